@@ -0,0 +1,54 @@
+# coding=utf-8
+# decode_throughput.py
+# Micro-benchmark: messages/second decoded by unpack_lifx_message for the
+# heaviest state messages, compared with building the same message through its
+# constructor (which packs the payload again, as the receive path used to).
+#
+# Usage: python benchmarks/decode_throughput.py [iterations]
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from lifxlan.message import HEADER_SIZE_BYTES
+from lifxlan.msgtypes import MSG_IDS, LightState, MultiZoneStateMultiZone, StateDeviceChain, StateTileEffect, StateTileState64
+from lifxlan.unpack import DECODERS, unpack_lifx_message
+
+MAC = "d0:73:d5:12:34:56"
+COLOR = (21845, 65535, 32768, 3500)
+TILE = {"reserved1": 0, "reserved2": 0, "reserved3": 0, "reserved4": 0, "user_x": 0.0, "user_y": 0.0,
+        "width": 8, "height": 8, "reserved5": 0, "device_version_vendor": 1, "device_version_product": 55,
+        "device_version_version": 10, "firmware_build": 1548977726000000000, "reserved6": 0,
+        "firmware_version": 3 << 16 | 50, "reserved7": 0}
+
+SAMPLES = [
+    (StateTileState64, {"tile_index": 0, "reserved": 0, "x": 0, "y": 0, "width": 8, "colors": [COLOR] * 64}),
+    (StateDeviceChain, {"start_index": 0, "total_count": 5, "tile_devices": [TILE] * 16}),
+    (MultiZoneStateMultiZone, {"count": 82, "index": 0, "color": [COLOR] * 8}),
+    (StateTileEffect, {"reserved1": 0, "instanceid": 1, "type": 2, "speed": 3000, "duration": 0, "reserved2": 0,
+                       "reserved3": 0, "parameters": [0] * 8, "palette_count": 16, "palette": [COLOR] * 16}),
+    (LightState, {"color": COLOR, "reserved1": 0, "power_level": 65535, "label": "Bench", "reserved2": 0}),
+]
+
+
+# decode the payload, then go through the constructor and its payload packing
+def decode_and_repack(msg_type, packed_message):
+    decoder = DECODERS[MSG_IDS[msg_type]][1]
+    return msg_type(MAC, 1, 0, decoder(packed_message, HEADER_SIZE_BYTES))
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    print("{:<26} {:>14} {:>14} {:>8}".format("message", "repack msg/s", "decode msg/s", "speedup"))
+    for msg_type, payload in SAMPLES:
+        packed_message = msg_type(MAC, 1, 0, payload).packed_message
+        repack_iterations = max(1, iterations // 20)
+        repack = repack_iterations / min(timeit.repeat(lambda: decode_and_repack(msg_type, packed_message), number=repack_iterations, repeat=3))
+        decode = iterations / min(timeit.repeat(lambda: unpack_lifx_message(packed_message), number=iterations, repeat=3))
+        print("{:<26} {:>14.0f} {:>14.0f} {:>7.1f}x".format(msg_type.__name__, repack, decode, decode / repack))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+# coding=utf-8
+# end_to_end.py
+# End-to-end benchmarks against the localhost emulator (tests/emulator.py):
+#
+#   discovery        LifxLAN.discover_devices wall time, per device count
+#   zone_reads       MultiZoneLight.get_color_zones latency, per strip size
+#   zone_writes      Group.set_zone_colors throughput, per device count, with
+#                    and without extended multizone
+#   tile_frames      TileChain.project_matrix frames per second
+#   group_skew       Group.set_color: time between the first and the last
+#                    light receiving its SetColor, per device count
+#
+# each at every loss rate. Results are printed as they come and written to a
+# JSON file ({"meta": {...}, "results": [...]}, one entry per benchmark, device
+# count and loss rate), to compare runs over time.
+#
+# Usage: python benchmarks/end_to_end.py [--devices 1,10,100,500] [--loss 0,0.01,0.05]
+#            [--only discovery,zone_reads] [--output end_to_end.json]
+# The devices and the library share the machine, so compare runs made on the
+# same one.
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tests"))
+
+import lifxlan
+import lifxlan.lifxlan as lifxlan_module
+from lifxlan import Group, LifxLAN, MultiZoneLight, TileChain, UDP_BROADCAST_IP_ADDRS
+from emulator import EMULATOR_IP_ADDR, EmulatedLight, EmulatedMultiZoneLight, EmulatedTileChain, Emulator, connect, emulated_mac
+from lifxlan.transport import Transport
+
+STRIP_SIZES = [8, 16, 32, 82, 120]
+COLOR = (21845, 65535, 32768, 3500)
+
+
+# Records when the first SetColor arrives (not its re-sends), for group_skew
+class TimedLight(EmulatedLight):
+    def __init__(self, mac_addr, **kwargs):
+        super(TimedLight, self).__init__(mac_addr, **kwargs)
+        self.set_color_time = None
+
+    def handle_LightSetColor(self, message):
+        if self.set_color_time == None:
+            self.set_color_time = time.time()
+        return super(TimedLight, self).handle_LightSetColor(message)
+
+
+def start_emulator(args, loss):
+    emulator = Emulator(port=0, latency=args.latency, jitter=args.jitter, loss=loss, seed=args.seed)
+    # the broadcasts of LifxLAN go to the emulator's discovery socket
+    lifxlan_module.UDP_BROADCAST_PORT = emulator.port
+    UDP_BROADCAST_IP_ADDRS.set_addrs([EMULATOR_IP_ADDR])
+    return emulator
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    if not samples:
+        return None
+    return {"count": len(samples),
+            "mean": sum(samples) / len(samples),
+            "p50": samples[len(samples) // 2],
+            "p95": samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+            "max": samples[-1]}
+
+
+def bench_discovery(args, devices, loss):
+    emulator = start_emulator(args, loss)
+    emulator.add_devices(EmulatedLight, devices)
+    emulator.start()
+    lan = LifxLAN(devices)
+    try:
+        start = time.time()
+        lan.discover_devices()
+        wall = time.time() - start
+        return {"wall_secs": wall, "found": len(lan.devices)}
+    finally:
+        lan.close()
+        emulator.close()
+
+
+def bench_zone_reads(args, zone_count, loss):
+    emulator = start_emulator(args, loss)
+    emulated = emulator.add_device(EmulatedMultiZoneLight(emulated_mac(1), zone_count=zone_count))
+    emulator.start()
+    transport = Transport()
+    strip = connect(MultiZoneLight, emulated, transport)
+    latencies = []
+    errors = 0
+    try:
+        for i in range(args.repeat):
+            start = time.time()
+            try:
+                strip.get_color_zones()
+            except lifxlan.WorkflowException:
+                errors += 1
+                continue
+            latencies.append(time.time() - start)
+        return {"zones": zone_count, "latency_secs": summarize(latencies), "errors": errors}
+    finally:
+        transport.close()
+        emulator.close()
+
+
+def bench_zone_writes(args, devices, loss, extended):
+    emulator = start_emulator(args, loss)
+    emulated = emulator.add_devices(EmulatedMultiZoneLight, devices, zone_count=args.zones, extended=extended)
+    emulator.start()
+    transport = Transport()
+    group = Group([connect(MultiZoneLight, e, transport) for e in emulated])
+    colors = [(zone * 500, 65535, 32768, 3500) for zone in range(args.zones)]
+    try:
+        group.set_zone_colors(colors) # learns which strips take extended multizone messages
+        writes = 0
+        errors = 0
+        start = time.time()
+        for i in range(args.writes):
+            try:
+                group.set_zone_colors(colors)
+                writes += 1
+            except lifxlan.WorkflowException:
+                errors += 1
+        wall = time.time() - start
+        return {"extended": extended, "zones": args.zones, "wall_secs": wall, "errors": errors,
+                "strips_per_sec": writes * devices / wall, "zones_per_sec": writes * devices * args.zones / wall}
+    finally:
+        transport.close()
+        emulator.close()
+
+
+def bench_tile_frames(args, loss, rapid):
+    emulator = start_emulator(args, loss)
+    emulated = emulator.add_device(EmulatedTileChain(emulated_mac(1)))
+    emulator.start()
+    transport = Transport()
+    tiles = connect(TileChain, emulated, transport)
+    (width, height) = tiles.get_canvas_dimensions()
+    errors = 0
+    try:
+        start = time.time()
+        for frame in range(args.frames):
+            matrix = [[((x + frame) * 1000 % 65536, 65535, 32768, 3500) for x in range(width)] for y in range(height)]
+            try:
+                tiles.project_matrix(matrix, rapid=rapid)
+            except lifxlan.WorkflowException:
+                errors += 1
+        # rapid frames only go into the device's send queue, the clock stops
+        # once the last of them is on the wire
+        while tiles.get_send_stats()["queued"] > 0:
+            time.sleep(0.001)
+        wall = time.time() - start
+        send_stats = tiles.get_send_stats()
+        return {"rapid": rapid, "tiles": len(emulated.tiles), "frames": args.frames, "wall_secs": wall,
+                "frames_per_sec": args.frames / wall, "errors": errors,
+                "rate_limit": send_stats["rate"], "burst": send_stats["burst"], "packets_sent": send_stats["sent"]}
+    finally:
+        transport.close()
+        emulator.close()
+
+
+def bench_group_skew(args, devices, loss):
+    emulator = start_emulator(args, loss)
+    emulated = emulator.add_devices(TimedLight, devices)
+    emulator.start()
+    transport = Transport()
+    group = Group([connect(lifxlan.Light, e, transport) for e in emulated])
+    skews = []
+    walls = []
+    errors = 0
+    try:
+        for i in range(args.repeat):
+            for e in emulated:
+                e.set_color_time = None
+            start = time.time()
+            try:
+                group.set_color(COLOR)
+            except lifxlan.WorkflowException:
+                errors += 1
+            walls.append(time.time() - start)
+            arrivals = [e.set_color_time for e in emulated if e.set_color_time != None]
+            if len(arrivals) == devices:
+                skews.append(max(arrivals) - min(arrivals))
+        return {"skew_secs": summarize(skews), "wall_secs": summarize(walls), "errors": errors}
+    finally:
+        transport.close()
+        emulator.close()
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def parse_list(value, convert):
+    return [convert(v) for v in value.split(",") if v != ""]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end benchmarks against the localhost emulator")
+    parser.add_argument("--devices", default="1,10,100,500", help="device counts, comma separated")
+    parser.add_argument("--loss", default="0,0.01,0.05", help="packet loss rates, comma separated")
+    parser.add_argument("--only", default="discovery,zone_reads,zone_writes,tile_frames,group_skew", help="benchmarks to run, comma separated")
+    parser.add_argument("--latency", type=float, default=0.002, help="one-way latency of the emulated devices, in seconds")
+    parser.add_argument("--jitter", type=float, default=0.001, help="latency jitter, in seconds")
+    parser.add_argument("--repeat", type=int, default=20, help="samples per zone_reads and group_skew measurement")
+    parser.add_argument("--writes", type=int, default=5, help="set_zone_colors calls per zone_writes measurement")
+    parser.add_argument("--zones", type=int, default=82, help="zones per strip in zone_writes")
+    parser.add_argument("--frames", type=int, default=50, help="frames per tile_frames measurement")
+    parser.add_argument("--seed", type=int, default=1, help="seed of the emulated packet loss and jitter")
+    parser.add_argument("--output", default="end_to_end.json", help="where to write the JSON results")
+    args = parser.parse_args()
+    device_counts = parse_list(args.devices, int)
+    loss_rates = parse_list(args.loss, float)
+    only = parse_list(args.only, str)
+
+    runs = []
+    for loss in loss_rates:
+        if "discovery" in only:
+            runs += [("discovery", {"devices": n, "loss": loss}, lambda n=n, loss=loss: bench_discovery(args, n, loss)) for n in device_counts]
+        if "zone_reads" in only:
+            runs += [("zone_reads", {"devices": 1, "loss": loss}, lambda z=z, loss=loss: bench_zone_reads(args, z, loss)) for z in STRIP_SIZES]
+        if "zone_writes" in only:
+            runs += [("zone_writes", {"devices": n, "loss": loss}, lambda n=n, loss=loss, x=x: bench_zone_writes(args, n, loss, x))
+                     for n in device_counts for x in (True, False)]
+        if "tile_frames" in only:
+            runs += [("tile_frames", {"devices": 1, "loss": loss}, lambda loss=loss, r=r: bench_tile_frames(args, loss, r)) for r in (False, True)]
+        if "group_skew" in only:
+            runs += [("group_skew", {"devices": n, "loss": loss}, lambda n=n, loss=loss: bench_group_skew(args, n, loss)) for n in device_counts]
+
+    results = []
+    for (name, params, run) in runs:
+        result = {"benchmark": name}
+        result.update(params)
+        result.update(run())
+        results.append(result)
+        print(json.dumps(result))
+        sys.stdout.flush()
+
+    meta = {"time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "lifxlan_version": lifxlan.__version__,
+            "git_commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "settings": vars(args)}
+    with open(args.output, "w") as f:
+        json.dump({"meta": meta, "results": results}, f, indent=2)
+    print("results written to " + args.output)
+
+
+if __name__ == "__main__":
+    main()
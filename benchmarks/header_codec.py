@@ -0,0 +1,68 @@
+# coding=utf-8
+# header_codec.py
+# Micro-benchmark: packets/second for building the 36-byte LIFX header with the
+# precompiled struct codec in message.py vs. the previous bitstring pipeline.
+#
+# Usage: python benchmarks/header_codec.py [iterations]
+# The legacy path needs bitstring (< 3.2) installed.
+
+import os
+import struct
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import bitstring
+
+from lifxlan.message import convert_MAC_to_int
+from lifxlan.msgtypes import MultiZoneGetColorZones
+
+MAC = "d0:73:d5:12:34:56"
+
+
+# The header path as it was before the struct codec, kept here as the reference.
+def little_endian(bs):
+    shifts = [i*8 for i in range(int(len(bs)/8))]
+    int_bytes_little_endian = [int(bs.uintbe >> i & 0xff) for i in shifts]
+    packed_message_little_endian = b""
+    for b in int_bytes_little_endian:
+        packed_message_little_endian += struct.pack("B", b)
+    return packed_message_little_endian
+
+def legacy_header(msg):
+    size = little_endian(bitstring.pack("16", msg.size))
+    flags = little_endian(bitstring.pack("2, 1, 1, 12", msg.origin, msg.tagged, msg.addressable, msg.protocol))
+    source_id = little_endian(bitstring.pack("32", msg.source_id))
+    mac_addr = little_endian(bitstring.pack("64", convert_MAC_to_int(msg.target_addr)))
+    reserved_48 = little_endian(bitstring.pack("48", 0))
+    response_flags = little_endian(bitstring.pack("6, 1, 1", 0, msg.ack_requested, msg.response_requested))
+    seq_num = little_endian(bitstring.pack("8", msg.seq_num))
+    reserved_64 = little_endian(bitstring.pack("64", 0))
+    message_type = little_endian(bitstring.pack("16", msg.message_type))
+    reserved_16 = little_endian(bitstring.pack("16", 0))
+    return size + flags + source_id + mac_addr + reserved_48 + response_flags + seq_num + reserved_64 + message_type + reserved_16
+
+
+def check_identical():
+    for target in (MAC, "00:00:00:00:00:00"):
+        for ack, res in ((False, False), (True, False), (False, True), (True, True)):
+            for seq in (0, 1, 255):
+                msg = MultiZoneGetColorZones(target, 0xdeadbeef, seq, {"start_index": 0, "end_index": 255}, ack, res)
+                assert msg.get_header() == legacy_header(msg), (target, ack, res, seq)
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    check_identical()
+    msg = MultiZoneGetColorZones(MAC, 0xdeadbeef, 7, {"start_index": 0, "end_index": 255}, False, True)
+    results = []
+    for name, fn in (("bitstring", lambda: legacy_header(msg)), ("struct", msg.get_header)):
+        seconds = min(timeit.repeat(fn, number=iterations, repeat=3))
+        results.append((name, iterations / seconds))
+        print("{:<10} {:>12.0f} headers/s".format(name, iterations / seconds))
+    print("speedup    {:>12.1f}x".format(results[1][1] / results[0][1]))
+
+
+if __name__ == "__main__":
+    main()
@@ -7,6 +7,11 @@ from .light import *
 from .multizonelight import *
 from .group import Group
 from .tilechain import TileChain, Tile
+from .transport import Transport
+from .asynctransport import AsyncTransport
+from .writequeue import WriteQueue
+from .broadcast import BroadcastAddrs, VIRTUAL_INTERFACES, get_broadcast_addrs
+from .tracing import ChromeTraceSubscriber, subscribe, unsubscribe
 from .utils import *
 
 __version__     = '1.2.5'
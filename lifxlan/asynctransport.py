@@ -0,0 +1,292 @@
+# coding=utf-8
+# asynctransport.py
+# The asyncio counterpart of transport.py, for the async_* methods of LifxLAN,
+# Device, Light and MultiZoneLight.
+#
+# An AsyncTransport is an asyncio DatagramProtocol: it sends and receives on
+# the event loop, so requests cost no threads. Otherwise it works like
+# Transport: rolling sequence numbers per target, given out when a request is
+# first sent, replies routed by (source_id, target
+# MAC, seq_num), up to max_in_flight requests per target on the wire with the
+# rest queued in order, the same RTT-based re-sends on timeout and the same
+# per-target token bucket pacing (with loop timers instead of a receiver
+# thread). submit() returns an asyncio future.
+#
+# Each event loop gets its own default transport (default_async_transport()).
+# A LifxLAN creates one on first async use and shares it with the devices its
+# async_discover_devices() finds.
+
+import asyncio
+from collections import deque
+from weakref import WeakKeyDictionary
+
+from .errors import WorkflowException
+from .packetlog import log_packet
+from .tracing import SUBSCRIBERS, instant
+from .transport import DEFAULT_BURST, DEFAULT_RATE_LIMIT, PendingRequest, QueuedPacket, SendQueue, TokenBucket, find_pending_request, next_seq_num, register_request
+from .unpack import unpack_lifx_message
+
+class AsyncTransport(asyncio.DatagramProtocol):
+    def __init__(self, rate_limit=DEFAULT_RATE_LIMIT, burst=DEFAULT_BURST):
+        self.rate_limit = rate_limit
+        self.burst = burst
+        self.endpoint = None # the asyncio DatagramTransport
+        self.loop = None
+        self.pending = {} # (source_id, seq_num) -> {target_addr: PendingRequest}
+        self.in_flight = {} # target_addr -> number of requests on the wire
+        self.waiting = {} # target_addr -> deque of PendingRequests not sent yet
+        self.timers = {} # PendingRequest -> TimerHandle of its current attempt
+        self.send_queues = {} # target_addr -> SendQueue
+        self.send_timer = None # TimerHandle of the next send_queued()
+        self.seq_nums = {} # target_addr -> last sequence number used
+        self.closed = False
+
+    ############################################################################
+    #                                                                          #
+    #                            Request Methods                               #
+    #                                                                          #
+    ############################################################################
+
+    # For packets that aren't waited on (requests get theirs in start)
+    def next_seq_num(self, source_id, target_addr):
+        return next_seq_num(self.pending, self.seq_nums, source_id, target_addr)
+
+    def create_future(self):
+        return self.loop.create_future()
+
+    # Sends request, or queues it if max_in_flight requests to the same target
+    # are already out (None for no limit). Returns its future, which must have
+    # been made with create_future().
+    def submit(self, request, max_in_flight=None):
+        if self.closed:
+            raise WorkflowException("WorkflowException: transport is closed")
+        request.future.add_done_callback(lambda future: self.complete(request) if future.cancelled() else None)
+        in_flight = self.in_flight.get(request.target_addr, 0)
+        if max_in_flight == None or in_flight < max_in_flight:
+            self.in_flight[request.target_addr] = in_flight + 1
+            self.start(request)
+        else:
+            self.waiting.setdefault(request.target_addr, deque()).append(request)
+        return request.future
+
+    def sendto(self, packet, addr):
+        self.endpoint.sendto(packet, addr)
+
+    # Sends packet to addrs as fire-and-forget, paced like the requests to
+    # target_addr. If it has to wait, a later packet with the same key (not
+    # None) replaces it, and it is dropped once it has waited timeout_secs
+    # (if not None).
+    def send(self, packet, addrs, target_addr, verbose=False, key=None, timeout_secs=None):
+        if self.closed:
+            raise WorkflowException("WorkflowException: transport is closed")
+        expires = None if timeout_secs == None else self.loop.time() + timeout_secs
+        if self.admit(target_addr, QueuedPacket(packet, addrs, verbose, key, expires)):
+            self.send_packet(packet, addrs, verbose)
+
+    def send_packet(self, packet, addrs, verbose=False):
+        for addr in addrs:
+            self.sendto(packet, addr)
+        log_packet("SEND", packet, verbose)
+
+    # Registers request on its first attempt and sends the attempt when its
+    # target's rate limit allows it.
+    def start(self, request):
+        if request.attempts == 0 and not register_request(self.pending, self.seq_nums, request):
+            self.complete(request, WorkflowException("WorkflowException: all sequence numbers to {} are in use".format(request.target_addr)))
+            return
+        if self.admit(request.target_addr, request):
+            self.transmit(request)
+
+    # Sends the next attempt of request and arms its timeout
+    def transmit(self, request):
+        timeout = request.next_attempt(self.loop.time())
+        self.timers[request] = self.loop.call_later(timeout, self.on_timeout, request)
+        try:
+            for addr in request.addrs:
+                self.sendto(request.packet, addr)
+        except Exception as err:
+            self.complete(request, err)
+            return
+        if SUBSCRIBERS:
+            instant("send", request.trace_args())
+        log_packet("SEND", request.packet, request.verbose)
+
+    def on_timeout(self, request):
+        self.timers.pop(request, None)
+        if request.done:
+            return
+        if request.can_retry(self.loop.time()):
+            self.start(request)
+        else:
+            self.complete(request)
+
+    # Unregisters request, resolves its future and sends the next request
+    # waiting for the same target, if any.
+    def complete(self, request, err=None):
+        if request.done:
+            return
+        request.done = True
+        timer = self.timers.pop(request, None)
+        if timer != None:
+            timer.cancel()
+        waiting = self.waiting.get(request.target_addr)
+        if waiting and request in waiting: # cancelled before it was sent
+            waiting.remove(request)
+            return
+        targets = self.pending.get((request.source_id, request.seq_num))
+        if targets != None and targets.get(request.target_addr) is request:
+            del targets[request.target_addr]
+            if len(targets) == 0:
+                del self.pending[(request.source_id, request.seq_num)]
+        if not request.future.done():
+            try:
+                if err != None:
+                    raise err
+                request.future.set_result(request.finish(request.responses))
+            except Exception as e:
+                request.future.set_exception(e)
+        if waiting:
+            self.start(waiting.popleft())
+        else:
+            self.in_flight[request.target_addr] -= 1
+            if self.in_flight[request.target_addr] == 0:
+                del self.in_flight[request.target_addr]
+
+    # True if item (a PendingRequest or a packet) may be sent to target_addr
+    # now, otherwise it is queued and send_queued() scheduled.
+    def admit(self, target_addr, item):
+        queue = self.send_queues.get(target_addr)
+        if queue == None:
+            queue = self.send_queues[target_addr] = SendQueue(self.rate_limit, self.burst)
+        if queue.admit(item, self.loop.time()):
+            return True
+        if len(queue.items) == 1: # the queue just started, its first item may be due before the timer
+            if self.send_timer != None:
+                self.send_timer.cancel()
+                self.send_timer = None
+            self.schedule_send(0)
+        return False
+
+    def schedule_send(self, delay):
+        if self.send_timer == None:
+            self.send_timer = self.loop.call_later(delay, self.send_queued)
+
+    # Sends the queued packets whose turn has come, and schedules itself again
+    # for the next one.
+    def send_queued(self):
+        self.send_timer = None
+        if self.closed:
+            return
+        now = self.loop.time()
+        wait = None
+        for queue in list(self.send_queues.values()):
+            items, delay = queue.pop_ready(now)
+            for item in items:
+                if isinstance(item, PendingRequest):
+                    self.transmit(item)
+                else:
+                    try:
+                        self.send_packet(item.packet, item.addrs, item.verbose)
+                    except Exception:
+                        pass # fire-and-forget
+            if delay != None:
+                wait = delay if wait == None else min(wait, delay)
+        if wait != None:
+            self.schedule_send(wait)
+
+    # Changes the pace of what is sent to target_addr: rate packets per second
+    # (None for no limit) after a burst of up to burst packets.
+    def set_rate_limit(self, target_addr, rate, burst=DEFAULT_BURST):
+        queue = self.send_queues.get(target_addr)
+        if queue == None:
+            queue = self.send_queues[target_addr] = SendQueue(rate, burst)
+        queue.bucket = TokenBucket(rate, burst)
+
+    # Send queue depth and counters for target_addr, as Transport.get_send_stats()
+    def get_send_stats(self, target_addr):
+        queue = self.send_queues.get(target_addr)
+        if queue == None:
+            queue = SendQueue(self.rate_limit, self.burst)
+        return queue.get_stats()
+
+    ############################################################################
+    #                                                                          #
+    #                            Protocol Methods                              #
+    #                                                                          #
+    ############################################################################
+
+    def connection_made(self, endpoint):
+        self.endpoint = endpoint
+
+    def datagram_received(self, data, addr):
+        try:
+            message = unpack_lifx_message(data, lazy=True)
+        except Exception: # not a LIFX packet
+            return
+        request = find_pending_request(self.pending, message)
+        if request == None or type(message) not in request.response_types:
+            return
+        message.ip_addr = addr[0]
+        if SUBSCRIBERS:
+            instant("receive", {"msg_type": type(message).__name__, "target": message.target_addr, "seq_num": message.seq_num})
+        log_packet("RECV", message, request.verbose)
+        timeout = request.add_response(message, self.loop.time())
+        try:
+            complete = request.is_complete(request.responses)
+        except Exception as err:
+            self.complete(request, err)
+            return
+        if complete:
+            self.complete(request)
+        else:
+            timer = self.timers.pop(request, None)
+            if timer != None:
+                timer.cancel()
+            self.timers[request] = self.loop.call_later(timeout, self.on_timeout, request)
+
+    def error_received(self, exc):
+        pass # e.g. ICMP port unreachable; the request times out and is re-sent
+
+    # Fails every request still pending or waiting
+    def connection_lost(self, exc):
+        self.closed = True
+        err = WorkflowException("WorkflowException: transport closed while waiting for a reply")
+        waiting_requests = [r for waiting in self.waiting.values() for r in waiting]
+        self.waiting = {}
+        for queue in self.send_queues.values():
+            queue.clear()
+        if self.send_timer != None:
+            self.send_timer.cancel()
+            self.send_timer = None
+        for targets in list(self.pending.values()):
+            for request in list(targets.values()):
+                self.complete(request, err)
+        for request in waiting_requests:
+            request.done = True
+            if not request.future.done():
+                request.future.set_exception(err)
+
+    def close(self):
+        if self.endpoint != None:
+            self.endpoint.close()
+
+# Opens an AsyncTransport on the running event loop
+async def open_async_transport():
+    loop = asyncio.get_running_loop()
+    endpoint, protocol = await loop.create_datagram_endpoint(AsyncTransport, local_addr=("0.0.0.0", 0), allow_broadcast=True)
+    protocol.loop = loop
+    return protocol
+
+DEFAULT_ASYNC_TRANSPORTS = WeakKeyDictionary() # event loop -> AsyncTransport
+
+# The transport used on the running event loop by devices that weren't given one
+async def default_async_transport():
+    loop = asyncio.get_running_loop()
+    transport = DEFAULT_ASYNC_TRANSPORTS.get(loop)
+    if transport == None or transport.closed:
+        transport = await open_async_transport()
+        if DEFAULT_ASYNC_TRANSPORTS.get(loop) != None and not DEFAULT_ASYNC_TRANSPORTS[loop].closed:
+            transport.close() # another task opened one while we were waiting
+            transport = DEFAULT_ASYNC_TRANSPORTS[loop]
+        DEFAULT_ASYNC_TRANSPORTS[loop] = transport
+    return transport
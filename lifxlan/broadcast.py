@@ -0,0 +1,106 @@
+# coding=utf-8
+# broadcast.py
+# The broadcast addresses that discovery and broadcast messages are sent to.
+#
+# UDP_BROADCAST_IP_ADDRS used to be a list worked out at import time from every
+# network interface, and never updated. It is now a BroadcastAddrs: it reads
+# the interfaces the first time it is used, reads them again once they are
+# older than ttl seconds (interfaces come and go, e.g. on laptops), and can
+# keep only the interfaces that pass include/exclude filters. It can be
+# iterated, indexed and len()'d like the list it replaces.
+#
+# By default every interface is used, as before: lights can be behind a bridge
+# (br0 or br-lan on a router, ...). To keep broadcasts away from subnets where
+# no light can be, exclude them:
+#
+#   UDP_BROADCAST_IP_ADDRS.set_interfaces(exclude=VIRTUAL_INTERFACES) # docker, libvirt...
+#   UDP_BROADCAST_IP_ADDRS.set_interfaces(include=["eth0", "wlan*"])
+#   UDP_BROADCAST_IP_ADDRS.set_addrs(["192.168.1.255"]) # no interface lookup at all
+
+from fnmatch import fnmatch
+from threading import Lock
+from time import time
+
+import netifaces as ni
+
+DEFAULT_BROADCAST_TTL = 60 # seconds
+VIRTUAL_INTERFACES = ["docker*", "br-*", "veth*", "virbr*"] # fnmatch patterns of container and VM networks
+FALLBACK_BROADCAST_ADDR = "255.255.255.255" # if no interface has a broadcast address
+
+# Broadcast addresses of the IPv4 interfaces whose name matches one of the
+# include patterns (any name if include is None) and none of the exclude ones
+def get_broadcast_addrs(include=None, exclude=None):
+    broadcast_addrs = []
+    for iface in ni.interfaces():
+        if include != None and not any(fnmatch(iface, pattern) for pattern in include):
+            continue
+        if exclude != None and any(fnmatch(iface, pattern) for pattern in exclude):
+            continue
+        try:
+            ifaddrs = ni.ifaddresses(iface)[ni.AF_INET]
+        except: # for interfaces that don't support ni.AF_INET
+            continue
+        for ifaddr in ifaddrs:
+            broadcast_addr = ifaddr.get("broadcast")
+            if ifaddr.get("addr") != "127.0.0.1" and broadcast_addr != None and broadcast_addr not in broadcast_addrs:
+                broadcast_addrs.append(broadcast_addr)
+    return broadcast_addrs
+
+class BroadcastAddrs(object):
+    def __init__(self, ttl=DEFAULT_BROADCAST_TTL, include=None, exclude=None):
+        self.ttl = ttl # None to never read the interfaces again
+        self.include = include
+        self.exclude = exclude
+        self.lock = Lock()
+        self.addrs = None
+        self.resolved_time = None
+        self.pinned = False
+
+    # The current addresses, reading the interfaces first if they never were
+    # or the last read is stale
+    def get(self):
+        with self.lock:
+            if self.addrs == None or (not self.pinned and self.ttl != None and time() - self.resolved_time > self.ttl):
+                self.resolve()
+            return self.addrs
+
+    # Called with the lock held
+    def resolve(self):
+        addrs = get_broadcast_addrs(self.include, self.exclude)
+        self.addrs = addrs if len(addrs) > 0 else [FALLBACK_BROADCAST_ADDR]
+        self.resolved_time = time()
+
+    # Reads the interfaces again on next use
+    def refresh(self):
+        with self.lock:
+            self.addrs = None
+            self.pinned = False
+
+    # include and exclude are lists of fnmatch patterns of interface names,
+    # include=None for all interfaces and exclude=None to exclude none.
+    def set_interfaces(self, include=None, exclude=None):
+        with self.lock:
+            self.include = include
+            self.exclude = exclude
+            self.addrs = None
+            self.pinned = False
+
+    # Uses addrs from now on, without looking at the interfaces
+    def set_addrs(self, addrs):
+        with self.lock:
+            self.addrs = list(addrs)
+            self.pinned = True
+
+    def __iter__(self):
+        return iter(self.get())
+
+    def __len__(self):
+        return len(self.get())
+
+    def __getitem__(self, index):
+        return self.get()[index]
+
+    def __repr__(self):
+        return repr(self.get())
+
+UDP_BROADCAST_IP_ADDRS = BroadcastAddrs()
@@ -19,44 +19,39 @@
 # per device, and also to capture in real time when a service is down (port = 0).
 
 from datetime import datetime
-from socket import AF_INET, SOCK_DGRAM, SOL_SOCKET, SO_BROADCAST, SO_REUSEADDR, socket, timeout, gethostbyname_ex, gethostname
-from time import sleep, time
-import platform
-import netifaces as ni
+from threading import local
 
+from .broadcast import UDP_BROADCAST_IP_ADDRS
 from .errors import WorkflowException
 from .msgtypes import Acknowledgement, GetGroup, GetHostFirmware, GetInfo, GetLabel, GetLocation, GetPower, GetVersion, \
     GetWifiFirmware, GetWifiInfo, SERVICE_IDS, SetLabel, SetPower, StateGroup, StateHostFirmware, StateInfo, StateLabel, \
     StateLocation, StatePower, StateVersion, StateWifiFirmware, StateWifiInfo, str_map
-from .message import BROADCAST_MAC
+from .packetlog import log_to_stdout
 from .products import features_map, product_map, light_products
-from .unpack import unpack_lifx_message
+from .stats import DeviceStats
+from .templates import freeze_payload, packet_templates
+from .tracing import SUBSCRIBERS, instant, trace_call
+from .asynctransport import default_async_transport
+from .transport import DEFAULT_BURST, PendingRequest, RTTEstimator, default_transport
+from .writequeue import WriteQueue
 
 DEFAULT_TIMEOUT = 1 #second
 DEFAULT_ATTEMPTS = 1
+DEFAULT_MAX_IN_FLIGHT = 3 # requests per device on the wire at once, see the pipelined workflow methods
 
 VERBOSE = False
 
-def get_broadcast_addrs():
-    broadcast_addrs = []
-    for iface in ni.interfaces():
-        try:
-            ifaddr = ni.ifaddresses(iface)[ni.AF_INET][0]
-            if ifaddr['addr'] != '127.0.0.1':
-                broadcast_addrs.append(ifaddr['broadcast'])
-        except: # for interfaces that don't support ni.AF_INET
-            pass
-    return broadcast_addrs
-
-UDP_BROADCAST_IP_ADDRS = get_broadcast_addrs()
 UDP_BROADCAST_PORT = 56700
 
 class Device(object):
     # mac_addr is a string, with the ":" and everything.
     # service is an integer that maps to a service type. See SERVICE_IDS in msgtypes.py
     # source_id is a number unique to this client, will appear in responses to this client
-    def __init__(self, mac_addr, ip_addr, service, port, source_id, verbose=False):
-        self.verbose = verbose
+    # transport is the Transport to send through, the process-wide default one if None
+    def __init__(self, mac_addr, ip_addr, service, port, source_id, verbose=False, transport=None):
+        self.verbose = verbose # log full packet dumps, see packetlog.py
+        if verbose:
+            log_to_stdout()
         self.mac_addr = mac_addr
         self.port = port
         self.service = service
@@ -94,10 +89,24 @@ class Device(object):
         # uptime
         # downtime
 
-        # The following attributes are used for handling multithreading requests
-
-        self.socket_counter = 0
-        self.socket_table = {}
+        # All packets go through the transport, which is shared with the other
+        # devices of the same LifxLAN (see transport.py)
+
+        self.transport = transport if transport != None else default_transport()
+        self.async_transport = None # set on first async use, see the async workflow methods
+        self.max_in_flight = DEFAULT_MAX_IN_FLIGHT
+        self.write_queue = WriteQueue() # see req_with_ack_coalesced
+        # Identical Get requests made while one is on the wire share it, and
+        # with a response_freshness_secs > 0, a response that came back at
+        # most that long ago is returned without asking again, unless a Set
+        # was sent since (see single_flight). Both work across the device
+        # objects of the same MAC that share a transport.
+        self.response_freshness_secs = 0
+        # Measured round trip times set the retransmission timeouts, and
+        # timeout_secs * max_attempts bounds the time a request may take (see
+        # PendingRequest). Set to None for fixed timeout_secs attempts.
+        self.rtt = RTTEstimator()
+        self.stats = DeviceStats() # see get_stats
 
 
     ############################################################################
@@ -454,108 +463,296 @@ class Device(object):
     ############################################################################
 
     # Don't wait for Acks or Responses, just send the same message repeatedly as fast as possible
-    def fire_and_forget(self, msg_type, payload={}, timeout_secs=DEFAULT_TIMEOUT, num_repeats=DEFAULT_ATTEMPTS):
-        socket_id = self.initialize_socket(timeout_secs)
-        sock = self.socket_table[socket_id]
-        msg = msg_type(self.mac_addr, self.source_id, seq_num=0, payload=payload, ack_requested=False, response_requested=False)
-        sent_msg_count = 0
-        sleep_interval = 0.05 if num_repeats > 20 else 0
-        while(sent_msg_count < num_repeats):
-            if self.ip_addr:
-                sock.sendto(msg.packed_message, (self.ip_addr, self.port))
-            else:
-                for ip_addr in UDP_BROADCAST_IP_ADDRS:
-                    sock.sendto(msg.packed_message, (ip_addr, self.port))
-            if self.verbose:
-                print("SEND: " + str(msg))
-            sent_msg_count += 1
-            sleep(sleep_interval) # Max num of messages device can handle is 20 per second.
-        self.close_socket(socket_id)
+    # Repeats are paced by the transport's rate limit (see transport.py), so
+    # this may return before they are all sent. Latest wins: a packet still
+    # waiting for its turn is replaced by the next one with the same msg_type
+    # and key (e.g. a zone range), so only the newest frame is sent. A packet
+    # that waited timeout_secs without being sent is dropped, it's too late.
+    def fire_and_forget(self, msg_type, payload={}, timeout_secs=DEFAULT_TIMEOUT, num_repeats=DEFAULT_ATTEMPTS, key=None):
+        if SUBSCRIBERS:
+            instant("fire_and_forget", self.trace_args(msg_type, {"num_repeats": num_repeats}))
+        self.forget_fresh_responses()
+        self.stats.for_message(msg_type).sent += num_repeats
+        packet = packet_templates.get_packet(msg_type, self.mac_addr, self.source_id, self.transport.next_seq_num(self.source_id, self.mac_addr), payload, ack_requested=False, response_requested=False)
+        for i in range(num_repeats):
+            self.send_packet(packet, (msg_type, key), timeout_secs)
 
     # Usually used for Set messages
+    # Inside an AckBatch block, returns without waiting for the ack.
     def req_with_ack(self, msg_type, payload, timeout_secs=DEFAULT_TIMEOUT, max_attempts=DEFAULT_ATTEMPTS):
-        self.req_with_resp(msg_type, Acknowledgement, payload, timeout_secs, max_attempts)
+        if SUBSCRIBERS:
+            return trace_call("req_with_ack", self.trace_args(msg_type), lambda: wait_for_acks([self.req_with_ack_future(msg_type, payload, timeout_secs, max_attempts)]))
+        wait_for_acks([self.req_with_ack_future(msg_type, payload, timeout_secs, max_attempts)])
+
+    # For Set messages sent faster than the device acks them, e.g. from a
+    # slider: see req_with_ack_coalesced_future
+    def req_with_ack_coalesced(self, msg_type, payload, key=None, timeout_secs=DEFAULT_TIMEOUT, max_attempts=DEFAULT_ATTEMPTS):
+        self.req_with_ack_coalesced_future(msg_type, payload, key, timeout_secs, max_attempts).result()
 
     # Usually used for Get messages, or for state confirmation after Set (hence the optional payload)
     def req_with_resp(self, msg_type, response_type, payload={}, timeout_secs=DEFAULT_TIMEOUT, max_attempts=DEFAULT_ATTEMPTS):
-        # Need to put error checking here for aguments
+        if SUBSCRIBERS:
+            return trace_call("req_with_resp", self.trace_args(msg_type), lambda: self.req_with_resp_future(msg_type, response_type, payload, timeout_secs, max_attempts).result())
+        return self.req_with_resp_future(msg_type, response_type, payload, timeout_secs, max_attempts).result()
+
+    # For Get messages that the device answers with several packets (e.g. GetColorZones
+    # over a whole strip). Sends the request once and keeps collecting matching
+    # responses until is_complete(responses) returns True. The request is re-sent
+    # if an attempt times out. Returns whatever was collected, which may be
+    # incomplete if max_attempts ran out; raises WorkflowException if nothing came back.
+    # With ack_and_resp, an Acknowledgement is asked for as well, as in req_with_ack_resp.
+    # With resend_partial=False, it isn't re-sent once some responses came (see
+    # PendingRequest), the caller asks for what is missing.
+    def req_with_multi_resp(self, msg_type, response_type, payload={}, is_complete=None, timeout_secs=DEFAULT_TIMEOUT, max_attempts=DEFAULT_ATTEMPTS, ack_and_resp=False, resend_partial=True):
+        if SUBSCRIBERS:
+            return trace_call("req_with_multi_resp", self.trace_args(msg_type), lambda: self.submit_request(msg_type, response_type, payload, is_complete, None, timeout_secs, max_attempts, ack_and_resp, resend_partial).result())
+        return self.submit_request(msg_type, response_type, payload, is_complete, None, timeout_secs, max_attempts, ack_and_resp, resend_partial).result()
+
+    # Usually used for Set messages whose resulting state you want back: asks for
+    # both an Acknowledgement and a response in the same exchange and returns the
+    # response (e.g. LightState for LightSetColor). The state is what the device
+    # reports as it handles the Set.
+    def req_with_ack_resp(self, msg_type, response_type, payload, timeout_secs=DEFAULT_TIMEOUT, max_attempts=DEFAULT_ATTEMPTS):
+        if SUBSCRIBERS:
+            return trace_call("req_with_ack_resp", self.trace_args(msg_type), lambda: self.req_with_ack_resp_future(msg_type, response_type, payload, timeout_secs, max_attempts).result())
+        return self.req_with_ack_resp_future(msg_type, response_type, payload, timeout_secs, max_attempts).result()
+
+    # span arguments for the tracing hooks (see tracing.py)
+    def trace_args(self, msg_type, extra=None):
+        args = {"msg_type": msg_type.__name__, "target": self.mac_addr, "ip_addr": self.ip_addr}
+        if extra != None:
+            args.update(extra)
+        return args
+
+    ############################################################################
+    #                                                                          #
+    #                       Pipelined Workflow Methods                         #
+    #                                                                          #
+    ############################################################################
+
+    # These return a concurrent.futures.Future instead of waiting for the reply,
+    # so several requests to the same device can be on the wire at once, e.g.
+    #
+    #   futures = [light.req_with_ack_future(MultiZoneSetColorZones, p) for p in payloads]
+    #   results = [f.result() for f in futures]
+    #
+    # Up to max_in_flight requests per device are sent at a time, the rest are
+    # queued in order. A future raises WorkflowException if its request got no reply.
+
+    # The future's result is the Acknowledgement
+    def req_with_ack_future(self, msg_type, payload, timeout_secs=DEFAULT_TIMEOUT, max_attempts=DEFAULT_ATTEMPTS):
+        return self.req_with_resp_future(msg_type, Acknowledgement, payload, timeout_secs, max_attempts)
+
+    # The future's result is the first matching response. Get requests
+    # identical to one already on the wire share its future (see single_flight).
+    def req_with_resp_future(self, msg_type, response_type, payload={}, timeout_secs=DEFAULT_TIMEOUT, max_attempts=DEFAULT_ATTEMPTS):
+        submit = lambda: self.submit_request(msg_type, response_type, payload, None, lambda responses: responses[0], timeout_secs, max_attempts)
+        if not is_get_message(msg_type):
+            return submit()
+        try:
+            key = (msg_type, response_type if type(response_type) != type([]) else tuple(response_type), freeze_payload(payload))
+        except TypeError: # unhashable payload value
+            return submit()
+        return self.single_flight(key, submit)
+
+    # Single-flight requests: if a request to this device with the same key
+    # is on the wire, returns its future instead of calling submit() to send
+    # another one. With response_freshness_secs > 0, a result received at most
+    # that long ago is returned right away. The table is the transport's (see
+    # SharedGets), so other device objects for the same MAC share it. Results
+    # are shared between callers, so they must not be modified.
+    def single_flight(self, key, submit):
+        return self.transport.shared_gets.single_flight(self.mac_addr, key, submit, self.response_freshness_secs)
+
+    # The future of a request with this key on the wire or of a fresh result
+    # (see single_flight), None if there is neither
+    def shared_get(self, key):
+        return self.transport.shared_gets.get(self.mac_addr, key, self.response_freshness_secs)
+
+    # Called whenever something that may change the device's state is sent
+    def forget_fresh_responses(self):
+        self.transport.shared_gets.forget(self.mac_addr)
+
+    # The future's result is the response, see req_with_ack_resp
+    def req_with_ack_resp_future(self, msg_type, response_type, payload, timeout_secs=DEFAULT_TIMEOUT, max_attempts=DEFAULT_ATTEMPTS):
+        return self.submit_request(msg_type, response_type, payload, None, lambda responses: responses[0], timeout_secs, max_attempts, ack_and_resp=True)
+
+    # Latest-wins write (see writequeue.py): while a write with the same
+    # msg_type and key (e.g. a zone range) is waiting for its ack, only the
+    # newest write following it is kept, the others are dropped. The future
+    # of a dropped write resolves with the outcome of the one that replaced it.
+    def req_with_ack_coalesced_future(self, msg_type, payload, key=None, timeout_secs=DEFAULT_TIMEOUT, max_attempts=DEFAULT_ATTEMPTS):
+        return self.write_queue.submit((msg_type, key), lambda: self.req_with_ack_future(msg_type, payload, timeout_secs, max_attempts))
+
+    # Builds the request and hands it to the transport. The future's result is
+    # result(responses), or the list of responses if result is None.
+    def submit_request(self, msg_type, response_type, payload={}, is_complete=None, result=None, timeout_secs=DEFAULT_TIMEOUT, max_attempts=DEFAULT_ATTEMPTS, ack_and_resp=False, resend_partial=True):
+        if not is_get_message(msg_type):
+            self.forget_fresh_responses()
+        request = self.build_request(self.transport, msg_type, response_type, payload, is_complete, result, timeout_secs, max_attempts, None, ack_and_resp, resend_partial)
+        return self.transport.submit(request, self.max_in_flight)
+
+    # With ack_and_resp, both ack_requested and response_requested are set.
+    # The Acknowledgement is then accepted along with the responses but left
+    # out of the list that is_complete and result see.
+    def build_request(self, transport, msg_type, response_type, payload={}, is_complete=None, result=None, timeout_secs=DEFAULT_TIMEOUT, max_attempts=DEFAULT_ATTEMPTS, future=None, ack_and_resp=False, resend_partial=True):
         if type(response_type) != type([]):
             response_type = [response_type]
-        success = False
-        device_response = None
-        socket_id = self.initialize_socket(timeout_secs)
-        sock = self.socket_table[socket_id]
-        if len(response_type) == 1 and Acknowledgement in response_type:
-            msg = msg_type(self.mac_addr, self.source_id, seq_num=0, payload=payload, ack_requested=True, response_requested=False)
+        if is_complete == None:
+            is_complete = lambda responses: len(responses) > 0
+        seq_num = 0 # the transport picks one when it sends the request
+        if ack_and_resp:
+            packet = packet_templates.get_packet(msg_type, self.mac_addr, self.source_id, seq_num, payload, ack_requested=True, response_requested=True)
+        elif len(response_type) == 1 and Acknowledgement in response_type:
+            packet = packet_templates.get_packet(msg_type, self.mac_addr, self.source_id, seq_num, payload, ack_requested=True, response_requested=False)
         else:
-            msg = msg_type(self.mac_addr, self.source_id, seq_num=0, payload=payload, ack_requested=False, response_requested=True)
-        response_seen = False
-        attempts = 0
-        while not response_seen and attempts < max_attempts:
-            sent = False
-            start_time = time()
-            timedout = False
-            while not response_seen and not timedout:
-                if not sent:
-                    if self.ip_addr:
-                        sock.sendto(msg.packed_message, (self.ip_addr, self.port))
-                    else:
-                        for ip_addr in UDP_BROADCAST_IP_ADDRS:
-                            sock.sendto(msg.packed_message, (ip_addr, self.port))
-                    sent = True
-                    if self.verbose:
-                        print("SEND: " + str(msg))
-                try:
-                    data, (ip_addr, port) = sock.recvfrom(1024)
-                    response = unpack_lifx_message(data)
-                    if self.verbose:
-                        print("RECV: " + str(response))
-                    if type(response) in response_type:
-                        if response.source_id == self.source_id and (response.target_addr == self.mac_addr or response.target_addr == BROADCAST_MAC):
-                            response_seen = True
-                            device_response = response
-                            self.ip_addr = ip_addr
-                            success = True
-                except timeout:
-                    pass
-                elapsed_time = time() - start_time
-                timedout = True if elapsed_time > timeout_secs else False
-            attempts += 1
-        if not success:
-            self.close_socket(socket_id)
-            raise WorkflowException("WorkflowException: Did not receive {} from {} (Name: {}) in response to {}".format(str(response_type), str(self.mac_addr), str(self.label), str(msg_type)))
-        else:
-            self.close_socket(socket_id)
-        return device_response
-
-    # Not currently implemented, although the LIFX LAN protocol supports this kind of workflow natively
-    def req_with_ack_resp(self, msg_type, response_type, payload, timeout_secs=DEFAULT_TIMEOUT, max_attempts=DEFAULT_ATTEMPTS):
-        pass
+            packet = packet_templates.get_packet(msg_type, self.mac_addr, self.source_id, seq_num, payload, ack_requested=False, response_requested=True)
+        accepted_types = response_type
+        if ack_and_resp and Acknowledgement not in response_type:
+            accepted_types = response_type + [Acknowledgement]
+            states_complete = is_complete
+            is_complete = lambda responses: type(responses[-1]) != Acknowledgement and states_complete(without_acks(responses))
+        def finish(responses):
+            if accepted_types is not response_type:
+                responses = without_acks(responses)
+            if len(responses) == 0:
+                raise WorkflowException("WorkflowException: Did not receive {} from {} (Name: {}) in response to {}".format(str(response_type), str(self.mac_addr), str(self.label), str(msg_type)))
+            self.ip_addr = responses[-1].ip_addr
+            return result(responses) if result != None else responses
+        return PendingRequest(packet, self.get_addrs(), self.source_id, self.mac_addr, seq_num, accepted_types, is_complete, finish, timeout_secs, max_attempts, self.verbose, future, self.rtt, self.stats.for_message(msg_type), resend_partial)
+
+    # Where packets for the device go: its IP address if known, broadcast otherwise
+    def get_addrs(self):
+        if self.ip_addr:
+            return [(self.ip_addr, self.port)]
+        return [(ip_addr, self.port) for ip_addr in UDP_BROADCAST_IP_ADDRS]
 
     ############################################################################
     #                                                                          #
-    #                              Socket Methods                              #
+    #                          Async Workflow Methods                          #
     #                                                                          #
     ############################################################################
 
-    def initialize_socket(self, timeout):
-        sock = socket(AF_INET, SOCK_DGRAM)
-        sock.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
-        sock.setsockopt(SOL_SOCKET, SO_BROADCAST, 1)
-        sock.settimeout(timeout)
-        try:
-            sock.bind(("", 0))  # allow OS to assign next available source port
-            socket_id = self.socket_counter
-            self.socket_table[socket_id] = sock
-            self.socket_counter += 1
-            return socket_id
-        except Exception as err:
-            raise WorkflowException("WorkflowException: error {} while trying to open socket".format(str(err)))
-
-    def close_socket(self, socket_id):
-        sock = self.socket_table.pop(socket_id, None)
-        if sock != None:
-            sock.close()
+    # Coroutine versions of the workflow methods, for use on an asyncio event
+    # loop. They go through an AsyncTransport (asynctransport.py) and never
+    # block or start threads.
+
+    async def async_fire_and_forget(self, msg_type, payload={}, timeout_secs=DEFAULT_TIMEOUT, num_repeats=DEFAULT_ATTEMPTS, key=None):
+        if self.async_transport == None:
+            self.async_transport = await default_async_transport()
+        self.stats.for_message(msg_type).sent += num_repeats
+        packet = packet_templates.get_packet(msg_type, self.mac_addr, self.source_id, self.async_transport.next_seq_num(self.source_id, self.mac_addr), payload, ack_requested=False, response_requested=False)
+        for i in range(num_repeats):
+            self.async_transport.send(packet, self.get_addrs(), self.mac_addr, self.verbose, (msg_type, key), timeout_secs)
+
+    async def async_req_with_ack(self, msg_type, payload, timeout_secs=DEFAULT_TIMEOUT, max_attempts=DEFAULT_ATTEMPTS):
+        await self.async_req_with_resp(msg_type, Acknowledgement, payload, timeout_secs, max_attempts)
+
+    async def async_req_with_resp(self, msg_type, response_type, payload={}, timeout_secs=DEFAULT_TIMEOUT, max_attempts=DEFAULT_ATTEMPTS):
+        return await self.async_submit_request(msg_type, response_type, payload, None, lambda responses: responses[0], timeout_secs, max_attempts)
+
+    async def async_req_with_multi_resp(self, msg_type, response_type, payload={}, is_complete=None, timeout_secs=DEFAULT_TIMEOUT, max_attempts=DEFAULT_ATTEMPTS, ack_and_resp=False, resend_partial=True):
+        return await self.async_submit_request(msg_type, response_type, payload, is_complete, None, timeout_secs, max_attempts, ack_and_resp, resend_partial)
+
+    async def async_req_with_ack_resp(self, msg_type, response_type, payload, timeout_secs=DEFAULT_TIMEOUT, max_attempts=DEFAULT_ATTEMPTS):
+        return await self.async_submit_request(msg_type, response_type, payload, None, lambda responses: responses[0], timeout_secs, max_attempts, ack_and_resp=True)
+
+    async def async_submit_request(self, msg_type, response_type, payload={}, is_complete=None, result=None, timeout_secs=DEFAULT_TIMEOUT, max_attempts=DEFAULT_ATTEMPTS, ack_and_resp=False, resend_partial=True):
+        if self.async_transport == None:
+            self.async_transport = await default_async_transport()
+        transport = self.async_transport
+        request = self.build_request(transport, msg_type, response_type, payload, is_complete, result, timeout_secs, max_attempts, transport.create_future(), ack_and_resp, resend_partial)
+        return await transport.submit(request, self.max_in_flight)
+
+    # Sends packet to the device, or broadcasts it if the IP address is unknown.
+    # key, timeout_secs: see Transport.send
+    def send_packet(self, packet, key=None, timeout_secs=None):
+        self.transport.send(packet, self.get_addrs(), self.mac_addr, self.verbose, key, timeout_secs)
+
+    # Everything sent to the device is paced to rate packets per second (None
+    # for no limit) after a burst of up to burst packets, to stay within what
+    # the firmware handles. The default is 20 per second.
+    def set_rate_limit(self, rate, burst=DEFAULT_BURST):
+        self.transport.set_rate_limit(self.mac_addr, rate, burst)
+        if self.async_transport != None:
+            self.async_transport.set_rate_limit(self.mac_addr, rate, burst)
+
+    # Snapshot of what was sent to and received from the device:
+    #   {"total": counts, "messages": {message type name: counts}, "send_queue": get_send_stats()}
+    # where counts are sent, retransmits, received, timeouts (requests that
+    # ran out of time) and the round trip times of first replies: rtt_count,
+    # rtt_mean, rtt_p50, rtt_p95 and rtt_p99 (upper bounds of histogram
+    # buckets, see stats.py), in seconds.
+    def get_stats(self):
+        stats = self.stats.snapshot()
+        stats["send_queue"] = self.get_send_stats()
+        return stats
+
+    def reset_stats(self):
+        self.stats.reset()
+
+    # Counters of the device's send queue on the transport: rate, burst,
+    # queued (packets waiting now), max_queued, sent, throttled (sent after
+    # waiting for the rate limit), superseded, dropped and expired
+    # (fire-and-forget packets replaced by a newer one, dropped from a full
+    # queue, or dropped after waiting longer than their timeout_secs), plus
+    # elided (coalesced writes dropped because a newer one replaced them).
+    def get_send_stats(self):
+        stats = self.transport.get_send_stats(self.mac_addr)
+        stats["elided"] = self.write_queue.elided
+        return stats
+
+# Get messages are safe to share between callers (see single_flight), Set
+# messages are not
+def is_get_message(msg_type):
+    return "Get" in msg_type.__name__
+
+ACK_BATCHES = local() # .stack: the AckBatches the current thread is in
+
+# Fan-out without threads (see Group): inside a "with AckBatch():" block, the
+# req_with_ack calls made by the current thread send their request and return
+# right away, so many devices can be set at once from one thread. The block
+# waits for all the acks when it ends, and raises the first error if any.
+# Given a list, errors, it adds every error to it instead of raising.
+class AckBatch(object):
+    def __init__(self, errors=None):
+        self.futures = []
+        self.errors = errors
+
+    def __enter__(self):
+        if not hasattr(ACK_BATCHES, "stack"):
+            ACK_BATCHES.stack = []
+        ACK_BATCHES.stack.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        ACK_BATCHES.stack.pop()
+        error = None
+        for future in self.futures:
+            try:
+                future.result()
+            except Exception as e:
+                if self.errors != None:
+                    self.errors.append(e)
+                elif error == None:
+                    error = e
+        if error != None and exc_type == None:
+            raise error
+        return False
+
+# Waits for the futures of acks, or leaves them to the current thread's
+# AckBatch if there is one
+def wait_for_acks(futures):
+    stack = getattr(ACK_BATCHES, "stack", None)
+    if stack:
+        stack[-1].futures.extend(futures)
+    else:
+        for future in futures:
+            future.result()
+
+# the responses of an ack_and_resp request, minus the Acknowledgement
+def without_acks(responses):
+    return [r for r in responses if type(r) != Acknowledgement]
 
 ################################################################################
 #                                                                              #
@@ -1,13 +1,16 @@
-#import thread
-from threading import Thread
 from time import sleep
 import sys
 
+from .device import AckBatch
+from .errors import WorkflowException
+from .msgtypes import GetHostFirmware, GetVersion, LightGet, LightState, StateHostFirmware, StateVersion
+
 class Group(object):
 
     def __init__(self, devices=[], verbose=False):
         self.devices = devices
         self.verbose = verbose
+        self.errors = [] # WorkflowExceptions of the devices that failed in the last set call
 
     def add_device(self, device_object):
         self.devices.append(device_object)
@@ -29,14 +32,21 @@ class Group(object):
     def get_device_list(self):
         return self.devices
 
+    # The set methods send to every device from the calling thread and wait
+    # for all the acks at the end (see AckBatch), so the devices change at
+    # about the same time without a thread per device.
+    #
+    # They are best effort, as when each device had a thread of its own: a
+    # device that fails (no ack, or no reply to what is asked first) doesn't
+    # stop the others. Its WorkflowException is added to self.errors, which
+    # every set call starts afresh, instead of being raised.
+
     def set_power(self, power, duration=0, rapid=False):
-        threads = []
-        for d in self.devices:
-            t = Thread(target = self.set_power_helper, args = (d, power, duration, rapid))
-            threads.append(t)
-            t.start()
-        for t in threads:
-            t.join()
+        self.errors = []
+        devices = self.get_versions(self.devices) # for is_light()
+        with AckBatch(self.errors):
+            for d in devices:
+                self.best_effort(self.set_power_helper, d, power, duration, rapid)
 
     def set_power_helper(self, device, power, duration, rapid):
         if device.is_light():
@@ -47,155 +57,167 @@ class Group(object):
     def set_color(self, color, duration=0, rapid=False):
         # pre-calculate which devices you'll operate on
         # it'll make the color change look more simultaneous
+        self.errors = []
         color_supporting_devices = []
         for d in self.devices:
             if d.supports_color:
                 color_supporting_devices.append(d)
-        # multi-threaded color change
-        threads = []
-        for d in color_supporting_devices:
-            t = Thread(target = d.set_color, args = (color, duration, rapid))
-            threads.append(t)
-            t.start()
-        for t in threads:
-            t.join()
+        with AckBatch(self.errors):
+            for d in color_supporting_devices:
+                self.best_effort(d.set_color, color, duration, rapid)
 
     # Hue, saturation, brightness, and colortemp are a little different than the
-    # other functions. You can't just spawn a new thread with "set_saturation"
-    # or whatever for each device, because each command will first request the
-    # current color from the bulbs, which will take different amounts of time to
-    # receive, which makes the color change take different amounts for each
-    # bulb. So basically you gotta get all the colors up front and then make
-    # a set_color() call for each bulb.
+    # other functions. You can't just call "set_saturation" or whatever for each
+    # device, because each command will first request the current color from
+    # the bulbs, which will take different amounts of time to receive, which
+    # makes the color change take different amounts for each bulb. So basically
+    # you gotta get all the colors up front and then make a set_color() call for
+    # each bulb.
 
     def set_hue(self, hue, duration=0, rapid=False):
+        self.errors = []
         # pre-calculate which devices to operate on
         color_supporting_devices = []
         for d in self.devices:
             if d.supports_color:
                 color_supporting_devices.append(d)
-        # get colors
-        colors = []
-        for d in color_supporting_devices:
-            colors.append(d.get_color())
+        colors = self.get_colors(color_supporting_devices)
         # "simultaneous" change
-        threads = []
-        for (i, d) in enumerate(color_supporting_devices):
-            _, saturation, brightness, kelvin = colors[i]
-            color = [hue, saturation, brightness, kelvin]
-            t = Thread(target = d.set_color, args = (color, duration, rapid))
-            threads.append(t)
-            t.start()
-        for t in threads:
-            t.join()
+        with AckBatch(self.errors):
+            for (i, d) in enumerate(color_supporting_devices):
+                if colors[i] == None: # didn't answer
+                    continue
+                _, saturation, brightness, kelvin = colors[i]
+                color = [hue, saturation, brightness, kelvin]
+                self.best_effort(d.set_color, color, duration, rapid)
 
     def set_brightness(self, brightness, duration=0, rapid=False):
+        self.errors = []
         # pre-calculate which devices to operate on
         color_supporting_devices = []
         for d in self.devices:
             if d.supports_color:
                 color_supporting_devices.append(d)
-        # get colors
-        colors = []
-        for d in color_supporting_devices:
-            colors.append(d.get_color())
+        colors = self.get_colors(color_supporting_devices)
         # "simultaneous" change
-        threads = []
-        for (i, d) in enumerate(color_supporting_devices):
-            hue, saturation, _, kelvin = colors[i]
-            color = [hue, saturation, brightness, kelvin]
-            t = Thread(target = d.set_color, args = (color, duration, rapid))
-            threads.append(t)
-            t.start()
-        for t in threads:
-            t.join()
+        with AckBatch(self.errors):
+            for (i, d) in enumerate(color_supporting_devices):
+                if colors[i] == None: # didn't answer
+                    continue
+                hue, saturation, _, kelvin = colors[i]
+                color = [hue, saturation, brightness, kelvin]
+                self.best_effort(d.set_color, color, duration, rapid)
 
     def set_saturation(self, saturation, duration=0, rapid=False):
+        self.errors = []
         # pre-calculate which devices to operate on
         color_supporting_devices = []
         for d in self.devices:
             if d.supports_color:
                 color_supporting_devices.append(d)
-        # get colors
-        colors = []
-        for d in color_supporting_devices:
-            colors.append(d.get_color())
+        colors = self.get_colors(color_supporting_devices)
         # "simultaneous" change
-        threads = []
-        for (i, d) in enumerate(color_supporting_devices):
-            hue, _, brightness, kelvin = colors[i]
-            color = [hue, saturation, brightness, kelvin]
-            t = Thread(target = d.set_color, args = (color, duration, rapid))
-            threads.append(t)
-            t.start()
-        for t in threads:
-            t.join()
+        with AckBatch(self.errors):
+            for (i, d) in enumerate(color_supporting_devices):
+                if colors[i] == None: # didn't answer
+                    continue
+                hue, _, brightness, kelvin = colors[i]
+                color = [hue, saturation, brightness, kelvin]
+                self.best_effort(d.set_color, color, duration, rapid)
 
     def set_colortemp(self, kelvin, duration=0, rapid=False):
+        self.errors = []
         # pre-calculate which devices to operate on
         color_supporting_devices = []
         for d in self.devices:
             if d.supports_color:
                 color_supporting_devices.append(d)
-        # get colors
-        colors = []
-        for d in color_supporting_devices:
-            colors.append(d.get_color())
+        colors = self.get_colors(color_supporting_devices)
         # "simultaneous" change
-        threads = []
-        for (i, d) in enumerate(color_supporting_devices):
-            hue, saturation, brightness, _ = colors[i]
-            color = [hue, saturation, brightness, kelvin]
-            t = Thread(target = d.set_color, args = (color, duration, rapid))
-            threads.append(t)
-            t.start()
-        for t in threads:
-            t.join()
+        with AckBatch(self.errors):
+            for (i, d) in enumerate(color_supporting_devices):
+                if colors[i] == None: # didn't answer
+                    continue
+                hue, saturation, brightness, _ = colors[i]
+                color = [hue, saturation, brightness, kelvin]
+                self.best_effort(d.set_color, color, duration, rapid)
 
     def set_infrared(self, infrared_brightness):
+        self.errors = []
         # pre-calculate which devices to operate on
         infrared_supporting_devices = []
-        for d in self.devices:
+        for d in self.get_versions(self.devices):
             if d.supports_infrared():
                 infrared_supporting_devices.append(d)
         # "simultaneous" change
-        threads = []
-        for d in infrared_supporting_devices:
-            t = Thread(target = d.set_infrared, args = (infrared_brightness))
-            threads.append(t)
-            t.start()
-        for t in threads:
-            t.join()
+        with AckBatch(self.errors):
+            for d in infrared_supporting_devices:
+                self.best_effort(d.set_infrared, infrared_brightness)
 
     def set_zone_color(self, start, end, color, duration=0, rapid=False, apply=1):
+        self.errors = []
         # pre-calculate which devices to operate on
         multizone_devices = []
-        for d in self.devices:
+        for d in self.get_versions(self.devices):
             if d.supports_multizone():
                 multizone_devices.append(d)
         # "simultaneous" change
-        threads = []
-        for d in multizone_devices:
-            t = Thread(target = d.set_zone_color, args = (start, end, color, duration, rapid, apply))
-            threads.append(t)
-            t.start()
-        for t in threads:
-            t.join()
+        with AckBatch(self.errors):
+            for d in multizone_devices:
+                self.best_effort(d.set_zone_color, start, end, color, duration, rapid, apply)
 
     def set_zone_colors(self, colors, duration=0, rapid=False):
+        self.errors = []
         # pre-calculate which devices to operate on
         multizone_devices = []
-        for d in self.devices:
+        for d in self.get_versions(self.devices):
             if d.supports_multizone():
                 multizone_devices.append(d)
+        # which devices take extended multizone messages, asked all at once
+        unknown = [d for d in multizone_devices if d.extended_multizone == None]
+        futures = [d.req_with_resp_future(GetHostFirmware, StateHostFirmware) for d in unknown]
+        for (d, future) in zip(unknown, futures):
+            response = self.best_effort(future.result)
+            if response == None:
+                multizone_devices.remove(d)
+            else:
+                d.update_extended_multizone(response)
         # "simultaneous" change
-        threads = []
-        for d in multizone_devices:
-            t = Thread(target = d.set_zone_colors, args = (colors, duration, rapid, apply))
-            threads.append(t)
-            t.start()
-        for t in threads:
-            t.join()
+        with AckBatch(self.errors):
+            for d in multizone_devices:
+                self.best_effort(d.set_zone_colors, colors, duration, rapid)
+
+    # Returns call(*args), or None after adding its WorkflowException to
+    # self.errors
+    def best_effort(self, call, *args):
+        try:
+            return call(*args)
+        except WorkflowException as e:
+            self.errors.append(e)
+            return None
+
+    # asks the devices whose product isn't known yet for their version, all at
+    # once. Returns the devices whose product is known.
+    def get_versions(self, devices):
+        unknown = [d for d in devices if d.product == None]
+        futures = [d.req_with_resp_future(GetVersion, StateVersion) for d in unknown]
+        for (d, future) in zip(unknown, futures):
+            response = self.best_effort(future.result)
+            if response != None:
+                d.vendor, d.product, d.version = response.vendor, response.product, response.version
+        return [d for d in devices if d.product != None]
+
+    # current colors of devices, asked for all at once, None for the ones
+    # that didn't answer
+    def get_colors(self, devices):
+        futures = [d.req_with_resp_future(LightGet, LightState) for d in devices]
+        colors = []
+        for (d, future) in zip(devices, futures):
+            response = self.best_effort(future.result)
+            if response != None:
+                d.update_from_light_state(response)
+            colors.append(response.color if response != None else None)
+        return colors
 
     def __str__(self):
         s = "Group ({}):\n\n".format(len(self.devices))
@@ -2,20 +2,23 @@
 # lifxlan.py
 # Author: Meghan Clark
 
-from random import randint
-from socket import AF_INET, SOCK_DGRAM, SOL_SOCKET, SO_BROADCAST, SO_REUSEADDR, socket, timeout
-from time import sleep, time
+import asyncio
 import random
 
 from .device import DEFAULT_ATTEMPTS, DEFAULT_TIMEOUT, Device, UDP_BROADCAST_IP_ADDRS, UDP_BROADCAST_PORT
 from .errors import InvalidParameterException, WorkflowException
 from .light import Light
 from .message import BROADCAST_MAC
-from .msgtypes import Acknowledgement, GetService, LightGet, LightGetPower, LightSetColor, LightSetPower, \
-    LightSetWaveform, LightState, LightStatePower, StateService
+from .packetlog import log_to_stdout
+from .msgtypes import Acknowledgement, GetService, GetVersion, LightGet, LightGetPower, LightSetColor, LightSetPower, \
+    LightSetWaveform, LightState, LightStatePower, StateService, StateVersion
 from .multizonelight import MultiZoneLight
 from .tilechain import TileChain
-from .unpack import unpack_lifx_message
+from .asynctransport import open_async_transport
+from .stats import DeviceStats
+from .templates import packet_templates
+from .tracing import SUBSCRIBERS, instant, trace_call
+from .transport import PendingRequest, Transport
 from .group import Group
 
 
@@ -26,7 +29,12 @@ class LifxLAN:
         self.num_lights = num_lights
         self.devices = None
         self.lights = None
-        self.verbose = verbose
+        self.verbose = verbose # log full packet dumps, see packetlog.py
+        if verbose:
+            log_to_stdout()
+        self.transport = Transport() # shared by all the devices found by this LifxLAN
+        self.async_transport = None # AsyncTransport, opened by the first async_* call
+        self.stats = DeviceStats() # of the broadcasts, see get_stats
 
     ############################################################################
     #                                                                          #
@@ -45,26 +53,65 @@ class LifxLAN:
     # more of an internal helper function
     # forces a refresh of the internal list of available devices
     def discover_devices(self):
+        if SUBSCRIBERS:
+            return trace_call("discover_devices", {}, self.do_discover_devices)
+        return self.do_discover_devices()
+
+    def do_discover_devices(self):
         self.lights = []
         self.devices = []
         responses = self.broadcast_with_resp(GetService, StateService,)
         for r in responses:
-            device = Device(r.target_addr, r.ip_addr, r.service, r.port, self.source_id, self.verbose)
+            device = Device(r.target_addr, r.ip_addr, r.service, r.port, self.source_id, self.verbose, self.transport)
             try:
                 if device.is_light():
                     if device.supports_multizone():
-                        device = MultiZoneLight(r.target_addr, r.ip_addr, r.service, r.port, self.source_id, self.verbose)
+                        device = MultiZoneLight(r.target_addr, r.ip_addr, r.service, r.port, self.source_id, self.verbose, self.transport)
                     elif device.supports_chain():
-                        device = TileChain(r.target_addr, r.ip_addr, r.service, r.port, self.source_id, self.verbose)
+                        device = TileChain(r.target_addr, r.ip_addr, r.service, r.port, self.source_id, self.verbose, self.transport)
                     else:
-                        device = Light(r.target_addr, r.ip_addr, r.service, r.port, self.source_id, self.verbose)
+                        device = Light(r.target_addr, r.ip_addr, r.service, r.port, self.source_id, self.verbose, self.transport)
                     self.lights.append(device)
             except WorkflowException:
                 # cheating -- it just so happens that all LIFX devices are lights right now
-                device = Light(r.target_addr, r.ip_addr, r.service, r.port, self.source_id, self.verbose)
+                device = Light(r.target_addr, r.ip_addr, r.service, r.port, self.source_id, self.verbose, self.transport)
                 self.lights.append(device)
             self.devices.append(device)
 
+    # Coroutine version of discover_devices, on the running event loop. The
+    # devices it finds use this LifxLAN's AsyncTransport for their async_*
+    # methods. Tile chains read their tiles with async requests too, see
+    # TileChain.async_read_tiles.
+    async def async_discover_devices(self):
+        responses = await self.async_broadcast_with_resp(GetService, StateService)
+        devices = await asyncio.gather(*[self.async_make_device(r) for r in responses])
+        self.devices = list(devices)
+        self.lights = [d for d in self.devices if isinstance(d, Light)]
+        return self.devices
+
+    async def async_make_device(self, r):
+        device = Device(r.target_addr, r.ip_addr, r.service, r.port, self.source_id, self.verbose, self.transport)
+        device.async_transport = self.async_transport
+        try:
+            response = await device.async_req_with_resp(GetVersion, StateVersion)
+            device.vendor, device.product, device.version = response.vendor, response.product, response.version
+            if device.is_light():
+                if device.supports_multizone():
+                    light = MultiZoneLight(r.target_addr, r.ip_addr, r.service, r.port, self.source_id, self.verbose, self.transport)
+                elif device.supports_chain():
+                    light = TileChain(r.target_addr, r.ip_addr, r.service, r.port, self.source_id, self.verbose, self.transport, read_tiles=False)
+                    light.async_transport = self.async_transport
+                    await light.async_read_tiles()
+                else:
+                    light = Light(r.target_addr, r.ip_addr, r.service, r.port, self.source_id, self.verbose, self.transport)
+                light.vendor, light.product, light.version = device.vendor, device.product, device.version
+                device = light
+        except WorkflowException:
+            # cheating -- it just so happens that all LIFX devices are lights right now
+            device = Light(r.target_addr, r.ip_addr, r.service, r.port, self.source_id, self.verbose, self.transport)
+        device.async_transport = self.async_transport
+        return device
+
     def get_multizone_lights(self):
         multizone_lights = []
         all_lights = self.get_lights()
@@ -212,86 +259,92 @@ class LifxLAN:
     #                                                                          #
     ############################################################################
 
-    def broadcast_fire_and_forget(self, msg_type, payload={}, timeout_secs=DEFAULT_TIMEOUT, num_repeats=DEFAULT_ATTEMPTS):
-        self.initialize_socket(timeout_secs)
-        msg = msg_type(BROADCAST_MAC, self.source_id, seq_num=0, payload=payload, ack_requested=False, response_requested=False)
-        sent_msg_count = 0
-        sleep_interval = 0.05 if num_repeats > 20 else 0
-        while(sent_msg_count < num_repeats):
-            for ip_addr in UDP_BROADCAST_IP_ADDRS:
-                self.sock.sendto(msg.packed_message, (ip_addr, UDP_BROADCAST_PORT))
-            if self.verbose:
-                print("SEND: " + str(msg))
-            sent_msg_count += 1
-            sleep(sleep_interval) # Max num of messages device can handle is 20 per second.
-        self.close_socket()
+    # Like Device.fire_and_forget: a queued packet is replaced by the next one
+    # with the same msg_type and key, and dropped after waiting timeout_secs
+    def broadcast_fire_and_forget(self, msg_type, payload={}, timeout_secs=DEFAULT_TIMEOUT, num_repeats=DEFAULT_ATTEMPTS, key=None):
+        if SUBSCRIBERS:
+            instant("broadcast_fire_and_forget", {"msg_type": msg_type.__name__, "num_repeats": num_repeats})
+        self.stats.for_message(msg_type).sent += num_repeats
+        packet = packet_templates.get_packet(msg_type, BROADCAST_MAC, self.source_id, self.transport.next_seq_num(self.source_id, BROADCAST_MAC), payload, ack_requested=False, response_requested=False)
+        for i in range(num_repeats): # paced by the transport's rate limit
+            self.broadcast_packet(packet, (msg_type, key), timeout_secs)
 
     def broadcast_with_resp(self, msg_type, response_type, payload={}, timeout_secs=DEFAULT_TIMEOUT, max_attempts=DEFAULT_ATTEMPTS):
-        self.initialize_socket(timeout_secs)
-        if response_type == Acknowledgement:
-            msg = msg_type(BROADCAST_MAC, self.source_id, seq_num=0, payload=payload, ack_requested=True, response_requested=False)
+        request = self.build_broadcast_request(self.transport, msg_type, response_type, payload, timeout_secs, max_attempts)
+        if SUBSCRIBERS:
+            return trace_call("broadcast_with_resp", {"msg_type": msg_type.__name__}, lambda: self.transport.submit(request).result())
+        return self.transport.submit(request).result()
+
+    # With ack_and_resp, both flags are set: devices ack and reply with
+    # response_type. Only the response_type replies are returned.
+    def build_broadcast_request(self, transport, msg_type, response_type, payload={}, timeout_secs=DEFAULT_TIMEOUT, max_attempts=DEFAULT_ATTEMPTS, future=None, ack_and_resp=False):
+        seq_num = 0 # the transport picks one when it sends the request
+        response_types = [response_type]
+        if ack_and_resp:
+            packet = packet_templates.get_packet(msg_type, BROADCAST_MAC, self.source_id, seq_num, payload, ack_requested=True, response_requested=True)
+            response_types.append(Acknowledgement)
+        elif response_type == Acknowledgement:
+            packet = packet_templates.get_packet(msg_type, BROADCAST_MAC, self.source_id, seq_num, payload, ack_requested=True, response_requested=False)
         else:
-            msg = msg_type(BROADCAST_MAC, self.source_id, seq_num=0, payload=payload, ack_requested=False, response_requested=True)
-        responses = []
-        addr_seen = []
-        num_devices_seen = 0
-        attempts = 0
-        while (self.num_devices == None or num_devices_seen < self.num_devices) and attempts < max_attempts:
-            sent = False
-            start_time = time()
-            timedout = False
-            while (self.num_devices == None or num_devices_seen < self.num_devices) and not timedout:
-                if not sent:
-                    for ip_addr in UDP_BROADCAST_IP_ADDRS:
-                        self.sock.sendto(msg.packed_message, (ip_addr, UDP_BROADCAST_PORT))
-                    sent = True
-                    if self.verbose:
-                        print("SEND: " + str(msg))
-                try:
-                    data, (ip_addr, port) = self.sock.recvfrom(1024)
-                    response = unpack_lifx_message(data)
-                    response.ip_addr = ip_addr
-                    if self.verbose:
-                        print("RECV: " + str(response))
-                    if type(response) == response_type and response.source_id == self.source_id:
-                        if response.target_addr not in addr_seen and response.target_addr != BROADCAST_MAC:
-                            addr_seen.append(response.target_addr)
-                            num_devices_seen += 1
-                            responses.append(response)
-                except timeout:
-                    pass
-                elapsed_time = time() - start_time
-                timedout = True if elapsed_time > timeout_secs else False
-            attempts += 1
-        self.close_socket()
-        return responses
+            packet = packet_templates.get_packet(msg_type, BROADCAST_MAC, self.source_id, seq_num, payload, ack_requested=False, response_requested=True)
+        # one response per device
+        def unique_responses(responses):
+            addr_seen = []
+            unique = []
+            for response in responses:
+                if ack_and_resp and type(response) == Acknowledgement:
+                    continue
+                if response.target_addr not in addr_seen and response.target_addr != BROADCAST_MAC:
+                    addr_seen.append(response.target_addr)
+                    unique.append(response)
+            return unique
+        def is_complete(responses):
+            return self.num_devices != None and len(unique_responses(responses)) >= self.num_devices
+        addrs = [(ip_addr, UDP_BROADCAST_PORT) for ip_addr in UDP_BROADCAST_IP_ADDRS]
+        return PendingRequest(packet, addrs, self.source_id, BROADCAST_MAC, seq_num, response_types, is_complete, unique_responses, timeout_secs, max_attempts, self.verbose, future, None, self.stats.for_message(msg_type))
+
+    async def async_broadcast_with_resp(self, msg_type, response_type, payload={}, timeout_secs=DEFAULT_TIMEOUT, max_attempts=DEFAULT_ATTEMPTS):
+        if self.async_transport == None or self.async_transport.closed:
+            self.async_transport = await open_async_transport()
+        request = self.build_broadcast_request(self.async_transport, msg_type, response_type, payload, timeout_secs, max_attempts, self.async_transport.create_future())
+        return await self.async_transport.submit(request)
 
     def broadcast_with_ack(self, msg_type, payload={}, timeout_secs=DEFAULT_TIMEOUT+0.5, max_attempts=DEFAULT_ATTEMPTS):
         self.broadcast_with_resp(msg_type, Acknowledgement, payload, timeout_secs, max_attempts)
 
-    # Not currently implemented, although the LIFX LAN protocol supports this kind of workflow natively
+    # Broadcasts a set message with both the ack and res flags, so every device
+    # acks it and reports its resulting state in the same exchange. Returns one
+    # response_type message per device.
     def broadcast_with_ack_resp(self, msg_type, response_type, payload={}, timeout_secs=DEFAULT_TIMEOUT+0.5, max_attempts=DEFAULT_ATTEMPTS):
-        pass
-
-    ############################################################################
-    #                                                                          #
-    #                              Socket Methods                              #
-    #                                                                          #
-    ############################################################################
-
-    def initialize_socket(self, timeout):
-        self.sock = socket(AF_INET, SOCK_DGRAM)
-        self.sock.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
-        self.sock.setsockopt(SOL_SOCKET, SO_BROADCAST, 1)
-        self.sock.settimeout(timeout)
-        try:
-            self.sock.bind(("", 0))  # allow OS to assign next available source port
-        except Exception as err:
-            raise WorkflowException("WorkflowException: error {} while trying to open socket".format(str(err)))
-
-
-    def close_socket(self):
-        self.sock.close()
+        request = self.build_broadcast_request(self.transport, msg_type, response_type, payload, timeout_secs, max_attempts, ack_and_resp=True)
+        if SUBSCRIBERS:
+            return trace_call("broadcast_with_ack_resp", {"msg_type": msg_type.__name__}, lambda: self.transport.submit(request).result())
+        return self.transport.submit(request).result()
+
+    def broadcast_packet(self, packet, key=None, timeout_secs=None):
+        addrs = [(ip_addr, UDP_BROADCAST_PORT) for ip_addr in UDP_BROADCAST_IP_ADDRS]
+        self.transport.send(packet, addrs, BROADCAST_MAC, self.verbose, key, timeout_secs)
+
+    # Snapshot of the broadcasts' stats and of each discovered device's:
+    #   {"broadcast": {...}, "devices": {mac_addr: Device.get_stats()}}
+    # For broadcasts, received counts the replies of every device.
+    def get_stats(self):
+        devices = {}
+        for d in (self.devices if self.devices != None else []):
+            devices[d.mac_addr] = d.get_stats()
+        return {"broadcast": self.stats.snapshot(), "devices": devices}
+
+    def reset_stats(self):
+        self.stats.reset()
+        for d in (self.devices if self.devices != None else []):
+            d.reset_stats()
+
+    # Closes the transport's socket and stops its receiver thread. The devices
+    # found by this LifxLAN can't send anything afterwards.
+    def close(self):
+        self.transport.close()
+        if self.async_transport != None:
+            self.async_transport.close()
 
 def test():
     pass
@@ -23,9 +23,9 @@ WARM_WHITE = [58275, 0, 65535, 3200]
 GOLD = [58275, 0, 65535, 2500]
 
 class Light(Device):
-    def __init__(self, mac_addr, ip_addr, service=1, port=56700, source_id=random.randrange(2, 1 << 32), verbose=False):
+    def __init__(self, mac_addr, ip_addr, service=1, port=56700, source_id=random.randrange(2, 1 << 32), verbose=False, transport=None):
         mac_addr = mac_addr.lower()
-        super(Light, self).__init__(mac_addr, ip_addr, service, port, source_id, verbose)
+        super(Light, self).__init__(mac_addr, ip_addr, service, port, source_id, verbose, transport)
         self.color = None
         self.infrared_brightness = None
 
@@ -44,11 +44,20 @@ class Light(Device):
             raise
         return self.power_level
 
-    def set_power(self, power, duration=0, rapid=False):
+    # The set methods below take return_state: if True (and not rapid), the
+    # device is asked for its state in the same exchange as the ack (see
+    # req_with_ack_resp) and the method returns it like the matching get method
+    # would, without a second request.
+
+    def set_power(self, power, duration=0, rapid=False, return_state=False):
         on = [True, 1, "on", 65535]
         off = [False, 0, "off"]
         try:
-            if power in on and not rapid:
+            if power in on and return_state and not rapid:
+                return self.set_power_with_state(65535, duration)
+            elif power in off and return_state and not rapid:
+                return self.set_power_with_state(0, duration)
+            elif power in on and not rapid:
                 self.req_with_ack(LightSetPower, {"power_level": 65535, "duration": duration})
             elif power in on and rapid:
                 self.fire_and_forget(LightSetPower, {"power_level": 65535, "duration": duration}, num_repeats=1)
@@ -61,40 +70,73 @@ class Light(Device):
         except WorkflowException as e:
             raise
 
+    def set_power_with_state(self, power_level, duration):
+        response = self.req_with_ack_resp(LightSetPower, LightStatePower, {"power_level": power_level, "duration": duration})
+        self.power_level = response.power_level
+        return self.power_level
+
     # color is [Hue, Saturation, Brightness, Kelvin]
-    def set_waveform(self, is_transient, color, period, cycles, duty_cycle, waveform, rapid=False):
+    def set_waveform(self, is_transient, color, period, cycles, duty_cycle, waveform, rapid=False, return_state=False):
         if len(color) == 4:
             try:
                 if rapid:
                     self.fire_and_forget(LightSetWaveform, {"transient": is_transient, "color": color, "period": period, "cycles": cycles, "duty_cycle": duty_cycle, "waveform": waveform}, num_repeats=1)
+                elif return_state:
+                    return self.set_color_with_state(LightSetWaveform, {"transient": is_transient, "color": color, "period": period, "cycles": cycles, "duty_cycle": duty_cycle, "waveform": waveform})
                 else:
                     self.req_with_ack(LightSetWaveform, {"transient": is_transient, "color": color, "period": period, "cycles": cycles, "duty_cycle": duty_cycle, "waveform": waveform})
             except WorkflowException as e:
                 raise
 
     # color is [Hue, Saturation, Brightness, Kelvin], duration in ms
-    def set_color(self, color, duration=0, rapid=False):
+    # With coalesce, a set_color still waiting to be sent is replaced by this
+    # one (see req_with_ack_coalesced).
+    def set_color(self, color, duration=0, rapid=False, return_state=False, coalesce=False):
         if len(color) == 4:
             try:
                 if rapid:
                     self.fire_and_forget(LightSetColor, {"color": color, "duration": duration}, num_repeats=1)
+                elif return_state:
+                    return self.set_color_with_state(LightSetColor, {"color": color, "duration": duration})
+                elif coalesce:
+                    self.req_with_ack_coalesced(LightSetColor, {"color": color, "duration": duration})
                 else:
                     self.req_with_ack(LightSetColor, {"color": color, "duration": duration})
             except WorkflowException as e:
                 raise
 
+    # sends a Set message that the device answers with LightState
+    def set_color_with_state(self, msg_type, payload):
+        response = self.req_with_ack_resp(msg_type, LightState, payload)
+        self.update_from_light_state(response)
+        return self.color
+
+    def update_from_light_state(self, response):
+        self.color = response.color
+        self.power_level = response.power_level
+        self.label = response.label
+
+    async def async_set_color(self, color, duration=0, rapid=False, return_state=False):
+        if len(color) == 4:
+            if rapid:
+                await self.async_fire_and_forget(LightSetColor, {"color": color, "duration": duration})
+            elif return_state:
+                response = await self.async_req_with_ack_resp(LightSetColor, LightState, {"color": color, "duration": duration})
+                self.update_from_light_state(response)
+                return self.color
+            else:
+                await self.async_req_with_ack(LightSetColor, {"color": color, "duration": duration})
+
     def get_color(self):
         try:
             response = self.req_with_resp(LightGet, LightState)
-            self.color = response.color
-            self.power_level = response.power_level
-            self.label = response.label
+            self.update_from_light_state(response)
         except WorkflowException as e:
             raise
         return self.color
 
     # hue in range [0 - 65535]
-    def set_hue(self, hue, duration=0, rapid=False):
+    def set_hue(self, hue, duration=0, rapid=False, return_state=False):
         """ hue to set
             duration in ms"""
         color = self.get_color()
@@ -102,13 +144,15 @@ class Light(Device):
         try:
             if rapid:
                 self.fire_and_forget(LightSetColor, {"color": color2, "duration": duration}, num_repeats=1)
+            elif return_state:
+                return self.set_color_with_state(LightSetColor, {"color": color2, "duration": duration})
             else:
                 self.req_with_ack(LightSetColor, {"color": color2, "duration": duration})
         except WorkflowException as e:
             raise
 
     # saturation in range [0 - 65535]
-    def set_saturation(self, saturation, duration=0, rapid=False):
+    def set_saturation(self, saturation, duration=0, rapid=False, return_state=False):
         """ saturation to set
             duration in ms"""
         color = self.get_color()
@@ -116,13 +160,15 @@ class Light(Device):
         try:
             if rapid:
                 self.fire_and_forget(LightSetColor, {"color": color2, "duration": duration}, num_repeats=1)
+            elif return_state:
+                return self.set_color_with_state(LightSetColor, {"color": color2, "duration": duration})
             else:
                 self.req_with_ack(LightSetColor, {"color": color2, "duration": duration})
         except WorkflowException as e:
             raise
 
     # brightness in range [0 - 65535]
-    def set_brightness(self, brightness, duration=0, rapid=False):
+    def set_brightness(self, brightness, duration=0, rapid=False, return_state=False):
         """ brightness to set
             duration in ms"""
         color = self.get_color()
@@ -130,13 +176,15 @@ class Light(Device):
         try:
             if rapid:
                 self.fire_and_forget(LightSetColor, {"color": color2, "duration": duration}, num_repeats=1)
+            elif return_state:
+                return self.set_color_with_state(LightSetColor, {"color": color2, "duration": duration})
             else:
                 self.req_with_ack(LightSetColor, {"color": color2, "duration": duration})
         except WorkflowException as e:
             raise
 
     # kelvin in range [2500 - 9000]
-    def set_colortemp(self, kelvin, duration=0, rapid=False):
+    def set_colortemp(self, kelvin, duration=0, rapid=False, return_state=False):
         """ kelvin: color temperature to set
             duration in ms"""
         color = self.get_color()
@@ -144,6 +192,8 @@ class Light(Device):
         try:
             if rapid:
                 self.fire_and_forget(LightSetColor, {"color": color2, "duration": duration}, num_repeats=1)
+            elif return_state:
+                return self.set_color_with_state(LightSetColor, {"color": color2, "duration": duration})
             else:
                 self.req_with_ack(LightSetColor, {"color": color2, "duration": duration})
         except WorkflowException as e:
@@ -160,10 +210,14 @@ class Light(Device):
         return self.infrared_brightness
 
     # Infrared set maximum brightness, infrared_brightness
-    def set_infrared(self, infrared_brightness, rapid=False):
+    def set_infrared(self, infrared_brightness, rapid=False, return_state=False):
         try:
             if rapid:
                 self.fire_and_forget(LightSetInfrared, {"infrared_brightness": infrared_brightness}, num_repeats=1)
+            elif return_state:
+                response = self.req_with_ack_resp(LightSetInfrared, LightStateInfrared, {"infrared_brightness": infrared_brightness})
+                self.infrared_brightness = response.infrared_brightness
+                return self.infrared_brightness
             else:
                 self.req_with_ack(LightSetInfrared, {"infrared_brightness": infrared_brightness})
         except WorkflowException as e:
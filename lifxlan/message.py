@@ -2,20 +2,41 @@
 # message.py
 # Author: Meghan Clark
 
+import binascii
 import struct
 
-import bitstring
-
 BROADCAST_MAC = "00:00:00:00:00:00"
 BROADCAST_SOURCE_ID = 0
 
 HEADER_SIZE_BYTES = 36
 
+# Whole 36-byte header in one precompiled struct, little endian:
+#   Frame:           size (16), origin/tagged/addressable/protocol (16), source (32)
+#   Frame Address:   target MAC (48, padded to 64), reserved (48), response flags (8), sequence (8)
+#   Protocol Header: reserved (64), message type (16), reserved (16)
+HEADER_STRUCT = struct.Struct("<HHI6s2x6xBB8xH2x")
+FRAME_STRUCT = struct.Struct("<HHI")
+FRAME_ADDR_STRUCT = struct.Struct("<6s2x6xBB")
+PROTOCOL_HEADER_STRUCT = struct.Struct("<8xH2x")
+
 class Message(object):
+    # Set before __init__ runs on messages built from received bytes (see
+    # unpack.py), in which case the payload is not packed again.
+    packed_message = None
+
+    # Subclasses describe their payload declaratively, see PayloadCodec below.
+    # The schema is compiled once, when the subclass is defined.
+    payload_schema = ()
+    payload_codec = None
+
+    def __init_subclass__(cls, **kwargs):
+        super(Message, cls).__init_subclass__(**kwargs)
+        if "payload_schema" in cls.__dict__:
+            cls.payload_codec = PayloadCodec(cls.payload_schema) if cls.payload_schema else None
+
     def __init__(self, msg_type, target_addr, source_id, seq_num, ack_requested=False, response_requested=False):
 
         # Frame
-        self.frame_format = ["16", "2, 1, 1, 12", "32"]
         self.size = None                                                # 16 bits/uint16
         self.origin = 0                                                 # 2 bits/uint8, must be zero
         self.tagged = 1 if target_addr == BROADCAST_MAC else 0          # 1 bit/bool, also must be one if getservice
@@ -24,7 +45,6 @@ class Message(object):
         self.source_id = source_id                                      # 32 bits/uint32, unique ID set by client. If zero, broadcast reply requested. If non-zero, unicast reply requested.
 
         # Frame Address
-        self.frame_addr_format = ["64", "48", "6, 1, 1", "8"]
         self.target_addr = target_addr                                  # 64 bits/uint64, either single MAC address or all zeroes for broadcast.
         self.reserved = 0                                               # 48 bits/uint8 x 6, all zero
         self.reserved = 0                                               # 6 bits, all zero
@@ -33,14 +53,23 @@ class Message(object):
         self.seq_num = seq_num                                          # 8 bits/uint8, wraparound
 
         # Protocol Header
-        self.protocol_header_format = ["64", "16", "16"]
         self.reserved = 0                                               # 64 bits/uint64, all zero
         self.message_type = msg_type                                    # 16 bits/uint16
         self.reserved = 0                                               # 16 bits/uint16, all zero
 
         self.payload_fields = [] # tuples of ("label", value)
 
-        self.packed_message = self.generate_packed_message()
+        if self.packed_message == None:
+            self.packed_message = self.generate_packed_message()
+
+    # Only called for attributes that haven't been set. Messages unpacked with
+    # lazy=True (see unpack.py) decode their payload fields on first access.
+    def __getattr__(self, name):
+        decode_payload = self.__dict__.get("decode_payload")
+        if decode_payload == None or name.startswith("__"):
+            raise AttributeError("'{}' object has no attribute '{}'".format(self.__class__.__name__, name))
+        decode_payload(self)
+        return object.__getattribute__(self, name)
 
     def generate_packed_message(self):
         self.payload = self.get_payload()
@@ -52,52 +81,59 @@ class Message(object):
     def get_header(self):
         if self.size == None:
             self.size = self.get_msg_size()
-        frame_addr = self.get_frame_addr()
-        frame = self.get_frame()
-        protocol_header = self.get_protocol_header()
-        header = frame + frame_addr + protocol_header
+        header = HEADER_STRUCT.pack(self.size,
+                                    self.get_frame_flags(),
+                                    self.source_id,
+                                    convert_MAC_to_bytes(self.target_addr),
+                                    self.get_response_flags(),
+                                    self.seq_num,
+                                    self.message_type)
         return header
 
-    # Default: No payload unless method overridden
+    # Packs the payload described by payload_schema. Default: no payload.
     def get_payload(self):
-        return little_endian(bitstring.pack(""))
+        codec = self.payload_codec
+        if codec == None:
+            return b""
+        for (attr, label, field) in codec.fields:
+            if label != None:
+                self.payload_fields.append((label, getattr(self, attr)))
+        return codec.pack(self)
 
     def get_frame(self):
-        size_format = self.frame_format[0]
-        flags_format = self.frame_format[1]
-        source_id_format = self.frame_format[2]
-        size = little_endian(bitstring.pack(size_format, self.size))
-        flags = little_endian(bitstring.pack(flags_format, self.origin, self.tagged, self.addressable, self.protocol))
-        source_id = little_endian(bitstring.pack(source_id_format, self.source_id))
-        frame = size + flags + source_id
+        frame = FRAME_STRUCT.pack(self.size, self.get_frame_flags(), self.source_id)
         return frame
 
     def get_frame_addr(self):
-        mac_addr_format = self.frame_addr_format[0]
-        reserved_48_format = self.frame_addr_format[1]
-        response_flags_format = self.frame_addr_format[2]
-        seq_num_format = self.frame_addr_format[3]
-        mac_addr = little_endian(bitstring.pack(mac_addr_format, convert_MAC_to_int(self.target_addr)))
-        reserved_48 = little_endian(bitstring.pack(reserved_48_format, self.reserved))
-        response_flags = little_endian(bitstring.pack(response_flags_format, self.reserved, self.ack_requested, self.response_requested))
-        seq_num = little_endian(bitstring.pack(seq_num_format, self.seq_num))
-        frame_addr = mac_addr + reserved_48 + response_flags + seq_num
+        frame_addr = FRAME_ADDR_STRUCT.pack(convert_MAC_to_bytes(self.target_addr), self.get_response_flags(), self.seq_num)
         return frame_addr
 
     def get_protocol_header(self):
-        reserved_64_format = self.protocol_header_format[0]
-        message_type_format = self.protocol_header_format[1]
-        reserved_16_format = self.protocol_header_format[2]
-        reserved_64 = little_endian(bitstring.pack(reserved_64_format, self.reserved))
-        message_type = little_endian(bitstring.pack(message_type_format, self.message_type))
-        reserved_16 = little_endian(bitstring.pack(reserved_16_format, self.reserved))
-        protocol_header = reserved_64 + message_type + reserved_16
+        protocol_header = PROTOCOL_HEADER_STRUCT.pack(self.message_type)
         return protocol_header
 
+    # origin (2 bits), tagged (1 bit), addressable (1 bit), protocol (12 bits)
+    def get_frame_flags(self):
+        return (self.origin & 3) << 14 | (self.tagged & 1) << 13 | (self.addressable & 1) << 12 | (self.protocol & 4095)
+
+    # reserved (6 bits), ack_required (1 bit), res_required (1 bit)
+    def get_response_flags(self):
+        return (1 if self.ack_requested else 0) << 1 | (1 if self.response_requested else 0)
+
     def get_msg_size(self):
         payload_size_bytes = len(self.payload)
         return HEADER_SIZE_BYTES + payload_size_bytes
 
+    # One line from the header only (no payload decoding, no hex dump), cheap
+    # enough to log every packet
+    def summary(self):
+        flags = ""
+        if self.ack_requested:
+            flags += " ack"
+        if self.response_requested:
+            flags += " res"
+        return "{} target={} source={} seq={}{} size={}".format(self.__class__.__name__, self.target_addr, self.source_id, self.seq_num, flags, len(self.packed_message))
+
     def __str__(self):
         indent = "  "
         s = self.__class__.__name__ + "\n"
@@ -112,6 +148,8 @@ class Message(object):
         s += indent + "Seq Num: {}\n".format(self.seq_num)
         s += indent + "Message Type: {}\n".format(self.message_type)
         s += indent + "Payload:"
+        if len(self.payload_fields) == 0 and len(self.packed_message) > HEADER_SIZE_BYTES:
+            self.get_payload() # received messages skip packing, so fill in the fields now
         for field in self.payload_fields:
             s += "\n" + indent*2 + "{}: {}".format(field[0], field[1])
         if len(self.payload_fields) == 0:
@@ -122,6 +160,117 @@ class Message(object):
         s += "\n"
         return s
 
+
+################################################################################
+#                                                                              #
+#                              Payload Codecs                                  #
+#                                                                              #
+################################################################################
+
+# A payload schema is a tuple of (attribute, label, format) entries in wire
+# order. attribute is read from the message when packing; label is what __str__
+# prints (None to leave the field out). format is one of:
+#   "H", "f", ...        a single value, any struct code
+#   "4H", "16B"          a fixed group of values, given as a tuple/list
+#   "32s"                a byte string, given as str (UTF-8), bytes or a list of ints, zero padded
+#   Array(fmt, count)    count elements of fmt, zero padded if fewer are given.
+#                        count=None means as many elements as the value has.
+#   Record(pairs)        one dict, with pairs a tuple of (key, format) entries
+# Schemas without a variable length Array compile into a single struct.Struct.
+
+class Scalar(object):
+    def __init__(self, code):
+        self.fmt = code
+        self.num_values = 1
+
+    def flatten(self, value, values):
+        values.append(value)
+
+class Group(object):
+    def __init__(self, fmt):
+        self.fmt = fmt
+        self.num_values = struct.calcsize("<" + fmt) // struct.calcsize("<" + fmt[-1])
+
+    def flatten(self, value, values):
+        values.extend(value)
+
+class String(object):
+    def __init__(self, fmt):
+        self.fmt = fmt
+        self.num_values = 1
+
+    def flatten(self, value, values):
+        if isinstance(value, bytes):
+            values.append(value)
+        elif isinstance(value, (list, tuple, bytearray)):
+            values.append(bytes(bytearray(value)))
+        else:
+            values.append(value.encode('utf-8'))
+
+class Record(object):
+    def __init__(self, pairs):
+        self.keys = [k for (k, fmt) in pairs]
+        self.items = [compile_format(fmt) for (k, fmt) in pairs]
+        self.fmt = "".join(item.fmt for item in self.items)
+        self.num_values = sum(item.num_values for item in self.items)
+
+    def flatten(self, value, values):
+        for (key, item) in zip(self.keys, self.items):
+            item.flatten(value[key], values)
+
+class Array(object):
+    def __init__(self, fmt, count=None):
+        self.element = compile_format(fmt)
+        self.count = count
+        self.fmt = None if count == None else self.element.fmt * count
+
+    def flatten(self, value, values):
+        element = self.element
+        if isinstance(element, Scalar):
+            values.extend(value)
+        elif isinstance(element, Group):
+            for v in value:
+                values.extend(v)
+        else:
+            for v in value:
+                element.flatten(v, values)
+        if self.count != None and len(value) < self.count:
+            values.extend([0] * (element.num_values * (self.count - len(value))))
+
+def compile_format(fmt):
+    if not isinstance(fmt, str):
+        return fmt # already an Array or Record
+    if fmt.endswith("s"):
+        return String(fmt)
+    if len(fmt) == 1:
+        return Scalar(fmt)
+    return Group(fmt)
+
+class PayloadCodec(object):
+    def __init__(self, schema):
+        self.fields = [(attr, label, compile_format(fmt)) for (attr, label, fmt) in schema]
+        self.struct = None
+        self.structs = {} # by variable array lengths, for variable length schemas
+        if all(field.fmt != None for (attr, label, field) in self.fields):
+            self.struct = struct.Struct("<" + "".join(field.fmt for (attr, label, field) in self.fields))
+
+    def pack(self, msg):
+        values = []
+        for (attr, label, field) in self.fields:
+            field.flatten(getattr(msg, attr), values)
+        s = self.struct
+        if s == None:
+            s = self.get_struct(tuple(len(getattr(msg, attr)) for (attr, label, field) in self.fields if field.fmt == None))
+        return s.pack(*values)
+
+    def get_struct(self, lengths):
+        s = self.structs.get(lengths)
+        if s == None:
+            remaining = iter(lengths)
+            fmt = "".join(field.fmt if field.fmt != None else field.element.fmt * next(remaining) for (attr, label, field) in self.fields)
+            s = self.structs.setdefault(lengths, struct.Struct("<" + fmt))
+        return s
+
 # reverses bytes for little endian, then converts to int
 def convert_MAC_to_int(addr):
     reverse_bytes_str = addr.split(':')
@@ -129,10 +278,10 @@ def convert_MAC_to_int(addr):
     addr_str = "".join(reverse_bytes_str)
     return int(addr_str, 16)
 
-def little_endian(bs):
-    shifts = [i*8 for i in range(int(len(bs)/8))]
-    int_bytes_little_endian = [int(bs.uintbe >> i & 0xff) for i in shifts]
-    packed_message_little_endian = b""
-    for b in int_bytes_little_endian:
-        packed_message_little_endian += struct.pack("B", b)
-    return packed_message_little_endian
+# "d0:73:d5:01:02:03" -> b"\xd0\x73\xd5\x01\x02\x03", i.e. already in wire order
+def convert_MAC_to_bytes(addr):
+    return binascii.unhexlify(addr.replace(':', ''))
+
+# b"\xd0\x73\xd5\x01\x02\x03" -> "d0:73:d5:01:02:03"
+def convert_bytes_to_MAC(addr):
+    return ":".join(["%02x" % b for b in bytearray(addr)])
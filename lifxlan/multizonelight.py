@@ -1,62 +1,145 @@
 # coding=utf-8
 # multizonelight.py
 
-import math
 import random
 
-from .device import WorkflowException
+from .device import WorkflowException, wait_for_acks
+from .tracing import SUBSCRIBERS, trace_call
+from .errors import InvalidParameterException
 from .light import Light
-from .msgtypes import MultiZoneGetColorZones, MultiZoneSetColorZones, MultiZoneStateMultiZone, MultiZoneStateZone, GetMultiZoneEffect, SetMultiZoneEffect, StateMultiZoneEffect
+from .msgtypes import MultiZoneGetColorZones, MultiZoneSetColorZones, MultiZoneStateMultiZone, MultiZoneStateZone, GetMultiZoneEffect, SetMultiZoneEffect, StateMultiZoneEffect, \
+    MultiZoneGetExtendedColorZones, MultiZoneSetExtendedColorZones, MultiZoneStateExtendedColorZones, GetHostFirmware, StateHostFirmware
+
+# Extended multizone messages (510-512) need host firmware 2.77 or newer
+EXTENDED_MULTIZONE_MIN_FIRMWARE = (2, 77)
+EXTENDED_MULTIZONE_MAX_ZONES = 82 # colors per extended multizone packet
+MISSING_ZONES_ROUNDS = 3 # times a read asks again for zones whose replies got lost
 
 
 class MultiZoneLight(Light):
-    def __init__(self, mac_addr, ip_addr, service=1, port=56700, source_id=random.randrange(2, 1 << 32), verbose=False):
-        super(MultiZoneLight, self).__init__(mac_addr, ip_addr, service, port, source_id, verbose)
+    def __init__(self, mac_addr, ip_addr, service=1, port=56700, source_id=random.randrange(2, 1 << 32), verbose=False, transport=None):
+        super(MultiZoneLight, self).__init__(mac_addr, ip_addr, service, port, source_id, verbose, transport)
+        self.extended_multizone = None
+        self.zone_count = None
+        self.zone_colors = None # last color read of each zone, None for zones never read
 
     # 0 indexed, NOT inclusive, works like python list indices
+    # With no range, one GetColorZones reads the whole strip. With a range, only
+    # the 8-zone chunks starting at start are requested, so a short segment costs
+    # a single packet. The zone count is cached from the replies (the first call
+    # reads the whole strip to learn it).
     def get_color_zones(self, start=None, end=None):
-        response = self.req_with_resp(MultiZoneGetColorZones, [MultiZoneStateZone, MultiZoneStateMultiZone], {"start_index":0, "end_index":255})
-        total_zones = response.count
-        # validate indices
-        if start != None and end != None:
-            # automatically truncate if the end is too large
-            if end > total_zones:
-                end = total_zones
-            if start >= total_zones:
-                raise ValueError("In the function get_color_zones, starting index is greater than the total available zones (provided start = {}, end = {} for a device with {} total zones).".format(start, end, total_zones))
-            if end <= start:
-                raise ValueError("In the function get_color_zones, end must be greater than start (provided start = {}, end = {}).".format(start, end, total_zones))
+        all_zones = None
         if (start != None and end == None) or (start == None and end != None):
             raise ValueError("In the function get_color_zones, start and end indices must both be provided, or neither provided.")
+        if start == None or self.zone_count == None:
+            all_zones = self.read_color_zones(0, 255)
+        if start == None:
+            self.color = all_zones
+            return self.color
+        end = self.validate_zone_range(start, end, self.zone_count)
+        if all_zones == None:
+            all_zones = self.read_color_zones(start, end-1, self.zone_count)
+        self.color = all_zones[start:end]
+        return self.color
 
-        # get all zones
-        all_zones = []
-        for i in range(total_zones):
-            all_zones.append(None)
-        for i in range(int(math.ceil(total_zones/8.0))):
-            response = self.req_with_resp(MultiZoneGetColorZones, [MultiZoneStateZone, MultiZoneStateMultiZone], {"start_index":0+(i*8), "end_index":7+(i*8)})
-            first_included_zone = response.index
-            if first_included_zone + 8 > total_zones:
-                last_included_zone = total_zones-1
-                last_index = last_included_zone - first_included_zone
-            else:
-                last_included_zone = first_included_zone + 7
-                last_index = 8
-            all_zones[first_included_zone:last_included_zone+1] = response.color[:last_index+1]
-        self.color = all_zones
+    # returns end, truncated to the number of zones
+    def validate_zone_range(self, start, end, total_zones):
+        # automatically truncate if the end is too large
+        if end > total_zones:
+            end = total_zones
+        if start >= total_zones:
+            raise ValueError("In the function get_color_zones, starting index is greater than the total available zones (provided start = {}, end = {} for a device with {} total zones).".format(start, end, total_zones))
+        if end <= start:
+            raise ValueError("In the function get_color_zones, end must be greater than start (provided start = {}, end = {}).".format(start, end, total_zones))
+        return end
 
-        if start != None and end != None:
-            self.color = all_zones[start:end]
+    # Reads zones first..last (inclusive) with one GetColorZones, asking again
+    # only for runs of zones whose replies got lost. Returns a list of
+    # total_zones colors with None outside the range.
+    def read_color_zones(self, first, last, total_zones=None):
+        all_zones = self.collect_color_zones(first, last, total_zones)
+        self.zone_count = len(all_zones)
+        self.fill_missing_zones(all_zones, first, last)
+        self.remember_zone_colors(all_zones)
+        self.check_zones_received(all_zones, first, last)
+        return all_zones
 
-        return self.color
+    # zone_colors keeps what every read got, e.g. for the virtual lights of
+    # a strip that each read a few zones but need to know the whole strip
+    def remember_zone_colors(self, all_zones):
+        if self.zone_colors == None or len(self.zone_colors) != len(all_zones):
+            self.zone_colors = [None] * len(all_zones)
+        for (i, color) in enumerate(all_zones):
+            if color != None:
+                self.zone_colors[i] = color
+
+    # Fills in the zones of first..last that are None in all_zones, asking for
+    # each run of them with its own GetColorZones, for up to
+    # MISSING_ZONES_ROUNDS rounds. These requests aren't shared, as a shared
+    # one may be the very read that lost the zones.
+    def fill_missing_zones(self, all_zones, first, last):
+        for i in range(MISSING_ZONES_ROUNDS):
+            runs = missing_zone_runs(all_zones, first, last)
+            if len(runs) == 0:
+                return
+            for (run_first, run_last) in runs:
+                zones = self.request_color_zones(run_first, run_last).result().get_zones(len(all_zones))
+                all_zones[run_first:run_last+1] = zones[run_first:run_last+1]
+
+    # Sends one GetColorZones for zones first..last (inclusive). The future's
+    # result is the ZoneCollector of the replies. A reply that got lost isn't
+    # asked for again here, see fill_missing_zones.
+    def request_color_zones(self, first, last):
+        collector = ZoneCollector(first, last)
+        return self.submit_request(MultiZoneGetColorZones, [MultiZoneStateZone, MultiZoneStateMultiZone], {"start_index": first, "end_index": last}, collector.is_complete, lambda responses: collector, resend_partial=False)
+
+    # Gathers the replies to one GetColorZones for zones first..last
+    # (inclusive) into a list of total_zones colors, with None for zones not
+    # received. total_zones is learned from the first reply if not given.
+    # Concurrent reads of the same zones share one request (see single_flight),
+    # also with the other device objects of the strip. A read of part of the
+    # strip is served by a whole strip read (0..255) that is on the wire or
+    # fresh, if that one got the zones.
+    def collect_color_zones(self, first, last, total_zones=None):
+        submit = lambda: self.request_color_zones(first, last)
+        def collect():
+            whole_strip = self.shared_get((MultiZoneGetColorZones, 0, 255)) if (first, last) != (0, 255) else None
+            if whole_strip != None and whole_strip.exception() == None and whole_strip.result().has_zones(first, last):
+                return whole_strip.result()
+            return self.single_flight((MultiZoneGetColorZones, first, last), submit).result()
+        if SUBSCRIBERS:
+            collector = trace_call("collect_color_zones", self.trace_args(MultiZoneGetColorZones, {"first": first, "last": last}), collect)
+        else:
+            collector = collect()
+        return collector.get_zones(total_zones)
 
-    def set_zone_color(self, start_index, end_index, color, duration=0, rapid=False, apply=1):
+    def check_zones_received(self, all_zones, first, last):
+        if None in all_zones[first:last+1]:
+            raise WorkflowException("WorkflowException: Did not receive zones {} to {} from {} (Name: {})".format(first, min(last, len(all_zones)-1), str(self.mac_addr), str(self.label)))
+
+    # With return_state (and not rapid), returns the colors of zones
+    # start_index..end_index as the strip reports them in the same exchange as
+    # the ack, instead of a separate get_color_zones.
+    # With coalesce, a write to the same zones that is still waiting to be sent
+    # is replaced by this one (see req_with_ack_coalesced).
+    def set_zone_color(self, start_index, end_index, color, duration=0, rapid=False, apply=1, return_state=False, coalesce=False):
         if len(color) == 4:
             try:
                 if rapid:
                     self.fire_and_forget(MultiZoneSetColorZones,
                                          {"start_index": start_index, "end_index": end_index, "color": color,
-                                          "duration": duration, "apply": apply}, num_repeats=1)
+                                          "duration": duration, "apply": apply}, num_repeats=1, key=(start_index, end_index))
+                elif return_state:
+                    collector = ZoneCollector(start_index, end_index)
+                    self.req_with_multi_resp(MultiZoneSetColorZones, [MultiZoneStateZone, MultiZoneStateMultiZone],
+                                             {"start_index": start_index, "end_index": end_index, "color": color,
+                                              "duration": duration, "apply": apply}, collector.is_complete, ack_and_resp=True)
+                    return collector.get_zones()[start_index:end_index+1]
+                elif coalesce:
+                    self.req_with_ack_coalesced(MultiZoneSetColorZones,
+                                                {"start_index": start_index, "end_index": end_index, "color": color,
+                                                 "duration": duration, "apply": apply}, (start_index, end_index))
                 else:
                     self.req_with_ack(MultiZoneSetColorZones,
                                       {"start_index": start_index, "end_index": end_index, "color": color,
@@ -65,23 +148,139 @@ class MultiZoneLight(Light):
                 raise
 
     # Sets colors for all zones given a list of HSVK colors
+    # Uses one extended multizone packet per 82 zones if the firmware supports
+    # it, one packet per zone otherwise (pipelined unless rapid).
     def set_zone_colors(self, colors, duration=0, rapid=False):
+        if self.supports_extended_multizone():
+            for start in range(0, len(colors), EXTENDED_MULTIZONE_MAX_ZONES):
+                apply = 1 if start + EXTENDED_MULTIZONE_MAX_ZONES >= len(colors) else 0
+                self.set_extended_color_zones(colors[start:start+EXTENDED_MULTIZONE_MAX_ZONES], start, duration, apply, rapid)
+            return
+        if rapid:
+            for (i, color) in enumerate(colors):
+                apply = 0
+                if i == len(colors)-1:
+                    apply = 1
+                self.set_zone_color(i, i+1, color, duration, rapid, apply)
+            return
+        # pipelined: all the zones are sent without waiting for each ack
+        futures = []
         for (i, color) in enumerate(colors):
             apply = 0
             if i == len(colors)-1:
                 apply = 1
-            self.set_zone_color(i, i+1, color, duration, rapid, apply)
+            futures.append(self.req_with_ack_future(MultiZoneSetColorZones,
+                                                    {"start_index": i, "end_index": i+1, "color": color,
+                                                     "duration": duration, "apply": apply}))
+        wait_for_acks(futures)
+
+    # Coroutine versions of get_color_zones and set_zone_color, see the async
+    # workflow methods in device.py
+    async def async_get_color_zones(self, start=None, end=None):
+        all_zones = None
+        if (start != None and end == None) or (start == None and end != None):
+            raise ValueError("In the function get_color_zones, start and end indices must both be provided, or neither provided.")
+        if start == None or self.zone_count == None:
+            all_zones = await self.async_read_color_zones(0, 255)
+        if start == None:
+            self.color = all_zones
+            return self.color
+        end = self.validate_zone_range(start, end, self.zone_count)
+        if all_zones == None:
+            all_zones = await self.async_read_color_zones(start, end-1, self.zone_count)
+        self.color = all_zones[start:end]
+        return self.color
+
+    async def async_read_color_zones(self, first, last, total_zones=None):
+        all_zones = await self.async_collect_color_zones(first, last, total_zones)
+        self.zone_count = len(all_zones)
+        for i in range(MISSING_ZONES_ROUNDS):
+            runs = missing_zone_runs(all_zones, first, last)
+            if len(runs) == 0:
+                break
+            for (run_first, run_last) in runs:
+                zones = await self.async_collect_color_zones(run_first, run_last, len(all_zones))
+                all_zones[run_first:run_last+1] = zones[run_first:run_last+1]
+        self.remember_zone_colors(all_zones)
+        self.check_zones_received(all_zones, first, last)
+        return all_zones
+
+    async def async_collect_color_zones(self, first, last, total_zones=None):
+        collector = ZoneCollector(first, last)
+        await self.async_req_with_multi_resp(MultiZoneGetColorZones, [MultiZoneStateZone, MultiZoneStateMultiZone], {"start_index": first, "end_index": last}, collector.is_complete, resend_partial=False)
+        return collector.get_zones(total_zones)
+
+    async def async_set_zone_color(self, start_index, end_index, color, duration=0, rapid=False, apply=1, return_state=False):
+        if len(color) == 4:
+            payload = {"start_index": start_index, "end_index": end_index, "color": color, "duration": duration, "apply": apply}
+            if rapid:
+                await self.async_fire_and_forget(MultiZoneSetColorZones, payload, key=(start_index, end_index))
+            elif return_state:
+                collector = ZoneCollector(start_index, end_index)
+                await self.async_req_with_multi_resp(MultiZoneSetColorZones, [MultiZoneStateZone, MultiZoneStateMultiZone], payload, collector.is_complete, ack_and_resp=True)
+                return collector.get_zones()[start_index:end_index+1]
+            else:
+                await self.async_req_with_ack(MultiZoneSetColorZones, payload)
+
+    # True if the strip understands the extended multizone messages, decided
+    # from its host firmware version the first time this is called.
+    def supports_extended_multizone(self):
+        if self.extended_multizone == None:
+            self.update_extended_multizone(self.req_with_resp(GetHostFirmware, StateHostFirmware))
+        return self.extended_multizone
+
+    def update_extended_multizone(self, host_firmware):
+        firmware = (host_firmware.version >> 16, host_firmware.version & 0xffff)
+        self.extended_multizone = firmware >= EXTENDED_MULTIZONE_MIN_FIRMWARE
+
+    # Reads the whole strip in one round trip, one reply per 82 zones. 0
+    # indexed, NOT inclusive, like get_color_zones, which it falls back to on
+    # strips without extended multizone support.
+    def get_extended_color_zones(self, start=None, end=None):
+        if (start != None and end == None) or (start == None and end != None):
+            raise ValueError("In the function get_extended_color_zones, start and end indices must both be provided, or neither provided.")
+        if not self.supports_extended_multizone():
+            return self.get_color_zones(start, end)
+        collector = ExtendedZoneCollector()
+        self.req_with_multi_resp(MultiZoneGetExtendedColorZones, MultiZoneStateExtendedColorZones, {}, collector.is_complete, resend_partial=False)
+        colors = collector.colors
+        # a lost reply can't be asked for alone, its zones are read with GetColorZones
+        self.fill_missing_zones(colors, 0, len(colors)-1)
+        self.remember_zone_colors(colors)
+        self.check_zones_received(colors, 0, len(colors)-1)
+        self.color = colors
+        if start != None and end != None:
+            self.color = colors[start:end]
+        return self.color
+
+    # Writes up to 82 consecutive zones, starting at zone_index, in one packet
+    # With return_state (and not rapid), returns all the zones the way
+    # get_extended_color_zones does, from the same exchange as the ack.
+    def set_extended_color_zones(self, colors, zone_index=0, duration=0, apply=1, rapid=False, return_state=False):
+        if len(colors) > EXTENDED_MULTIZONE_MAX_ZONES:
+            raise InvalidParameterException("Maximum number of colors is {}, {} given.".format(EXTENDED_MULTIZONE_MAX_ZONES, len(colors)))
+        payload = {"duration": duration,
+                   "apply": apply,
+                   "zone_index": zone_index,
+                   "colors_count": len(colors),
+                   "colors": colors}
+        if rapid:
+            self.fire_and_forget(MultiZoneSetExtendedColorZones, payload, num_repeats=1, key=(zone_index, len(colors)))
+        elif return_state:
+            collector = ExtendedZoneCollector()
+            self.req_with_multi_resp(MultiZoneSetExtendedColorZones, MultiZoneStateExtendedColorZones, payload, collector.is_complete, ack_and_resp=True)
+            self.color = collector.colors
+            return self.color
+        else:
+            self.req_with_ack(MultiZoneSetExtendedColorZones, payload)
 
     def get_multizone_effect(self):
         response = self.req_with_resp(GetMultiZoneEffect, StateMultiZoneEffect)
-        effect = {"instanceid": response.instanceid,
-                  "type": response.effect_type,
-                  "speed": response.speed,
-                  "duration": response.duration,
-                  "parameters": response.parameters}
-        return effect
-
-    def set_multizone_effect(self, effect_type=0, speed=0, duration=0, instanceid=0, parameters=[], rapid=False):
+        return multizone_effect_dict(response)
+
+    # With return_state (and not rapid), returns the effect the way
+    # get_multizone_effect does, from the same exchange as the ack.
+    def set_multizone_effect(self, effect_type=0, speed=0, duration=0, instanceid=0, parameters=[], rapid=False, return_state=False):
         if len(parameters)>8:
             raise InvalidParameterException("Maximum parameters size is 8, {} given.".format(len(parameters)))
 
@@ -97,7 +296,75 @@ class MultiZoneLight(Light):
                    "reserved2": 0,
                    "reserved3": 0,
                    "parameters": parameters}
-        if not rapid:
+        if not rapid and return_state:
+            return multizone_effect_dict(self.req_with_ack_resp(SetMultiZoneEffect, StateMultiZoneEffect, payload))
+        elif not rapid:
             self.req_with_ack(SetMultiZoneEffect, payload)
         else:
             self.fire_and_forget(SetMultiZoneEffect, payload, num_repeats=1)
+
+
+# Collects the StateZone/StateMultiZone replies to one GetColorZones over zones
+# first..last (inclusive). is_complete is the completion check for
+# req_with_multi_resp: true once every zone in the range came back.
+class ZoneCollector(object):
+    def __init__(self, first, last):
+        self.first = first
+        self.last = last
+        self.zones = {}
+        self.total_zones = None
+
+    def is_complete(self, responses):
+        response = responses[-1]
+        if self.total_zones == None:
+            self.total_zones = response.count
+        if type(response) == MultiZoneStateZone:
+            self.zones[response.index] = response.color
+        else:
+            for (i, color) in enumerate(response.color):
+                self.zones[response.index + i] = color
+        return self.has_zones(self.first, self.last)
+
+    # whether zones first..last (inclusive, up to the strip's last zone) all came
+    def has_zones(self, first, last):
+        if self.total_zones == None:
+            return False
+        return all(i in self.zones for i in range(first, min(last, self.total_zones - 1) + 1))
+
+    # list of total_zones colors (the device's count if not given), None where missing
+    def get_zones(self, total_zones=None):
+        if total_zones == None:
+            total_zones = self.total_zones
+        return [self.zones.get(i) for i in range(total_zones)]
+
+# Gathers the StateExtendedColorZones replies of a strip, one per 82 zones,
+# into colors: all the strip's zones, None for the ones not received yet
+class ExtendedZoneCollector(object):
+    def __init__(self):
+        self.colors = None
+
+    def is_complete(self, responses):
+        response = responses[-1]
+        if self.colors == None:
+            self.colors = [None] * response.zones_count
+        count = max(0, min(response.colors_count, response.zones_count - response.zone_index))
+        self.colors[response.zone_index:response.zone_index+count] = response.colors[:count]
+        return None not in self.colors
+
+def multizone_effect_dict(response):
+    return {"instanceid": response.instanceid,
+            "type": response.effect_type,
+            "speed": response.speed,
+            "duration": response.duration,
+            "parameters": response.parameters}
+
+# [first, last] runs of consecutive zones in first..last that are still None
+def missing_zone_runs(all_zones, first, last):
+    runs = []
+    for i in range(first, min(last, len(all_zones)-1)+1):
+        if all_zones[i] == None:
+            if runs and runs[-1][1] == i - 1:
+                runs[-1][1] = i
+            else:
+                runs.append([i, i])
+    return runs
@@ -0,0 +1,79 @@
+# coding=utf-8
+# packetlog.py
+# Logging of the packets the transports send and receive.
+#
+# Packets are logged at DEBUG level through the standard logging module:
+#
+#   lifxlan.packets       one line per packet (Message.summary()), for every
+#                         device
+#   lifxlan.packets.dump  the full message with its hex dump, for the packets
+#                         of devices created with verbose=True
+#
+# Nothing is formatted unless a handler is going to emit the record: the
+# transports only check isEnabledFor(DEBUG) (which logging caches), and the
+# record's argument is a LoggedPacket that unpacks and formats the packet in
+# its __str__. So packet logging can be left on a busy system:
+#
+#   logging.getLogger("lifxlan.packets").setLevel(logging.DEBUG)
+#
+# verbose=True used to print every packet of a device to stdout from the I/O
+# thread. It now calls log_to_stdout(), which prints the dumps from a
+# background thread (QueueHandler/QueueListener), so a slow terminal doesn't
+# hold up the transport.
+
+import atexit
+import logging
+import sys
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
+from threading import Lock
+
+from .message import Message
+from .unpack import decode_message
+
+PACKET_LOG = logging.getLogger("lifxlan.packets")
+DUMP_LOG = logging.getLogger("lifxlan.packets.dump")
+
+# Formats a packet (bytes or a Message) when the record is emitted
+class LoggedPacket(object):
+    def __init__(self, packet, dump=False):
+        self.packet = packet
+        self.dump = dump
+
+    def __str__(self):
+        message = self.packet if isinstance(self.packet, Message) else decode_message(bytes(self.packet), lazy=True)
+        return str(message).rstrip() if self.dump else message.summary()
+
+# direction is "SEND" or "RECV", packet the packed bytes or the received
+# Message, verbose whether its device was created with verbose=True
+def log_packet(direction, packet, verbose=False):
+    if verbose and DUMP_LOG.isEnabledFor(logging.DEBUG):
+        DUMP_LOG.debug("%s: %s", direction, LoggedPacket(packet, True))
+    elif PACKET_LOG.isEnabledFor(logging.DEBUG):
+        PACKET_LOG.debug("%s %s", direction, LoggedPacket(packet))
+
+# Leaves the formatting to the listener's thread: the stock QueueHandler
+# formats the record in the thread that logs it.
+class DeferredQueueHandler(QueueHandler):
+    def prepare(self, record):
+        return record
+
+stdout_listener = None
+stdout_lock = Lock()
+
+# Prints the dumps of verbose devices to stdout, like they used to be. Does
+# nothing if the dump logger already has handlers.
+def log_to_stdout():
+    global stdout_listener
+    with stdout_lock:
+        if stdout_listener != None or DUMP_LOG.handlers:
+            return
+        queue = SimpleQueue()
+        stream_handler = logging.StreamHandler(sys.stdout)
+        stream_handler.setFormatter(logging.Formatter("%(message)s"))
+        stdout_listener = QueueListener(queue, stream_handler)
+        stdout_listener.start()
+        atexit.register(stdout_listener.stop) # flush what's queued
+        DUMP_LOG.addHandler(DeferredQueueHandler(queue))
+        DUMP_LOG.setLevel(logging.DEBUG)
+        DUMP_LOG.propagate = False
@@ -0,0 +1,115 @@
+# coding=utf-8
+# stats.py
+# Per device, per message type counters and round trip time histograms.
+#
+# The transports count, for each request: the packets sent, the retransmits
+# among them, the replies received, the requests that ran out of time before
+# they were complete (timeouts) and the round trip time of the first reply to a
+# first attempt. Recording only increments preallocated counters (the buckets
+# of a histogram are a fixed list), so it stays on all the time. Counters
+# aren't locked: a count may very rarely be lost to a race, which is fine for
+# statistics.
+#
+# Device.get_stats() and LifxLAN.get_stats() return snapshots as plain dicts,
+# reset_stats() zeroes the counters.
+
+from bisect import bisect_left
+
+# upper bounds of the RTT histogram buckets, in seconds; the last bucket is
+# for anything slower
+RTT_BUCKETS = [0.001, 0.002, 0.003, 0.005, 0.0075, 0.01, 0.015, 0.02, 0.03, 0.05, 0.075,
+               0.1, 0.15, 0.2, 0.3, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0]
+
+class RTTHistogram(object):
+    def __init__(self):
+        self.counts = [0] * (len(RTT_BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, rtt):
+        self.counts[bisect_left(RTT_BUCKETS, rtt)] += 1
+        self.count += 1
+        self.total += rtt
+
+    # Upper bound of the bucket holding the q-th quantile (0 < q <= 1), None
+    # if empty. The last bucket reports the largest bound.
+    def quantile(self, q):
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        seen = 0
+        for (i, n) in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return RTT_BUCKETS[min(i, len(RTT_BUCKETS) - 1)]
+        return RTT_BUCKETS[-1]
+
+    def merge(self, other):
+        for (i, n) in enumerate(other.counts):
+            self.counts[i] += n
+        self.count += other.count
+        self.total += other.total
+
+    def reset(self):
+        for i in range(len(self.counts)):
+            self.counts[i] = 0
+        self.count = 0
+        self.total = 0.0
+
+class MessageStats(object):
+    def __init__(self):
+        self.sent = 0
+        self.retransmits = 0
+        self.received = 0
+        self.timeouts = 0
+        self.rtt = RTTHistogram()
+
+    def merge(self, other):
+        self.sent += other.sent
+        self.retransmits += other.retransmits
+        self.received += other.received
+        self.timeouts += other.timeouts
+        self.rtt.merge(other.rtt)
+
+    def reset(self):
+        self.sent = 0
+        self.retransmits = 0
+        self.received = 0
+        self.timeouts = 0
+        self.rtt.reset()
+
+    def snapshot(self):
+        return {"sent": self.sent,
+                "retransmits": self.retransmits,
+                "received": self.received,
+                "timeouts": self.timeouts,
+                "rtt_count": self.rtt.count,
+                "rtt_mean": self.rtt.total / self.rtt.count if self.rtt.count > 0 else None,
+                "rtt_p50": self.rtt.quantile(0.5),
+                "rtt_p95": self.rtt.quantile(0.95),
+                "rtt_p99": self.rtt.quantile(0.99)}
+
+# The MessageStats of one device (or of a LifxLAN's broadcasts), one per
+# message type sent
+class DeviceStats(object):
+    def __init__(self):
+        self.messages = {} # msg_type -> MessageStats
+
+    def for_message(self, msg_type):
+        stats = self.messages.get(msg_type)
+        if stats == None:
+            stats = self.messages.setdefault(msg_type, MessageStats())
+        return stats
+
+    def reset(self):
+        for stats in list(self.messages.values()):
+            stats.reset()
+
+    # {"total": {...}, "messages": {message type name: {...}}}, see MessageStats.snapshot
+    def snapshot(self):
+        total = MessageStats()
+        messages = {}
+        for (msg_type, stats) in list(self.messages.items()):
+            total.merge(stats)
+            messages[msg_type.__name__] = stats.snapshot()
+        return {"total": total.snapshot(), "messages": messages}
@@ -0,0 +1,97 @@
+# coding=utf-8
+# templates.py
+# Cache of packed packets, keyed by (message type, target MAC, ack/response flags, payload).
+#
+# The same requests get sent over and over (polling zones every couple of
+# seconds, asking for the power or the label), so each distinct packet is
+# packed once and kept as a template. Per send, the template is copied into a
+# bytearray and only the two header fields that differ between sends are
+# patched in: the source id and the sequence number.
+#
+# Only payload-free messages and Gets are cached. The payloads of Sets (colors,
+# whole frames of zones or tile pixels) are mostly new every time: packing
+# them directly is cheaper than freezing them into a key, and their templates
+# would push out the ones that get reused.
+#
+# Templates are looked up by payload value, so a changed payload simply maps to
+# a new template. Entries are never refreshed behind your back though: use
+# invalidate() when something that packing depends on, other than the key,
+# changes (e.g. after registering a different message class), or clear() to
+# start over.
+
+import struct
+from collections import OrderedDict
+from threading import Lock
+
+SOURCE_ID_STRUCT = struct.Struct("<I")
+SOURCE_ID_OFFSET = 4
+SEQ_NUM_OFFSET = 23
+
+DEFAULT_MAX_TEMPLATES = 256
+
+class PacketTemplateCache(object):
+    def __init__(self, max_templates=DEFAULT_MAX_TEMPLATES):
+        self.max_templates = max_templates
+        self.templates = OrderedDict() # least recently used first
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    # returns a bytearray ready to be sent
+    def get_packet(self, msg_type, target_addr, source_id, seq_num, payload={}, ack_requested=False, response_requested=False):
+        if not is_cacheable(msg_type, payload):
+            return bytearray(msg_type(target_addr, source_id, seq_num, payload, ack_requested, response_requested).packed_message)
+        template = self.get_template(msg_type, target_addr, payload, ack_requested, response_requested)
+        packet = bytearray(template)
+        SOURCE_ID_STRUCT.pack_into(packet, SOURCE_ID_OFFSET, source_id)
+        packet[SEQ_NUM_OFFSET] = seq_num
+        return packet
+
+    def get_template(self, msg_type, target_addr, payload={}, ack_requested=False, response_requested=False):
+        try:
+            key = (msg_type, target_addr, bool(ack_requested), bool(response_requested), freeze_payload(payload))
+        except TypeError: # unhashable payload value, don't cache it
+            return msg_type(target_addr, 0, 0, payload, ack_requested, response_requested).packed_message
+        with self.lock:
+            template = self.templates.get(key)
+            if template != None:
+                self.templates.move_to_end(key)
+                self.hits += 1
+                return template
+            self.misses += 1
+        template = msg_type(target_addr, 0, 0, payload, ack_requested, response_requested).packed_message
+        with self.lock:
+            self.templates[key] = template
+            while len(self.templates) > self.max_templates:
+                self.templates.popitem(last=False)
+        return template
+
+    # Drops the templates for a message type and/or target MAC, or all of them
+    # if neither is given.
+    def invalidate(self, msg_type=None, target_addr=None):
+        with self.lock:
+            for key in list(self.templates.keys()):
+                if (msg_type == None or key[0] == msg_type) and (target_addr == None or key[1] == target_addr):
+                    del self.templates[key]
+
+    def clear(self):
+        self.invalidate()
+
+    def __len__(self):
+        return len(self.templates)
+
+def is_cacheable(msg_type, payload):
+    return len(payload) == 0 or "Get" in msg_type.__name__
+
+# Turns a payload dict into a hashable key (lists become tuples, dicts become
+# sorted item tuples). Raises TypeError if a value can't be hashed.
+def freeze_payload(value):
+    if isinstance(value, dict):
+        return tuple(sorted((k, freeze_payload(v)) for (k, v) in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze_payload(v) for v in value)
+    hash(value)
+    return value
+
+# shared by every Device and LifxLAN in the process
+packet_templates = PacketTemplateCache()
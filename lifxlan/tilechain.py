@@ -1,33 +1,49 @@
 import random
 
-from .errors import WorkflowException, InvalidParameterException
+from .device import AckBatch
+from .errors import InvalidParameterException
 from .light import Light
 from .msgtypes import GetTileState64, StateTileState64, SetTileState64, GetDeviceChain, StateDeviceChain, SetUserPosition, SetTileEffect, GetTileEffect, StateTileEffect
-from threading import Thread
 
 class TileChain(Light):
-    def __init__(self, mac_addr, ip_addr, service=1, port=56700, source_id=random.randrange(2, 1 << 32), verbose=False):
-        super(TileChain, self).__init__(mac_addr, ip_addr, service, port, source_id, verbose)
+    # read_tiles=False leaves the tiles to be read later, with async_read_tiles
+    def __init__(self, mac_addr, ip_addr, service=1, port=56700, source_id=random.randrange(2, 1 << 32), verbose=False, transport=None, read_tiles=True):
+        super(TileChain, self).__init__(mac_addr, ip_addr, service, port, source_id, verbose, transport)
         self.tile_info = None
         self.tile_count = None
         self.tile_map = None
         self.canvas_dimensions = None
-        self.get_tile_info()
+        if read_tiles:
+            self.get_tile_info()
+            self.get_tile_map()
+            self.get_canvas_dimensions()
+
+    # Coroutine version of the reads done by __init__: the tile map and the
+    # canvas dimensions are worked out from the tile info, without requests
+    async def async_read_tiles(self):
+        await self.async_get_tile_info()
         self.get_tile_map()
         self.get_canvas_dimensions()
 
     # returns information about all tiles
     def get_tile_info(self, refresh_cache=False):
         if (self.tile_info == None) or (refresh_cache == True):
-            response = self.req_with_resp(GetDeviceChain, StateDeviceChain)
-            tiles = []
-            for tile in response.tile_devices:
-                t = Tile(tile["user_x"], tile["user_y"], tile["width"], tile["height"], tile["device_version_vendor"], tile["device_version_product"], tile["device_version_version"], tile["firmware_build"], tile["firmware_version"])
-                tiles.append(t)
-            self.tile_info = tiles[:response.total_count]
-            self.tile_count = response.total_count
+            self.update_tile_info(self.req_with_resp(GetDeviceChain, StateDeviceChain))
         return self.tile_info
 
+    async def async_get_tile_info(self, refresh_cache=False):
+        if (self.tile_info == None) or (refresh_cache == True):
+            self.update_tile_info(await self.async_req_with_resp(GetDeviceChain, StateDeviceChain))
+        return self.tile_info
+
+    def update_tile_info(self, response):
+        tiles = []
+        for tile in response.tile_devices:
+            t = Tile(tile["user_x"], tile["user_y"], tile["width"], tile["height"], tile["device_version_vendor"], tile["device_version_product"], tile["device_version_version"], tile["firmware_build"], tile["firmware_version"])
+            tiles.append(t)
+        self.tile_info = tiles[:response.total_count]
+        self.tile_count = response.total_count
+
     def get_tile_count(self, refresh_cache=False):
         if (self.tile_count == None) or (refresh_cache == True):
             response = self.req_with_resp(GetDeviceChain, StateDeviceChain)
@@ -72,16 +88,13 @@ class TileChain(Light):
         if not rapid:
             self.req_with_ack(SetTileState64, payload)
         else:
-            self.fire_and_forget(SetTileState64, payload, num_repeats=1)
+            self.fire_and_forget(SetTileState64, payload, num_repeats=1, key=(start_index, tile_count, x, y, width))
 
+    # all the tiles are sent before waiting for the acks (see AckBatch)
     def set_tilechain_colors(self, tilechain_colors, duration=0, rapid=False):
-        threads = []
-        for i in range(self.tile_count):
-            t = Thread(target = self.set_tile_colors, args = ((i, tilechain_colors[i], duration, 1, 0, 0, 8, rapid)))
-            threads.append(t)
-            t.start()
-        for t in threads:
-            t.join()
+        with AckBatch():
+            for i in range(self.tile_count):
+                self.set_tile_colors(i, tilechain_colors[i], duration, 1, 0, 0, 8, rapid)
 
     def recenter_coordinates(self):
         num_tiles = self.get_tile_count()
@@ -114,13 +127,9 @@ class TileChain(Light):
                     (tile_num, color_num) = tile_map[row][col]
                     tile_colors[tile_num][color_num] = hsvk_matrix[row][col]
 
-        threads = []
-        for (i, tile_color) in enumerate(tile_colors):
-            t = Thread(target = self.set_tile_colors, args = ((i, tile_color, duration, 1, 0, 0, 8, rapid)))
-            threads.append(t)
-            t.start()
-        for t in threads:
-            t.join()
+        with AckBatch():
+            for (i, tile_color) in enumerate(tile_colors):
+                self.set_tile_colors(i, tile_color, duration, 1, 0, 0, 8, rapid)
 
     ### HELPER FUNCTIONS
 
@@ -0,0 +1,104 @@
+# coding=utf-8
+# tracing.py
+# Hooks to see where the time of a call goes.
+#
+# The workflow methods (req_with_resp and friends, fire_and_forget, the
+# broadcast methods, discover_devices) and unpack_lifx_message report spans: a
+# start event when they begin and an end event with the outcome ("ok" or the
+# exception's class name) when they return. The transports report instant
+# events for each packet sent and each reply received.
+#
+# A subscriber is any object with an on_event(kind, name, timestamp, thread_id,
+# args) method: kind is "start", "end" or "instant", timestamp comes from
+# time.perf_counter() and args is a dict (message type, target, ...). It is
+# called on the thread doing the work, so it should be quick.
+#
+# With no subscriber registered, the instrumented code only checks that
+# SUBSCRIBERS is empty.
+#
+#   trace = ChromeTraceSubscriber("trace.json")
+#   subscribe(trace)
+#   light.get_color_zones()
+#   unsubscribe(trace)
+#   trace.write() # open in chrome://tracing or https://ui.perfetto.dev
+
+import json
+import os
+from threading import Lock, get_ident
+from time import perf_counter
+
+SUBSCRIBERS = [] # modified in place, so that modules can import it
+
+def subscribe(subscriber):
+    if subscriber not in SUBSCRIBERS:
+        SUBSCRIBERS.append(subscriber)
+
+def unsubscribe(subscriber):
+    if subscriber in SUBSCRIBERS:
+        SUBSCRIBERS.remove(subscriber)
+
+def emit(kind, name, args):
+    timestamp = perf_counter()
+    thread_id = get_ident()
+    for subscriber in list(SUBSCRIBERS):
+        subscriber.on_event(kind, name, timestamp, thread_id, args)
+
+def start_span(name, args):
+    emit("start", name, args)
+
+def end_span(name, outcome, args=None):
+    end_args = {"outcome": outcome}
+    if args != None:
+        end_args.update(args)
+    emit("end", name, end_args)
+
+def instant(name, args):
+    emit("instant", name, args)
+
+# Calls call() inside a span and returns what it returns. Only used once a
+# subscriber is registered, callers check SUBSCRIBERS first.
+def trace_call(name, args, call):
+    start_span(name, args)
+    try:
+        result = call()
+    except BaseException as e:
+        end_span(name, type(e).__name__)
+        raise
+    end_span(name, "ok")
+    return result
+
+# Collects the events in memory and writes them as Chrome trace-event JSON
+# (the "JSON Object Format"), with timestamps in microseconds from the
+# subscriber's creation.
+class ChromeTraceSubscriber(object):
+    PHASES = {"start": "B", "end": "E", "instant": "i"}
+
+    def __init__(self, path):
+        self.path = path
+        self.origin = perf_counter()
+        self.pid = os.getpid()
+        self.events = []
+        self.lock = Lock()
+
+    def on_event(self, kind, name, timestamp, thread_id, args):
+        event = {"name": name,
+                 "cat": "lifxlan",
+                 "ph": self.PHASES[kind],
+                 "ts": (timestamp - self.origin) * 1e6,
+                 "pid": self.pid,
+                 "tid": thread_id,
+                 "args": args}
+        if kind == "instant":
+            event["s"] = "t" # scoped to the thread
+        with self.lock:
+            self.events.append(event)
+
+    def write(self):
+        with self.lock:
+            events = list(self.events)
+        with open(self.path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, default=str)
+
+    def clear(self):
+        with self.lock:
+            self.events = []
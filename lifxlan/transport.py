@@ -0,0 +1,816 @@
+# coding=utf-8
+# transport.py
+# A UDP transport shared by many devices and many outstanding requests.
+#
+# One socket is used for everything sent through the transport, and a single
+# I/O thread, waiting on a selector (epoll/kqueue/select, whatever the platform
+# has best), drives every outstanding request: it reads every reply that comes
+# back, re-sends on timeout and paces queued sends. Other threads wake it up
+# through a socket pair when they give it something to do sooner than it
+# planned to wake up. Each target MAC has its own rolling
+# sequence numbers (0-255). A request gets the next one that no pending request
+# from the same source to the same target uses when it is first sent, and is
+# registered under (source_id, target MAC, seq_num). Replies carry those three values back, so the
+# I/O thread can hand each one to the request it answers. Requests sent to
+# BROADCAST_MAC match replies from any device.
+#
+# Requests are pipelined: submit() returns a concurrent.futures.Future right
+# away, and up to max_in_flight requests per target MAC are on the wire at the
+# same time. The rest wait their turn in submission order (which also keeps
+# the 256 sequence numbers from running out). The I/O thread re-sends
+# requests whose timeout expired and fails the ones that ran out of attempts,
+# so every future gets resolved.
+#
+# Replies that nobody is waiting for (late duplicates, answers to requests that
+# already gave up) are dropped.
+#
+# Everything sent to a device is paced by a token bucket, because the firmware
+# silently drops packets beyond about 20 per second. Up to burst packets go out
+# back to back; the rest wait in the device's send queue and the I/O thread
+# sends them as tokens come in (rate per second). Timeouts only start
+# once a request actually goes out. get_send_stats() tells how deep the queue
+# is and how often sends had to wait, set_rate_limit() changes the pace.
+# Fire-and-forget packets (the rapid Sets) only get later by waiting, so they
+# don't pile up: one sent with a key replaces a queued one with the same key
+# (e.g. the previous frame for the same zones), beyond MAX_QUEUED_PACKETS
+# per target the oldest is dropped, and one still waiting after its
+# timeout_secs is dropped (it expired).
+#
+# Timeouts, RTT samples, pacing and freshness go by the monotonic clock, so
+# setting the wall clock (e.g. NTP) doesn't fire or hold up any of them.
+#
+# A LifxLAN object owns one Transport and gives it to every device it creates.
+# Devices created on their own share the process-wide default_transport().
+
+import heapq
+from collections import deque
+from concurrent.futures import Future
+from itertools import count
+from selectors import EVENT_READ, DefaultSelector
+from socket import AF_INET, SOCK_DGRAM, SOL_SOCKET, SO_BROADCAST, SO_REUSEADDR, error, socket, socketpair
+from threading import Lock, Thread
+from time import monotonic
+
+from .errors import WorkflowException
+from .message import BROADCAST_MAC, Message
+from .packetlog import log_packet
+from .templates import SEQ_NUM_OFFSET
+from .tracing import SUBSCRIBERS, instant
+from .unpack import materialize, unpack_lifx_message
+from .writequeue import copy_outcome
+
+RECV_BUFFER_SIZE = 4096
+RECEIVE_POLL_SECS = 0.5 # longest the I/O thread sleeps without being woken up
+
+# Round trip time estimate for one device, kept the way TCP does it (RFC 6298):
+# a smoothed mean (srtt) and mean deviation (rttvar) of the measured RTTs, and
+# a retransmission timeout rto = srtt + 4 * rttvar. A timeout doubles rto until
+# the next measurement, once for all the requests that were on the wire
+# together (not once per request that timed out).
+MIN_RTO = 0.05
+MAX_RTO = 2.0
+INITIAL_RTO = 0.5 # before the first measurement
+RTT_ALPHA = 0.125
+RTT_BETA = 0.25
+
+DEFAULT_RATE_LIMIT = 20.0 # packets per second per device
+DEFAULT_BURST = 5 # packets sent back to back before pacing kicks in
+MAX_QUEUED_PACKETS = 20 # fire-and-forget packets waiting per target, a second's worth at the default rate
+
+# Paces the packets to one target: tokens come in at rate per second up to
+# burst, and each packet takes one. rate=None means no limit.
+class TokenBucket(object):
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = None
+
+    # Takes a token if one is available at now and returns 0, otherwise
+    # returns how many seconds until there is one.
+    def take(self, now):
+        if self.rate == None:
+            return 0
+        if self.updated != None:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+# A fire-and-forget packet. While it waits in a SendQueue, a newer packet with
+# the same key (if not None) takes its place. It is dropped if it is still
+# waiting at expires (None for never).
+class QueuedPacket(object):
+    def __init__(self, packet, addrs, verbose=False, key=None, expires=None):
+        self.packet = packet
+        self.addrs = addrs
+        self.verbose = verbose
+        self.key = key
+        self.expires = expires
+
+# The packets waiting for a target's token bucket, in order: PendingRequests
+# (whose next attempt is due) and QueuedPackets, of which at most max_packets.
+# Counts what went through it.
+class SendQueue(object):
+    def __init__(self, rate, burst, max_packets=MAX_QUEUED_PACKETS):
+        self.bucket = TokenBucket(rate, burst)
+        self.items = deque()
+        self.max_packets = max_packets
+        self.packets = 0 # QueuedPackets in items
+        self.sent = 0 # packets sent (attempts count once, whatever the number of addrs)
+        self.throttled = 0 # of which had to wait in the queue
+        self.superseded = 0 # QueuedPackets replaced by a newer one
+        self.dropped = 0 # QueuedPackets dropped as max_packets were waiting
+        self.expired = 0 # QueuedPackets dropped as they waited past expires
+        self.max_depth = 0
+
+    # Called with the transport's lock held: True if item may be sent now,
+    # otherwise queues it.
+    def admit(self, item, now):
+        if len(self.items) == 0 and self.bucket.take(now) == 0:
+            self.sent += 1
+            return True
+        if isinstance(item, QueuedPacket):
+            if self.supersede(item):
+                return False
+            if self.packets >= self.max_packets:
+                self.drop_oldest_packet()
+            self.packets += 1
+        self.items.append(item)
+        self.max_depth = max(self.max_depth, len(self.items))
+        return False
+
+    # Puts packet in the place of a queued one with the same key, if any
+    def supersede(self, packet):
+        if packet.key == None:
+            return False
+        for (i, item) in enumerate(self.items):
+            if isinstance(item, QueuedPacket) and item.key == packet.key:
+                self.items[i] = packet
+                self.superseded += 1
+                return True
+        return False
+
+    def drop_oldest_packet(self):
+        for (i, item) in enumerate(self.items):
+            if isinstance(item, QueuedPacket):
+                del self.items[i]
+                self.packets -= 1
+                self.dropped += 1
+                return
+
+    def clear(self):
+        self.items.clear()
+        self.packets = 0
+
+    # Called with the transport's lock held: pops the items whose turn has
+    # come at now. Returns them and the seconds until the next one is due
+    # (None if the queue is empty).
+    def pop_ready(self, now):
+        ready = []
+        while self.items:
+            item = self.items[0]
+            if isinstance(item, PendingRequest) and item.done: # answered or failed while waiting
+                self.items.popleft()
+                continue
+            if isinstance(item, QueuedPacket) and item.expires != None and now >= item.expires:
+                self.items.popleft()
+                self.packets -= 1
+                self.expired += 1
+                continue
+            delay = self.bucket.take(now)
+            if delay > 0:
+                return ready, delay
+            self.items.popleft()
+            if isinstance(item, QueuedPacket):
+                self.packets -= 1
+            self.sent += 1
+            self.throttled += 1
+            ready.append(item)
+        return ready, None
+
+    def get_stats(self):
+        return {"rate": self.bucket.rate,
+                "burst": self.bucket.burst,
+                "queued": len(self.items),
+                "max_queued": self.max_depth,
+                "sent": self.sent,
+                "throttled": self.throttled,
+                "superseded": self.superseded,
+                "dropped": self.dropped,
+                "expired": self.expired}
+
+class RTTEstimator(object):
+    def __init__(self):
+        self.srtt = None
+        self.rttvar = None
+        self.rto = INITIAL_RTO
+        self.backoff_time = None # when rto was last doubled
+
+    def add_sample(self, rtt):
+        if self.srtt == None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2.0
+        else:
+            self.rttvar = (1 - RTT_BETA) * self.rttvar + RTT_BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - RTT_ALPHA) * self.srtt + RTT_ALPHA * rtt
+        self.rto = min(max(self.srtt + 4 * self.rttvar, MIN_RTO), MAX_RTO)
+
+    # Called at now for an attempt sent at sent_time that timed out. Attempts
+    # sent before the last backoff were waiting on the rto it doubled already.
+    def backoff(self, sent_time, now):
+        if self.backoff_time != None and sent_time < self.backoff_time:
+            return
+        self.backoff_time = now
+        self.rto = min(self.rto * 2, MAX_RTO)
+
+# A request being sent and waited on by the Transport.
+# is_complete(responses) says when enough replies are in. finish(responses)
+# turns the replies into the future's result, or raises to fail it; it is also
+# called with whatever arrived when the last attempt times out.
+#
+# Without an RTTEstimator (rtt=None) each attempt waits timeout_secs and there
+# are max_attempts of them. With one, timeout_secs * max_attempts is the
+# deadline for the whole request; attempts are re-sent after the device's rto
+# (which doubles with every timeout) for as long as the deadline allows.
+# Replies to an attempt that was re-sent aren't measured (Karn's algorithm).
+#
+# With resend_partial=False, a request that got some of its replies isn't
+# re-sent when they stop coming: it finishes with what arrived, for callers
+# that ask again for just what is missing (e.g. the zone runs in
+# MultiZoneLight.read_color_zones) rather than have the device send it all.
+#
+# stats is the MessageStats (see stats.py) to count the request in, if any.
+#
+# The transport replaces seq_num, in the packet too, when it first sends it.
+class PendingRequest(object):
+    def __init__(self, packet, addrs, source_id, target_addr, seq_num, response_types, is_complete, finish, timeout_secs, max_attempts, verbose=False, future=None, rtt=None, stats=None, resend_partial=True):
+        self.packet = packet
+        self.addrs = addrs
+        self.source_id = source_id
+        self.target_addr = target_addr
+        self.seq_num = seq_num
+        self.response_types = response_types
+        self.is_complete = is_complete
+        self.finish = finish
+        self.timeout_secs = timeout_secs
+        self.max_attempts = max_attempts
+        self.verbose = verbose
+        self.future = future if future != None else Future()
+        self.rtt = rtt
+        self.stats = stats
+        self.resend_partial = resend_partial
+        self.responses = []
+        self.attempts = 0
+        self.sent_time = None
+        self.expires = None # deadline of the whole request, with an RTTEstimator
+        self.deadline = None # deadline of the current attempt
+        self.done = False
+
+    # Counts a (re)send at now and returns how long to wait for it
+    def next_attempt(self, now):
+        if self.attempts == 0 and self.rtt != None:
+            self.expires = now + self.timeout_secs * self.max_attempts
+        self.attempts += 1
+        self.sent_time = now
+        if self.stats != None:
+            self.stats.sent += 1
+            if self.attempts > 1:
+                self.stats.retransmits += 1
+        return self.attempt_timeout(now)
+
+    def attempt_timeout(self, now):
+        if self.rtt == None:
+            return self.timeout_secs
+        return max(0, min(self.rtt.rto, self.expires - now))
+
+    def set_seq_num(self, seq_num):
+        self.seq_num = seq_num
+        self.packet = bytearray(self.packet)
+        self.packet[SEQ_NUM_OFFSET] = seq_num
+
+    # arguments of the transports' trace events (see tracing.py)
+    def trace_args(self):
+        return {"target": self.target_addr, "seq_num": self.seq_num, "attempt": self.attempts}
+
+    # Called when the current attempt timed out at now: True to send it again
+    def can_retry(self, now):
+        if len(self.responses) > 0 and not self.resend_partial:
+            retry = False
+        elif self.rtt == None:
+            retry = self.attempts < self.max_attempts
+        else:
+            self.rtt.backoff(self.sent_time, now)
+            retry = now < self.expires
+        if not retry and self.stats != None:
+            self.stats.timeouts += 1
+        return retry
+
+    # Called for every matching reply. Returns how long to keep waiting from
+    # now if the request isn't complete, as a multi-packet reply that is still
+    # arriving shouldn't trigger a retransmission.
+    def add_response(self, message, now):
+        if len(self.responses) == 0 and self.attempts == 1:
+            if self.rtt != None:
+                self.rtt.add_sample(now - self.sent_time)
+            if self.stats != None:
+                self.stats.rtt.add(now - self.sent_time)
+        if self.stats != None:
+            self.stats.received += 1
+        self.responses.append(message)
+        return self.attempt_timeout(now)
+
+# Single-flight Gets, shared by every device object using the transport (e.g.
+# the virtual lights of one strip, each with its own MultiZoneLight): if a
+# request with the same target MAC and key (message type, response types and
+# frozen payload) is on the wire, callers get its future instead of sending
+# another one. A result received at most freshness_secs ago is returned right
+# away, unless something that may have changed the device's state was sent to
+# it since (see forget). Results are shared between callers, so they must not
+# be modified.
+class SharedGets(object):
+    def __init__(self):
+        self.lock = Lock()
+        self.in_flight = {} # (target_addr, key) -> Future of the request on the wire
+        self.fresh = {} # (target_addr, key) -> (time received, result)
+        self.sets_sent = {} # target_addr -> count, responses to Gets sent before a Set aren't kept
+
+    # The future of the request on the wire, or of a result at most
+    # freshness_secs old, or None. Called with the lock held.
+    def find(self, target_addr, key, freshness_secs):
+        if freshness_secs > 0:
+            fresh = self.fresh.get((target_addr, key))
+            if fresh != None and monotonic() - fresh[0] <= freshness_secs:
+                future = Future()
+                future.set_result(fresh[1])
+                return future
+        return self.in_flight.get((target_addr, key))
+
+    def get(self, target_addr, key, freshness_secs=0):
+        with self.lock:
+            return self.find(target_addr, key, freshness_secs)
+
+    def single_flight(self, target_addr, key, submit, freshness_secs=0):
+        with self.lock:
+            future = self.find(target_addr, key, freshness_secs)
+            if future != None:
+                return future
+            future = self.in_flight[(target_addr, key)] = Future()
+            sets_sent = self.sets_sent.get(target_addr, 0)
+        try:
+            sent = submit()
+        except Exception as err:
+            sent = Future()
+            sent.set_exception(err)
+        sent.add_done_callback(lambda done: self.finish(target_addr, key, done, future, sets_sent))
+        return future
+
+    # Called whenever something that may change the device's state is sent.
+    # The Gets on the wire may have been answered before it, so callers from
+    # now on send their own; the ones already waiting keep theirs.
+    def forget(self, target_addr):
+        with self.lock:
+            self.sets_sent[target_addr] = self.sets_sent.get(target_addr, 0) + 1
+            for entry in [entry for entry in self.fresh if entry[0] == target_addr]:
+                del self.fresh[entry]
+            for entry in [entry for entry in self.in_flight if entry[0] == target_addr]:
+                del self.in_flight[entry]
+
+    def finish(self, target_addr, key, sent, future, sets_sent):
+        succeeded = not sent.cancelled() and sent.exception() == None
+        if succeeded:
+            result = sent.result()
+            for message in (result if type(result) == type([]) else [result]):
+                if isinstance(message, Message):
+                    materialize(message) # so that the callers don't race to decode it
+        with self.lock:
+            if self.in_flight.get((target_addr, key)) is future: # not forgotten and sent again since
+                del self.in_flight[(target_addr, key)]
+            if succeeded and self.sets_sent.get(target_addr, 0) == sets_sent:
+                self.fresh[(target_addr, key)] = (monotonic(), sent.result())
+        copy_outcome(sent, future)
+
+class Transport(object):
+    def __init__(self, rate_limit=DEFAULT_RATE_LIMIT, burst=DEFAULT_BURST):
+        self.rate_limit = rate_limit
+        self.burst = burst
+        self.socket = None
+        self.lock = Lock()
+        self.pending = {} # (source_id, seq_num) -> {target_addr: PendingRequest}
+        self.in_flight = {} # target_addr -> number of requests on the wire
+        self.waiting = {} # target_addr -> deque of PendingRequests not sent yet
+        self.deadlines = [] # heap of (deadline, tiebreak, PendingRequest)
+        self.tiebreak = count()
+        self.send_queues = {} # target_addr -> SendQueue
+        self.shared_gets = SharedGets()
+        self.seq_nums = {} # target_addr -> last sequence number used
+        self.selector = None
+        self.wakeup_sockets = None # (read end, write end) of the socket pair that wakes the I/O thread
+        self.wake_time = 0 # when the I/O thread will wake up by itself
+        self.receiver_thread = None
+        self.closed = False
+
+    ############################################################################
+    #                                                                          #
+    #                            Request Methods                               #
+    #                                                                          #
+    ############################################################################
+
+    # For packets that aren't waited on (requests get theirs in start)
+    def next_seq_num(self, source_id, target_addr):
+        with self.lock:
+            return next_seq_num(self.pending, self.seq_nums, source_id, target_addr)
+
+    # Sends request, or queues it if max_in_flight requests to the same target
+    # are already out (None for no limit). Returns its future. Requests are
+    # registered for replies when they are first sent.
+    def submit(self, request, max_in_flight=None):
+        self.get_socket()
+        with self.lock:
+            in_flight = self.in_flight.get(request.target_addr, 0)
+            if max_in_flight == None or in_flight < max_in_flight:
+                self.in_flight[request.target_addr] = in_flight + 1
+                send_now = True
+            else:
+                self.waiting.setdefault(request.target_addr, deque()).append(request)
+                send_now = False
+        if send_now:
+            self.start(request)
+        return request.future
+
+    # Sends packet to (ip_addr, port). If the socket has gone bad, it is
+    # replaced and the packet sent once more.
+    def sendto(self, packet, addr):
+        sock = self.get_socket()
+        try:
+            sock.sendto(packet, addr)
+        except error:
+            self.reset_socket(sock).sendto(packet, addr)
+
+    # Sends packet to addrs as fire-and-forget, paced like the requests to
+    # target_addr. If it has to wait, a later packet with the same key (not
+    # None) replaces it, and it is dropped once it has waited timeout_secs
+    # (if not None).
+    def send(self, packet, addrs, target_addr, verbose=False, key=None, timeout_secs=None):
+        self.get_socket()
+        expires = None if timeout_secs == None else monotonic() + timeout_secs
+        with self.lock:
+            send_now = self.admit(target_addr, QueuedPacket(packet, addrs, verbose, key, expires))
+        if send_now:
+            self.send_packet(packet, addrs, verbose)
+
+    def send_packet(self, packet, addrs, verbose=False):
+        for addr in addrs:
+            self.sendto(packet, addr)
+        log_packet("SEND", packet, verbose)
+
+    # Registers request on its first attempt and sends the attempt when its
+    # target's rate limit allows it.
+    def start(self, request):
+        if request.attempts == 0 and not request.future.set_running_or_notify_cancel():
+            self.complete(request) # cancelled while it was waiting
+            return
+        with self.lock:
+            registered = request.attempts > 0 or register_request(self.pending, self.seq_nums, request)
+            send_now = registered and self.admit(request.target_addr, request)
+        if not registered:
+            self.complete(request, WorkflowException("WorkflowException: all sequence numbers to {} are in use".format(request.target_addr)))
+        elif send_now:
+            self.transmit(request)
+
+    # Sends the next attempt of request and arms its timeout
+    def transmit(self, request):
+        with self.lock:
+            now = monotonic()
+            request.deadline = now + request.next_attempt(now)
+            self.push_deadline(request)
+        try:
+            for addr in request.addrs:
+                self.sendto(request.packet, addr)
+        except Exception as err:
+            self.complete(request, err)
+            return
+        if SUBSCRIBERS:
+            instant("send", request.trace_args())
+        log_packet("SEND", request.packet, request.verbose)
+
+    # Unregisters request, resolves its future and sends the next request
+    # waiting for the same target, if any.
+    def complete(self, request, err=None):
+        with self.lock:
+            if request.done:
+                return
+            request.done = True
+            targets = self.pending.get((request.source_id, request.seq_num))
+            if targets != None and targets.get(request.target_addr) is request:
+                del targets[request.target_addr]
+                if len(targets) == 0:
+                    del self.pending[(request.source_id, request.seq_num)]
+            next_request = None
+            waiting = self.waiting.get(request.target_addr)
+            if waiting:
+                next_request = waiting.popleft()
+            else:
+                self.in_flight[request.target_addr] -= 1
+                if self.in_flight[request.target_addr] == 0:
+                    del self.in_flight[request.target_addr]
+        if not request.future.cancelled():
+            try:
+                if err != None:
+                    raise err
+                request.future.set_result(request.finish(request.responses))
+            except Exception as e:
+                request.future.set_exception(e)
+        if next_request != None:
+            self.start(next_request)
+
+    # Called with the lock held. Wakes the I/O thread up if it would otherwise
+    # sleep past request's deadline.
+    def push_deadline(self, request):
+        heapq.heappush(self.deadlines, (request.deadline, next(self.tiebreak), request))
+        if request.deadline < self.wake_time:
+            self.wake_receiver()
+
+    # Called with the lock held: True if item (a PendingRequest or a packet) may
+    # be sent to target_addr now, otherwise it is queued. Wakes the I/O thread
+    # up when a queue starts, so it sends the item on time.
+    def admit(self, target_addr, item):
+        queue = self.send_queues.get(target_addr)
+        if queue == None:
+            queue = self.send_queues[target_addr] = SendQueue(self.rate_limit, self.burst)
+        if queue.admit(item, monotonic()):
+            return True
+        if len(queue.items) == 1:
+            self.wake_receiver()
+        return False
+
+    # Sends the queued packets whose turn has come. Returns the number of
+    # seconds until the next one is due.
+    def send_queued(self):
+        now = monotonic()
+        ready = []
+        wait = None
+        with self.lock:
+            for queue in self.send_queues.values():
+                items, delay = queue.pop_ready(now)
+                ready.extend(items)
+                if delay != None:
+                    wait = delay if wait == None else min(wait, delay)
+        for item in ready:
+            if isinstance(item, PendingRequest):
+                self.transmit(item)
+            else:
+                try:
+                    self.send_packet(item.packet, item.addrs, item.verbose)
+                except Exception:
+                    pass # fire-and-forget
+        return wait
+
+    # Changes the pace of what is sent to target_addr: rate packets per second
+    # (None for no limit) after a burst of up to burst packets.
+    def set_rate_limit(self, target_addr, rate, burst=DEFAULT_BURST):
+        with self.lock:
+            queue = self.send_queues.get(target_addr)
+            if queue == None:
+                queue = self.send_queues[target_addr] = SendQueue(rate, burst)
+            queue.bucket = TokenBucket(rate, burst)
+            if queue.items:
+                self.wake_receiver()
+
+    # Send queue depth and counters for target_addr: rate, burst, queued (packets
+    # waiting now), max_queued, sent, throttled (sent after waiting), and the
+    # fire-and-forget packets superseded by a newer one, dropped or expired.
+    def get_send_stats(self, target_addr):
+        with self.lock:
+            queue = self.send_queues.get(target_addr)
+            if queue == None:
+                queue = SendQueue(self.rate_limit, self.burst)
+            return queue.get_stats()
+
+    # Re-sends or gives up on the requests whose timeout expired. Returns the
+    # number of seconds until the next timeout.
+    def check_deadlines(self):
+        now = monotonic()
+        expired = []
+        with self.lock:
+            while self.deadlines and self.deadlines[0][0] <= now:
+                deadline, tiebreak, request = heapq.heappop(self.deadlines)
+                if not request.done and request.deadline == deadline:
+                    expired.append(request)
+        for request in expired:
+            if request.can_retry(now):
+                self.start(request)
+            else:
+                self.complete(request)
+        with self.lock:
+            if self.deadlines:
+                return max(0, self.deadlines[0][0] - monotonic())
+        return None
+
+    ############################################################################
+    #                                                                          #
+    #                              Socket Methods                              #
+    #                                                                          #
+    ############################################################################
+
+    # Returns the socket, opening it and starting the I/O thread on first use
+    def get_socket(self):
+        with self.lock:
+            if self.closed:
+                raise WorkflowException("WorkflowException: transport is closed")
+            if self.socket == None:
+                self.socket = self.initialize_socket()
+            if self.receiver_thread == None:
+                self.selector = DefaultSelector()
+                self.wakeup_sockets = socketpair()
+                for wakeup_socket in self.wakeup_sockets:
+                    wakeup_socket.setblocking(False)
+                self.selector.register(self.wakeup_sockets[0], EVENT_READ)
+                self.receiver_thread = Thread(target=self.receive_loop)
+                self.receiver_thread.daemon = True
+                self.receiver_thread.start()
+            return self.socket
+
+    def initialize_socket(self):
+        sock = socket(AF_INET, SOCK_DGRAM)
+        sock.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+        sock.setsockopt(SOL_SOCKET, SO_BROADCAST, 1)
+        try:
+            sock.bind(("", 0))  # allow OS to assign next available source port
+            return sock
+        except Exception as err:
+            sock.close()
+            raise WorkflowException("WorkflowException: error {} while trying to open socket".format(str(err)))
+
+    # Interrupts the I/O thread's wait on the selector
+    def wake_receiver(self):
+        if self.wakeup_sockets != None:
+            try:
+                self.wakeup_sockets[1].send(b"\0")
+            except error: # full: it has plenty of wake-ups to read already
+                pass
+
+    # Replaces sock if it is still the current socket (another thread may have
+    # replaced it already) and returns the socket to use from now on.
+    def reset_socket(self, sock):
+        with self.lock:
+            if self.socket is sock and not self.closed:
+                sock.close()
+                self.socket = self.initialize_socket()
+            return self.socket
+
+    # Closes the socket, stops the I/O thread and fails every request that is
+    # still pending.
+    def close(self):
+        with self.lock:
+            self.closed = True
+            self.wake_receiver()
+            if self.socket != None:
+                self.socket.close()
+                self.socket = None
+            requests = [r for targets in self.pending.values() for r in targets.values()]
+            waiting_requests = [r for waiting in self.waiting.values() for r in waiting]
+            self.waiting = {}
+            for queue in self.send_queues.values():
+                queue.clear()
+        if self.receiver_thread != None:
+            self.receiver_thread.join()
+            self.receiver_thread = None
+        for request in requests:
+            self.complete(request, WorkflowException("WorkflowException: transport closed while waiting for a reply"))
+        for request in waiting_requests:
+            request.done = True
+            if request.future.set_running_or_notify_cancel():
+                request.future.set_exception(WorkflowException("WorkflowException: transport closed before the request was sent"))
+
+    # The I/O thread: waits on the selector for replies, wake-ups and the next
+    # timeout or queued send, whichever comes first.
+    def receive_loop(self):
+        registered = None
+        while not self.closed:
+            sock = self.socket
+            if sock == None:
+                break
+            if sock is not registered: # first run, or the socket was reset
+                if registered != None:
+                    self.selector.unregister(registered)
+                self.selector.register(sock, EVENT_READ)
+                registered = sock
+            with self.lock:
+                self.wake_time = float("inf") # anything pushed while we work out the wait wakes us up
+            wait = RECEIVE_POLL_SECS
+            for next_wait in (self.check_deadlines(), self.send_queued()):
+                if next_wait != None:
+                    wait = min(wait, next_wait)
+            with self.lock:
+                self.wake_time = monotonic() + wait
+            for (key, events) in self.selector.select(wait):
+                if key.fileobj is sock:
+                    self.receive(sock)
+                else:
+                    self.drain_wakeups()
+        with self.lock:
+            self.selector.close()
+            for wakeup_socket in self.wakeup_sockets:
+                wakeup_socket.close()
+            self.wakeup_sockets = None
+
+    # Reads and dispatches one datagram from sock, which is ready to be read
+    def receive(self, sock):
+        try:
+            data, (ip_addr, port) = sock.recvfrom(RECV_BUFFER_SIZE)
+        except error:
+            if not self.closed:
+                self.reset_socket(sock)
+            return
+        try:
+            message = unpack_lifx_message(data, lazy=True)
+        except Exception: # not a LIFX packet
+            return
+        self.dispatch(message, ip_addr)
+
+    def drain_wakeups(self):
+        try:
+            while self.wakeup_sockets[0].recv(RECV_BUFFER_SIZE):
+                pass
+        except error:
+            pass
+
+    def dispatch(self, message, ip_addr):
+        with self.lock:
+            request = find_pending_request(self.pending, message)
+        if request == None or request.attempts == 0 or type(message) not in request.response_types:
+            return
+        message.ip_addr = ip_addr
+        if SUBSCRIBERS:
+            instant("receive", {"msg_type": type(message).__name__, "target": message.target_addr, "seq_num": message.seq_num})
+        log_packet("RECV", message, request.verbose)
+        now = monotonic()
+        timeout = request.add_response(message, now)
+        try:
+            complete = request.is_complete(request.responses)
+        except Exception as err:
+            self.complete(request, err)
+            return
+        if complete:
+            self.complete(request)
+        else:
+            with self.lock:
+                request.deadline = now + timeout
+                self.push_deadline(request)
+
+# Looks up the request a reply answers in a (source_id, seq_num) -> {target_addr:
+# request} table. A reply addressed to BROADCAST_MAC goes to the request with
+# the same source and sequence number if there is only one.
+def find_pending_request(pending, message):
+    request = None
+    targets = pending.get((message.source_id, message.seq_num))
+    if targets != None:
+        request = targets.get(message.target_addr, targets.get(BROADCAST_MAC))
+        if request == None and message.target_addr == BROADCAST_MAC and len(targets) == 1:
+            request = list(targets.values())[0]
+    return request
+
+# The sequence number after the last one used for target_addr (in seq_nums,
+# target_addr -> last one) that no request from source_id to target_addr
+# pending uses, or None if they all are. Marks it used.
+def free_seq_num(pending, seq_nums, source_id, target_addr):
+    seq_num = seq_nums.get(target_addr, 0)
+    for i in range(256):
+        seq_num = (seq_num + 1) % 256
+        targets = pending.get((source_id, seq_num))
+        if targets == None or target_addr not in targets:
+            seq_nums[target_addr] = seq_num
+            return seq_num
+    return None
+
+# Same, but a packet that isn't waited on may share its sequence number with
+# a pending request if there is no other choice
+def next_seq_num(pending, seq_nums, source_id, target_addr):
+    seq_num = free_seq_num(pending, seq_nums, source_id, target_addr)
+    if seq_num == None:
+        seq_num = seq_nums[target_addr] = (seq_nums[target_addr] + 1) % 256
+    return seq_num
+
+# Gives request a free sequence number and registers it in pending. False if
+# there is none.
+def register_request(pending, seq_nums, request):
+    seq_num = free_seq_num(pending, seq_nums, request.source_id, request.target_addr)
+    if seq_num == None:
+        return False
+    request.set_seq_num(seq_num)
+    pending.setdefault((request.source_id, seq_num), {})[request.target_addr] = request
+    return True
+
+DEFAULT_TRANSPORT = None
+DEFAULT_TRANSPORT_LOCK = Lock()
+
+# The transport used by devices that weren't given one
+def default_transport():
+    global DEFAULT_TRANSPORT
+    with DEFAULT_TRANSPORT_LOCK:
+        if DEFAULT_TRANSPORT == None:
+            DEFAULT_TRANSPORT = Transport()
+        return DEFAULT_TRANSPORT
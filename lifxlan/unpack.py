@@ -2,418 +2,64 @@
 # unpack.py
 # Author: Meghan Clark
 
-import binascii
 import struct
 
-from .message import HEADER_SIZE_BYTES, Message
+from .message import HEADER_SIZE_BYTES, HEADER_STRUCT, Message, convert_bytes_to_MAC
 from .msgtypes import *
-
+from .tracing import SUBSCRIBERS, trace_call
+
+# Payload decoders, keyed by message id. Each entry is (message class, decoder),
+# where the decoder takes the whole packet and the offset of the payload and
+# returns the payload dict the message class expects. Every decoder reads its
+# payload with precompiled structs, so decoding a message is a dict lookup plus
+# one unpack_from call (two for the variable length tile effect palettes).
+DECODERS = {}
+
+# Registers (or replaces) the decoder for a message type. Use this to teach the
+# unpacker about new message types without touching unpack_lifx_message.
+# decoder=None means the message has no payload.
+def register_decoder(msg_type, decoder=None, msg_id=None):
+    if msg_id == None:
+        msg_id = MSG_IDS[msg_type]
+    DECODERS[msg_id] = (msg_type, decoder)
 
 # Creates a LIFX Message out of packed binary data
-# If the message type is not one of the officially released ones above, it will create just a Message out of it
+# If the message type is not one of the registered ones, it will create just a Message out of it
 # If it's not in the LIFX protocol format, uhhhhh...we'll put that on a to-do list.
-def unpack_lifx_message(packed_message):
-    header_str = packed_message[0:HEADER_SIZE_BYTES]
-    payload_str = packed_message[HEADER_SIZE_BYTES:]
-
-    size = struct.unpack("<H", header_str[0:2])[0]
-    flags = struct.unpack("<H", header_str[2:4])[0]
+# With lazy=True only the header is decoded here; payload fields are decoded
+# from a memoryview over packed_message the first time one of them is read.
+def unpack_lifx_message(packed_message, lazy=False):
+    if SUBSCRIBERS:
+        return trace_call("unpack_lifx_message", {"size": len(packed_message), "lazy": lazy}, lambda: decode_message(packed_message, lazy))
+    return decode_message(packed_message, lazy)
+
+def decode_message(packed_message, lazy=False):
+    size, flags, source_id, target_addr, response_flags, seq_num, message_type = HEADER_STRUCT.unpack_from(packed_message)
     origin = (flags >> 14) & 3
     tagged = (flags >> 13) & 1
     addressable = (flags >> 12) & 1
     protocol = flags & 4095
-    source_id = struct.unpack("<I", header_str[4:8])[0]
-    target_addr = ":".join([('%02x' % b) for b in struct.unpack("<" + ("B"*6), header_str[8:14])])
-    response_flags = struct.unpack("<B", header_str[22:23])[0]
-    ack_requested = response_flags & 2
+    target_addr = convert_bytes_to_MAC(target_addr)
+    ack_requested = (response_flags >> 1) & 1
     response_requested = response_flags & 1
-    seq_num = struct.unpack("<B", header_str[23:24])[0]
-    message_type = struct.unpack("<H", header_str[32:34])[0]
-
-    message = None
-    if message_type == MSG_IDS[GetService]:
-        message = GetService(target_addr, source_id, seq_num, {}, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[StateService]:
-        service = struct.unpack("<B", payload_str[0:1])[0]
-        port = struct.unpack("<I", payload_str[1:5])[0]
-        payload = {"service": service, "port": port}
-        message = StateService(target_addr, source_id, seq_num, payload, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[GetHostInfo]:
-        message = GetHostInfo(target_addr, source_id, seq_num, {}, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[StateHostInfo]:
-        signal = struct.unpack("<f", payload_str[0:4])[0]
-        tx = struct.unpack("<I", payload_str[4:8])[0]
-        rx = struct.unpack("<I", payload_str[8:12])[0]
-        reserved1 = struct.unpack("<h", payload_str[12:14])[0]
-        payload = {"signal": signal, "tx": tx, "rx": rx, "reserved1": reserved1}
-        message = StateHostInfo(target_addr, source_id, seq_num, payload, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[GetHostFirmware]:
-        message = GetHostFirmware(target_addr, source_id, seq_num, {}, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[StateHostFirmware]:
-        build = struct.unpack("<Q", payload_str[0:8])[0]
-        reserved1 = struct.unpack("<Q", payload_str[8:16])[0]
-        version = struct.unpack("<I", payload_str[16:20])[0]
-        payload = {"build": build, "reserved1": reserved1, "version": version}
-        message = StateHostFirmware(target_addr, source_id, seq_num, payload, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[GetWifiInfo]:
-        message = GetWifiInfo(target_addr, source_id, seq_num, {}, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[StateWifiInfo]:
-        signal = struct.unpack("<f", payload_str[0:4])[0]
-        tx = struct.unpack("<I", payload_str[4:8])[0]
-        rx = struct.unpack("<I", payload_str[8:12])[0]
-        reserved1 = struct.unpack("<h", payload_str[12:14])[0]
-        payload = {"signal": signal, "tx": tx, "rx": rx, "reserved1": reserved1}
-        message = StateWifiInfo(target_addr, source_id, seq_num, payload, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[GetWifiFirmware]:
-        message = GetWifiFirmware(target_addr, source_id, seq_num, {}, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[StateWifiFirmware]:
-        build = struct.unpack("<Q", payload_str[0:8])[0]
-        reserved1 = struct.unpack("<Q", payload_str[8:16])[0]
-        version = struct.unpack("<I", payload_str[16:20])[0]
-        payload = {"build": build, "reserved1": reserved1, "version": version}
-        message = StateWifiFirmware(target_addr, source_id, seq_num, payload, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[GetPower]:
-        message = GetPower(target_addr, source_id, seq_num, {}, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[SetPower]:
-        power_level = struct.unpack("<H", payload_str[0:2])[0]
-        payload = {"power_level": power_level}
-        message = SetPower(target_addr, source_id, seq_num, payload, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[StatePower]:
-        power_level = struct.unpack("<H", payload_str[0:2])[0]
-        payload = {"power_level": power_level}
-        message = StatePower(target_addr, source_id, seq_num, payload, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[GetLabel]:
-        message = GetLabel(target_addr, source_id, seq_num, {}, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[SetLabel]:
-        label = binascii.unhexlify("".join(["%2.2x" % (b & 0x000000ff) for b in struct.unpack("<" + ("b"*32), payload_str[0:32])])).replace(b'\x00', b'')
-        label = label.decode('utf-8')
-        payload = {"label": label}
-        message = SetLabel(target_addr, source_id, seq_num, payload, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[StateLabel]:
-        label = binascii.unhexlify("".join(["%2.2x" % (b & 0x000000ff) for b in struct.unpack("<" + ("b"*32), payload_str[0:32])])).replace(b'\x00', b'')
-        label = label.decode('utf-8')
-        payload = {"label": label}
-        message = StateLabel(target_addr, source_id, seq_num, payload, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[GetLocation]:
-        message = GetLocation(target_addr, source_id, seq_num, {}, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[StateLocation]:
-        location = [b for b in struct.unpack("<" + ("B"*16), payload_str[0:16])]
-        label = binascii.unhexlify("".join(["%2.2x" % (b & 0x000000ff) for b in struct.unpack("<" + ("b"*32), payload_str[16:48])])).replace(b'\x00', b'')
-        label = label.decode('utf-8')
-        updated_at = struct.unpack("<Q", payload_str[48:56])[0]
-        payload = {"location": location, "label": label, "updated_at": updated_at}
-        message = StateLocation(target_addr, source_id, seq_num, payload, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[GetGroup]:
-        message = GetGroup(target_addr, source_id, seq_num, {}, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[StateGroup]:
-        group = [b for b in struct.unpack("<" + ("B"*16), payload_str[0:16])]
-        label = binascii.unhexlify("".join(["%2.2x" % (b & 0x000000ff) for b in struct.unpack("<" + ("b"*32), payload_str[16:48])])).replace(b'\x00', b'')
-        label = label.decode('utf-8')
-        updated_at = struct.unpack("<Q", payload_str[48:56])[0]
-        payload = {"group": group, "label": label, "updated_at": updated_at}
-        message = StateGroup(target_addr, source_id, seq_num, payload, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[GetVersion]:
-        message = GetVersion(target_addr, source_id, seq_num, {}, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[StateVersion]:
-        vendor = struct.unpack("<I", payload_str[0:4])[0]
-        product = struct.unpack("<I", payload_str[4:8])[0]
-        version = struct.unpack("<I", payload_str[8:12])[0]
-        payload = {"vendor": vendor, "product": product, "version": version}
-        message = StateVersion(target_addr, source_id, seq_num, payload, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[GetInfo]:
-        message = GetInfo(target_addr, source_id, seq_num, {}, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[StateInfo]:
-        time = struct.unpack("<Q", payload_str[0:8])[0]
-        uptime = struct.unpack("<Q", payload_str[8:16])[0]
-        downtime = struct.unpack("<Q", payload_str[16:24])[0]
-        payload = {"time": time, "uptime": uptime, "downtime": downtime}
-        message = StateInfo(target_addr, source_id, seq_num, payload, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[Acknowledgement]:
-        message = Acknowledgement(target_addr, source_id, seq_num, {}, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[EchoRequest]:
-        byte_array_len = len(payload_str)
-        byte_array = [b for b in struct.unpack("<" + ("B"*byte_array_len), payload_str[0:byte_array_len])]
-        payload = {"byte_array": byte_array}
-        message = EchoRequest(target_addr, source_id, seq_num, payload, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[EchoResponse]:
-        byte_array_len = len(payload_str)
-        byte_array = [b for b in struct.unpack("<" + ("B"*byte_array_len), payload_str[0:byte_array_len])]
-        payload = {"byte_array": byte_array}
-        message = EchoResponse(target_addr, source_id, seq_num, payload, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[LightGet]:
-        message = LightGet(target_addr, source_id, seq_num, {}, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[LightSetColor]:
-        reserved = struct.unpack("<B", payload_str[0:1])[0]
-        color = struct.unpack("<" + ("H"*4), payload_str[1:9])
-        duration = struct.unpack("<I", payload_str[9:13])[0]
-        payload = {"color": color, "duration": duration}
-        message = LightSetColor(target_addr, source_id, seq_num, payload, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[LightState]:
-        color = struct.unpack("<" + ("H"*4), payload_str[0:8])
-        reserved1 = struct.unpack("<H", payload_str[8:10])[0]
-        power_level = struct.unpack("<H", payload_str[10:12])[0]
-        label = binascii.unhexlify("".join(["%2.2x" % (b & 0x000000ff) for b in struct.unpack("<" + ("b"*32), payload_str[12:44])])).replace(b'\x00', b'')
-        label = label.decode('utf-8')
-        reserved2 = struct.unpack("<Q", payload_str[44:52])[0]
-        payload = {"color": color, "reserved1": reserved1, "power_level": power_level, "label": label, "reserved2": reserved2}
-        message = LightState(target_addr, source_id, seq_num, payload, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[LightGetPower]:
-        message = LightGetPower(target_addr, source_id, seq_num, {}, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[LightSetPower]:
-        power_level = struct.unpack("<H", payload_str[0:2])[0]
-        duration = struct.unpack("<I", payload_str[2:6])[0]
-        payload = {"power_level": power_level, "duration": duration}
-        message = LightSetPower(target_addr, source_id, seq_num, payload, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[LightStatePower]:
-        power_level = struct.unpack("<H", payload_str[0:2])[0]
-        payload = {"power_level": power_level}
-        message = LightStatePower(target_addr, source_id, seq_num, payload, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[LightGetInfrared]:  # 120
-        message = LightGetInfrared(target_addr, source_id, seq_num, {}, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[LightStateInfrared]:  # 121
-        infrared_brightness = struct.unpack("<H", payload_str[0:2])[0]
-        payload = {"infrared_brightness": infrared_brightness}
-        message = LightStateInfrared(target_addr, source_id, seq_num, payload, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[LightSetInfrared]:  # 122
-        infrared_brightness = struct.unpack("<H", payload_str[0:2])[0]
-        payload = {"infrared_brightness": infrared_brightness}
-        message = LightSetInfrared(target_addr, source_id, seq_num, payload, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[MultiZoneSetColorZones]: #501
-        start_index = struct.unpack("<c", payload_str[0:1])[0]
-        start_index = ord(start_index) # 8 bit
-        end_index = struct.unpack("<c", payload_str[1:2])[0]
-        end_index = ord(end_index) #8 bit
-        color = struct.unpack("<" + ("H" * 4), payload_str[2:10])
-        duration = struct.unpack("<I", payload_str[10:14])[0]
-        apply = struct.unpack("<c", payload_str[14:15])[0]
-        apply = ord(apply) #8 bit
-        payload = {"start_index": start_index, "end_index": end_index, "color": color, "duration": duration, "apply": apply}
-        message = MultiZoneSetColorZones(target_addr, source_id, seq_num, payload, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[MultiZoneGetColorZones]: #502
-        start_index = struct.unpack("<c", payload_str[0:1])[0]
-        start_index = ord(start_index) # 8 bit
-        end_index = struct.unpack("<c", payload_str[1:2])[0]
-        end_index = ord(end_index) #8 bit
-        payload = {"start_index": start_index, "end_index": end_index}
-        message = MultiZoneGetColorZones(target_addr, source_id, seq_num, payload, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[MultiZoneStateZone]: #503
-        count = struct.unpack("<c", payload_str[0:1])[0]
-        count = ord(count) # 8 bit
-        index = struct.unpack("<c", payload_str[1:2])[0]
-        index = ord(index) #8 bit
-        color = struct.unpack("<" + ("H" * 4), payload_str[2:10])
-        payload = {"count": count, "index": index, "color": color}
-        message = MultiZoneStateZone(target_addr, source_id, seq_num, payload, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[MultiZoneStateMultiZone]: #506
-        count = struct.unpack("<c", payload_str[0:1])[0]
-        count = ord(count) # 8 bit
-        index = struct.unpack("<c", payload_str[1:2])[0]
-        index = ord(index) #8 bit
-        colors = []
-        for i in range(8):
-            color = struct.unpack("<" + ("H" * 4), payload_str[2+(i*8):10+(i*8)])
-            colors.append(color)
-        payload = {"count": count, "index": index, "color": colors}
-        message = MultiZoneStateMultiZone(target_addr, source_id, seq_num, payload, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[GetMultiZoneEffect]: #507
-        message = GetMultiZoneEffect(target_addr, source_id, seq_num, payload, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[SetMultiZoneEffect]: #508
-        instanceid = struct.unpack("<I", payload_str[0:4])[0]
-        effect_type = struct.unpack("<B", payload_str[4:5])[0]
-        reserved1 = struct.unpack("<H", payload_str[5:7])[0]
-        speed = struct.unpack("<I", payload_str[7:11])[0]
-        duration = struct.unpack("<Q", payload_str[11:19])[0]
-        reserved2 = struct.unpack("<I", payload_str[19:23])[0]
-        reserved3 = struct.unpack("<I", payload_str[23:27])[0]
-        parameters = []
-        for i in range(8):
-            parameter = struct.unpack("<I", payload_str[27+(i*4):31+(i*4)])[0]
-            parameters.append(parameter)
-        payload = {"instanceid": instanceid, "type": effect_type, "reserved1": reserved1, "speed": speed,
-                   "duration": duration, "reserved2": reserved2, "reserved3": reserved3, "parameters": parameters}
-        message = SetMultiZoneEffect(target_addr, source_id, seq_num, payload, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[StateMultiZoneEffect]: #509
-        instanceid = struct.unpack("<I", payload_str[0:4])[0]
-        effect_type = struct.unpack("<B", payload_str[4:5])[0]
-        reserved1 = struct.unpack("<H", payload_str[5:7])[0]
-        speed = struct.unpack("<I", payload_str[7:11])[0]
-        duration = struct.unpack("<Q", payload_str[11:19])[0]
-        reserved2 = struct.unpack("<I", payload_str[19:23])[0]
-        reserved3 = struct.unpack("<I", payload_str[23:27])[0]
-        parameters = []
-        for i in range(8):
-            parameter = struct.unpack("<I", payload_str[27+(i*4):31+(i*4)])[0]
-            parameters.append(parameter)
-        payload = {"instanceid": instanceid, "type": effect_type, "reserved1": reserved1, "speed": speed,
-                   "duration": duration, "reserved2": reserved2, "reserved3": reserved3, "parameters": parameters}
-        message = StateMultiZoneEffect(target_addr, source_id, seq_num, payload, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[GetDeviceChain]: #701
-        message = GetDeviceChain(target_addr, source_id, seq_num, {}, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[StateDeviceChain]: #702
-        start_index = struct.unpack("<B", payload_str[0:1])[0]
-        tile_devices = []
-        tilesize_bytes = 55
-        for i in range(16):
-            offset = (i * tilesize_bytes)
-            tile = {"reserved1": struct.unpack("<h", payload_str[1+offset:3+offset])[0],
-                    "reserved2": struct.unpack("<h", payload_str[3+offset:5+offset])[0],
-                    "reserved3": struct.unpack("<h", payload_str[5+offset:7+offset])[0],
-                    "reserved4": struct.unpack("<h", payload_str[7+offset:9+offset])[0],
-                    "user_x": struct.unpack("<f", payload_str[9+offset:13+offset])[0],
-                    "user_y": struct.unpack("<f", payload_str[13+offset:17+offset])[0],
-                    "width": struct.unpack("<B", payload_str[17+offset:18+offset])[0],
-                    "height": struct.unpack("<B", payload_str[18+offset:19+offset])[0],
-                    "reserved5": struct.unpack("<B", payload_str[19+offset:20+offset])[0],
-                    "device_version_vendor": struct.unpack("<I", payload_str[20+offset:24+offset])[0],
-                    "device_version_product": struct.unpack("<I", payload_str[24+offset:28+offset])[0],
-                    "device_version_version": struct.unpack("<I", payload_str[28+offset:32+offset])[0],
-                    "firmware_build": struct.unpack("<Q", payload_str[32+offset:40+offset])[0],
-                    "reserved6": struct.unpack("<Q", payload_str[40+offset:48+offset])[0],
-                    "firmware_version": struct.unpack("<I", payload_str[48+offset:52+offset])[0],
-                    "reserved7": struct.unpack("<I", payload_str[52+offset:56+offset])[0]}
-            tile_devices.append(tile)
-        total_count = struct.unpack("<B", payload_str[881:882])[0]
-        payload = {"start_index": start_index, "total_count": total_count, "tile_devices": tile_devices}
-        message = StateDeviceChain(target_addr, source_id, seq_num, payload, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[SetUserPosition]: #703
-        tile_index = struct.unpack("<B", payload_str[0:1])[0]
-        reserved = struct.unpack("<H", payload_str[1:3])[0]
-        user_x = struct.unpack("<f", payload_str[3:7])[0]
-        user_y = struct.unpack("<f", payload_str[7:11])[0]
-        payload = {"tile_index": tile_index, "reserved": reserved, "user_x": user_x, "user_y": user_y}
-        message = SetUserPosition(target_addr, source_id, seq_num, payload, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[GetTileState64]: #707
-        tile_index = struct.unpack("<B", payload_str[0:1])[0]
-        length = struct.unpack("<B", payload_str[1:2])[0]
-        reserved = struct.unpack("<B", payload_str[2:3])[0]
-        x = struct.unpack("<B", payload_str[3:4])[0]
-        y = struct.unpack("<B", payload_str[4:5])[0]
-        width = struct.unpack("<B", payload_str[5:6])[0]
-        payload = {"tile_index": tile_index, "length": length, "reserved": reserved, "x": x, "y": y, "width": width}
-        message = GetTileState64(target_addr, source_id, seq_num, payload, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[StateTileState64]: #711
-        tile_index = struct.unpack("<B", payload_str[0:1])[0]
-        reserved = struct.unpack("<B", payload_str[1:2])[0]
-        x = struct.unpack("<B", payload_str[2:3])[0]
-        y = struct.unpack("<B", payload_str[3:4])[0]
-        width = struct.unpack("<B", payload_str[4:5])[0]
-        colors = []
-        for i in range(64):
-            color = struct.unpack("<" + ("H" * 4), payload_str[5+(i*8):13+(i*8)])
-            colors.append(color)
-        payload = {"tile_index": tile_index, "reserved": reserved, "x": x, "y": y, "width": width, "colors": colors}
-        message = StateTileState64(target_addr, source_id, seq_num, payload, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[SetTileState64]: #715
-        tile_index = struct.unpack("<B", payload_str[0:1])[0]
-        length = struct.unpack("<B", payload_str[1:2])[0]
-        reserved = struct.unpack("<B", payload_str[2:3])[0]
-        x = struct.unpack("<B", payload_str[3:4])[0]
-        y = struct.unpack("<B", payload_str[4:5])[0]
-        width = struct.unpack("<B", payload_str[5:6])[0]
-        duration = struct.unpack("<I", payload_str[6:10])[0]
-        colors = []
-        for i in range(64):
-            color = struct.unpack("<" + ("H" * 4), payload_str[10+(i*8):18+(i*8)])
-            colors.append(color)
-        payload = {"tile_index": tile_index, "length": length, "reserved": reserved, "x": x, "y": y, "width": width, "duration": duration, "colors": colors}
-        message = SetTileState64(target_addr, source_id, seq_num, payload, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[GetTileEffect]: #718
-        message = GetTileEffect(target_addr, source_id, seq_num, payload, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[SetTileEffect]: #719
-        reserved1 = struct.unpack("<B", payload_str[0:1])[0]
-        reserved2 = struct.unpack("<B", payload_str[1:2])[0]
-        instanceid = struct.unpack("<I", payload_str[2:6])[0]
-        effect_type = struct.unpack("<B", payload_str[6:7])[0]
-        speed = struct.unpack("<I", payload_str[7:11])[0]
-        duration = struct.unpack("<Q", payload_str[11:19])[0]
-        reserved3 = struct.unpack("<I", payload_str[19:23])[0]
-        reserved4 = struct.unpack("<I", payload_str[23:27])[0]
-        parameters = []
-        for i in range(8):
-            parameter = struct.unpack("<I", payload_str[27+(i*4):31+(i*4)])[0]
-            parameters.append(parameter)
-        palette_count = struct.unpack("<B", payload_str[59:60])[0]
-        palette = []
-        for i in range(palette_count):
-            color = struct.unpack("<" + ("H" * 4), payload_str[60+(i*8):68+(i*8)])
-            palette.append(color)
-        payload = {"reserved1": reserved1, "reserved2": reserved2, "instanceid": instanceid, "type": effect_type, "speed": speed, "duration": duration,
-                   "reserved3": reserved3, "reserved4": reserved4, "parameters": parameters, "palette_count": palette_count, "palette": palette}
-        message = SetTileEffect(target_addr, source_id, seq_num, payload, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[StateTileEffect]: #720
-        reserved1 = struct.unpack("<B", payload_str[0:1])[0]
-        instanceid = struct.unpack("<I", payload_str[1:5])[0]
-        effect_type = struct.unpack("<B", payload_str[5:6])[0]
-        speed = struct.unpack("<I", payload_str[6:10])[0]
-        duration = struct.unpack("<Q", payload_str[10:18])[0]
-        reserved2 = struct.unpack("<I", payload_str[18:22])[0]
-        reserved3 = struct.unpack("<I", payload_str[22:26])[0]
-        parameters = []
-        for i in range(8):
-            parameter = struct.unpack("<I", payload_str[26+(i*4):30+(i*4)])[0]
-            parameters.append(parameter)
-        palette_count = struct.unpack("<B", payload_str[58:59])[0]
-        palette = []
-        for i in range(palette_count):
-            color = struct.unpack("<" + ("H" * 4), payload_str[59+(i*8):67+(i*8)])
-            palette.append(color)
-        payload = {"reserved1": reserved1, "instanceid": instanceid, "type": effect_type, "speed": speed, "duration": duration,
-                   "reserved2": reserved2, "reserved3": reserved3, "parameters": parameters, "palette_count": palette_count, "palette": palette}
-        message = StateTileEffect(target_addr, source_id, seq_num, payload, ack_requested, response_requested)
 
+    entry = DECODERS.get(message_type)
+    lazy = lazy and entry != None and entry[1] != None # nothing to defer for messages without a payload
+    if lazy:
+        message = entry[0].__new__(entry[0])
+        message.message_type = message_type
+        message.target_addr = target_addr
+        message.seq_num = seq_num
+        message.ack_requested = ack_requested
+        message.response_requested = response_requested
+        message.payload_fields = []
+        message.decode_payload = decode_lazy_payload
+    elif entry == None:
+        message = new_received_message(Message, packed_message, message_type, target_addr, source_id, seq_num, ack_requested, response_requested)
     else:
-        message = Message(message_type, target_addr, source_id, seq_num, ack_requested, response_requested)
+        msg_type, decoder = entry
+        payload = decoder(packed_message, HEADER_SIZE_BYTES) if decoder != None else {}
+        message = new_received_message(msg_type, packed_message, target_addr, source_id, seq_num, payload, ack_requested, response_requested)
 
     message.size = size
     message.origin = origin
@@ -421,8 +67,249 @@ def unpack_lifx_message(packed_message):
     message.addressable = addressable
     message.protocol = protocol
     message.source_id = source_id
-    message.header = header_str
-    message.payload = payload_str
     message.packed_message = packed_message
+    if not lazy:
+        message.header = packed_message[0:HEADER_SIZE_BYTES]
+        message.payload = packed_message[HEADER_SIZE_BYTES:]
+
+    return message
+
 
+# Builds a message around bytes we received. packed_message is attached before
+# __init__ runs so that Message.__init__ doesn't pack the decoded payload again.
+def new_received_message(msg_type, packed_message, *args):
+    message = msg_type.__new__(msg_type)
+    message.packed_message = packed_message
+    message.__init__(*args)
     return message
+
+
+# Fills in the payload fields of a message unpacked with lazy=True. The fields
+# are decoded into a throwaway message and copied over in one update, so the
+# header fields are left alone and a concurrent reader never sees a partially
+# decoded message.
+def decode_lazy_payload(message):
+    if SUBSCRIBERS:
+        trace_call("decode_payload", {"msg_type": type(message).__name__}, lambda: decode_payload_now(message))
+    else:
+        decode_payload_now(message)
+
+def decode_payload_now(message):
+    packed_message = message.packed_message
+    msg_type, decoder = DECODERS[message.message_type]
+    payload = decoder(memoryview(packed_message), HEADER_SIZE_BYTES)
+    decoded = new_received_message(msg_type, packed_message, message.target_addr, message.source_id, message.seq_num,
+                                   payload, message.ack_requested, message.response_requested)
+    fields = dict((k, v) for (k, v) in vars(decoded).items() if k not in message.__dict__)
+    fields["header"] = packed_message[0:HEADER_SIZE_BYTES]
+    fields["payload"] = packed_message[HEADER_SIZE_BYTES:]
+    message.__dict__.update(fields)
+    message.__dict__.pop("decode_payload", None)
+
+# Decodes the payload of a message unpacked with lazy=True now, if it hasn't
+# been already (e.g. before handing the message to other threads).
+def materialize(message):
+    decode_payload = message.__dict__.get("decode_payload")
+    if decode_payload != None:
+        decode_payload(message)
+    return message
+
+################################################################################
+#                                                                              #
+#                              Decoder Helpers                                 #
+#                                                                              #
+################################################################################
+
+# Builds a decoder for payloads made only of scalar fields, in wire order.
+def fields_decoder(fmt, names):
+    s = struct.Struct("<" + fmt)
+    def decoder(packed_message, offset):
+        return dict(zip(names, s.unpack_from(packed_message, offset)))
+    return decoder
+
+# groups a flat run of uint16s into (H, S, B, K) tuples
+def hsbk_list(values, start, count):
+    return [tuple(values[start+(i*4):start+(i*4)+4]) for i in range(count)]
+
+def decode_label(raw):
+    return raw.replace(b'\x00', b'').decode('utf-8')
+
+HSBK_ARRAY_STRUCTS = [struct.Struct("<" + ("4H"*n)) for n in range(17)] # tile effect palettes, 0-16 colors
+
+
+################################################################################
+#                                                                              #
+#                              Payload Decoders                                #
+#                                                                              #
+################################################################################
+
+##### DEVICE MESSAGES #####
+
+LABEL_STRUCT = struct.Struct("<32s")
+def decode_label_payload(packed_message, offset):
+    return {"label": decode_label(LABEL_STRUCT.unpack_from(packed_message, offset)[0])}
+
+STATE_LOCATION_STRUCT = struct.Struct("<16B32sQ")
+def decode_state_location(packed_message, offset):
+    values = STATE_LOCATION_STRUCT.unpack_from(packed_message, offset)
+    return {"location": list(values[0:16]), "label": decode_label(values[16]), "updated_at": values[17]}
+
+def decode_state_group(packed_message, offset):
+    values = STATE_LOCATION_STRUCT.unpack_from(packed_message, offset)
+    return {"group": list(values[0:16]), "label": decode_label(values[16]), "updated_at": values[17]}
+
+def decode_byte_array(packed_message, offset):
+    return {"byte_array": list(packed_message[offset:])}
+
+##### LIGHT MESSAGES #####
+
+LIGHT_SET_COLOR_STRUCT = struct.Struct("<B4HI")
+def decode_light_set_color(packed_message, offset):
+    values = LIGHT_SET_COLOR_STRUCT.unpack_from(packed_message, offset)
+    return {"color": values[1:5], "duration": values[5]}
+
+LIGHT_SET_WAVEFORM_STRUCT = struct.Struct("<BB4HIfhB")
+def decode_light_set_waveform(packed_message, offset):
+    values = LIGHT_SET_WAVEFORM_STRUCT.unpack_from(packed_message, offset)
+    return {"transient": values[1], "color": values[2:6], "period": values[6], "cycles": values[7],
+            "duty_cycle": values[8], "waveform": values[9]}
+
+LIGHT_STATE_STRUCT = struct.Struct("<4HHH32sQ")
+def decode_light_state(packed_message, offset):
+    values = LIGHT_STATE_STRUCT.unpack_from(packed_message, offset)
+    return {"color": values[0:4], "reserved1": values[4], "power_level": values[5], "label": decode_label(values[6]),
+            "reserved2": values[7]}
+
+##### MULTIZONE MESSAGES #####
+
+SET_COLOR_ZONES_STRUCT = struct.Struct("<BB4HIB")
+def decode_set_color_zones(packed_message, offset):
+    values = SET_COLOR_ZONES_STRUCT.unpack_from(packed_message, offset)
+    return {"start_index": values[0], "end_index": values[1], "color": values[2:6], "duration": values[6], "apply": values[7]}
+
+STATE_ZONE_STRUCT = struct.Struct("<BB4H")
+def decode_state_zone(packed_message, offset):
+    values = STATE_ZONE_STRUCT.unpack_from(packed_message, offset)
+    return {"count": values[0], "index": values[1], "color": values[2:6]}
+
+STATE_MULTIZONE_STRUCT = struct.Struct("<BB32H")
+def decode_state_multizone(packed_message, offset):
+    values = STATE_MULTIZONE_STRUCT.unpack_from(packed_message, offset)
+    return {"count": values[0], "index": values[1], "color": hsbk_list(values, 2, 8)}
+
+MULTIZONE_EFFECT_STRUCT = struct.Struct("<IBHIQII8I")
+def decode_multizone_effect(packed_message, offset):
+    values = MULTIZONE_EFFECT_STRUCT.unpack_from(packed_message, offset)
+    return {"instanceid": values[0], "type": values[1], "reserved1": values[2], "speed": values[3],
+            "duration": values[4], "reserved2": values[5], "reserved3": values[6], "parameters": list(values[7:15])}
+
+SET_EXTENDED_COLOR_ZONES_STRUCT = struct.Struct("<IBHB328H")
+def decode_set_extended_color_zones(packed_message, offset):
+    values = SET_EXTENDED_COLOR_ZONES_STRUCT.unpack_from(packed_message, offset)
+    return {"duration": values[0], "apply": values[1], "zone_index": values[2], "colors_count": values[3],
+            "colors": hsbk_list(values, 4, 82)}
+
+STATE_EXTENDED_COLOR_ZONES_STRUCT = struct.Struct("<HHB328H")
+def decode_state_extended_color_zones(packed_message, offset):
+    values = STATE_EXTENDED_COLOR_ZONES_STRUCT.unpack_from(packed_message, offset)
+    return {"zones_count": values[0], "zone_index": values[1], "colors_count": values[2], "colors": hsbk_list(values, 3, 82)}
+
+##### TILE MESSAGES #####
+
+TILE_DEVICE_FIELDS = ("reserved1", "reserved2", "reserved3", "reserved4", "user_x", "user_y", "width", "height",
+                      "reserved5", "device_version_vendor", "device_version_product", "device_version_version",
+                      "firmware_build", "reserved6", "firmware_version", "reserved7")
+STATE_DEVICE_CHAIN_STRUCT = struct.Struct("<B" + ("4h2f3B3I2Q2I"*16) + "B")
+def decode_state_device_chain(packed_message, offset):
+    values = STATE_DEVICE_CHAIN_STRUCT.unpack_from(packed_message, offset)
+    n = len(TILE_DEVICE_FIELDS)
+    tile_devices = [dict(zip(TILE_DEVICE_FIELDS, values[1+(i*n):1+(i*n)+n])) for i in range(16)]
+    return {"start_index": values[0], "total_count": values[-1], "tile_devices": tile_devices}
+
+STATE_TILE_STATE_STRUCT = struct.Struct("<5B256H")
+def decode_state_tile_state(packed_message, offset):
+    values = STATE_TILE_STATE_STRUCT.unpack_from(packed_message, offset)
+    return {"tile_index": values[0], "reserved": values[1], "x": values[2], "y": values[3], "width": values[4],
+            "colors": hsbk_list(values, 5, 64)}
+
+SET_TILE_STATE_STRUCT = struct.Struct("<6BI256H")
+def decode_set_tile_state(packed_message, offset):
+    values = SET_TILE_STATE_STRUCT.unpack_from(packed_message, offset)
+    return {"tile_index": values[0], "length": values[1], "reserved": values[2], "x": values[3], "y": values[4],
+            "width": values[5], "duration": values[6], "colors": hsbk_list(values, 7, 64)}
+
+SET_TILE_EFFECT_STRUCT = struct.Struct("<BBIBIQII8IB")
+def decode_set_tile_effect(packed_message, offset):
+    values = SET_TILE_EFFECT_STRUCT.unpack_from(packed_message, offset)
+    palette_count = values[16]
+    palette_values = HSBK_ARRAY_STRUCTS[min(palette_count, 16)].unpack_from(packed_message, offset + SET_TILE_EFFECT_STRUCT.size)
+    return {"reserved1": values[0], "reserved2": values[1], "instanceid": values[2], "type": values[3], "speed": values[4],
+            "duration": values[5], "reserved3": values[6], "reserved4": values[7], "parameters": list(values[8:16]),
+            "palette_count": palette_count, "palette": hsbk_list(palette_values, 0, min(palette_count, 16))}
+
+STATE_TILE_EFFECT_STRUCT = struct.Struct("<BIBIQII8IB")
+def decode_state_tile_effect(packed_message, offset):
+    values = STATE_TILE_EFFECT_STRUCT.unpack_from(packed_message, offset)
+    palette_count = values[15]
+    palette_values = HSBK_ARRAY_STRUCTS[min(palette_count, 16)].unpack_from(packed_message, offset + STATE_TILE_EFFECT_STRUCT.size)
+    return {"reserved1": values[0], "instanceid": values[1], "type": values[2], "speed": values[3], "duration": values[4],
+            "reserved2": values[5], "reserved3": values[6], "parameters": list(values[7:15]),
+            "palette_count": palette_count, "palette": hsbk_list(palette_values, 0, min(palette_count, 16))}
+
+
+register_decoder(GetService)
+register_decoder(StateService, fields_decoder("BI", ("service", "port")))
+register_decoder(GetHostInfo)
+register_decoder(StateHostInfo, fields_decoder("fIIh", ("signal", "tx", "rx", "reserved1")))
+register_decoder(GetHostFirmware)
+register_decoder(StateHostFirmware, fields_decoder("QQI", ("build", "reserved1", "version")))
+register_decoder(GetWifiInfo)
+register_decoder(StateWifiInfo, fields_decoder("fIIh", ("signal", "tx", "rx", "reserved1")))
+register_decoder(GetWifiFirmware)
+register_decoder(StateWifiFirmware, fields_decoder("QQI", ("build", "reserved1", "version")))
+register_decoder(GetPower)
+register_decoder(SetPower, fields_decoder("H", ("power_level",)))
+register_decoder(StatePower, fields_decoder("H", ("power_level",)))
+register_decoder(GetLabel)
+register_decoder(SetLabel, decode_label_payload)
+register_decoder(StateLabel, decode_label_payload)
+register_decoder(GetLocation)
+register_decoder(StateLocation, decode_state_location)
+register_decoder(GetGroup)
+register_decoder(StateGroup, decode_state_group)
+register_decoder(GetVersion)
+register_decoder(StateVersion, fields_decoder("III", ("vendor", "product", "version")))
+register_decoder(GetInfo)
+register_decoder(StateInfo, fields_decoder("QQQ", ("time", "uptime", "downtime")))
+register_decoder(Acknowledgement)
+register_decoder(EchoRequest, decode_byte_array)
+register_decoder(EchoResponse, decode_byte_array)
+register_decoder(LightGet)
+register_decoder(LightSetColor, decode_light_set_color)
+register_decoder(LightSetWaveform, decode_light_set_waveform)
+register_decoder(LightState, decode_light_state)
+register_decoder(LightGetPower)
+register_decoder(LightSetPower, fields_decoder("HI", ("power_level", "duration")))
+register_decoder(LightStatePower, fields_decoder("H", ("power_level",)))
+register_decoder(LightGetInfrared)
+register_decoder(LightStateInfrared, fields_decoder("H", ("infrared_brightness",)))
+register_decoder(LightSetInfrared, fields_decoder("H", ("infrared_brightness",)))
+register_decoder(MultiZoneSetColorZones, decode_set_color_zones)
+register_decoder(MultiZoneGetColorZones, fields_decoder("BB", ("start_index", "end_index")))
+register_decoder(MultiZoneStateZone, decode_state_zone)
+register_decoder(MultiZoneStateMultiZone, decode_state_multizone)
+register_decoder(GetMultiZoneEffect)
+register_decoder(SetMultiZoneEffect, decode_multizone_effect)
+register_decoder(StateMultiZoneEffect, decode_multizone_effect)
+register_decoder(MultiZoneSetExtendedColorZones, decode_set_extended_color_zones)
+register_decoder(MultiZoneGetExtendedColorZones)
+register_decoder(MultiZoneStateExtendedColorZones, decode_state_extended_color_zones)
+register_decoder(GetDeviceChain)
+register_decoder(StateDeviceChain, decode_state_device_chain)
+register_decoder(SetUserPosition, fields_decoder("BHff", ("tile_index", "reserved", "user_x", "user_y")))
+register_decoder(GetTileState64, fields_decoder("6B", ("tile_index", "length", "reserved", "x", "y", "width")))
+register_decoder(StateTileState64, decode_state_tile_state)
+register_decoder(SetTileState64, decode_set_tile_state)
+register_decoder(GetTileEffect)
+register_decoder(SetTileEffect, decode_set_tile_effect)
+register_decoder(StateTileEffect, decode_state_tile_effect)
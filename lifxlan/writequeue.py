@@ -0,0 +1,77 @@
+# coding=utf-8
+# writequeue.py
+# Latest-wins coalescing of writes to a device.
+#
+# A slider dragged in a UI fires many writes of the same kind (e.g. the color
+# of the same zones) in a row. Sent one after the other, each waiting for its
+# ack, they pile up and the device lags further and further behind. Writes that
+# go through a WriteQueue are keyed (message type, zone range, ...): while a
+# write with some key is on the wire, only the newest write with the same key
+# is kept to be sent after it, and the ones it replaces are dropped (elided).
+#
+# Every write gets a Future. A dropped write's future is resolved with the
+# outcome of the write that replaced it, so whoever waits on it returns once
+# the state they asked for, or a newer one, has been acknowledged.
+
+from concurrent.futures import Future
+from threading import Lock
+
+class WriteQueue(object):
+    def __init__(self):
+        self.lock = Lock()
+        self.in_flight = {} # key -> Future of the write on the wire
+        self.pending = {} # key -> (send, Future) of the write to send after it
+        self.elided = 0 # writes dropped because a newer one replaced them
+
+    # send() starts the write and returns a Future for its result; it is called
+    # right away if no write with the same key is on the wire, later or never
+    # otherwise. Returns a Future.
+    def submit(self, key, send):
+        future = Future()
+        with self.lock:
+            if key in self.in_flight:
+                replaced = self.pending.get(key)
+                self.pending[key] = (send, future)
+                if replaced != None:
+                    self.elided += 1
+                    future.add_done_callback(lambda done: copy_outcome(done, replaced[1]))
+                return future
+            self.in_flight[key] = future
+        self.start(key, send, future)
+        return future
+
+    def start(self, key, send, future):
+        try:
+            sent = send()
+        except Exception as err:
+            sent = Future()
+            sent.set_exception(err)
+        sent.add_done_callback(lambda done: self.finish(key, done, future))
+
+    # Resolves future once its write is done and sends the write that was
+    # waiting behind it, if any.
+    def finish(self, key, sent, future):
+        with self.lock:
+            next_write = self.pending.pop(key, None)
+            if next_write == None:
+                del self.in_flight[key]
+            else:
+                self.in_flight[key] = next_write[1]
+        copy_outcome(sent, future)
+        if next_write != None:
+            self.start(key, *next_write)
+
+    def __len__(self):
+        with self.lock:
+            return len(self.pending)
+
+# Resolves future with the result or exception of the done future source
+def copy_outcome(source, future):
+    if future.done():
+        return
+    if source.cancelled():
+        future.cancel()
+    elif source.exception() != None:
+        future.set_exception(source.exception())
+    else:
+        future.set_result(source.result())
@@ -22,6 +22,7 @@ import homeassistant.util.color as color_util
 
 from .lifxlan import LifxLAN
 from .lifxlan import MultiZoneLight
+from .lifxlan import WorkflowException
 
 from .const import (
     DOMAIN,
@@ -48,6 +49,10 @@ PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend({
 lifx = LifxLAN()
 lifx.discover_devices()
 
+# One MultiZoneLight per strip MAC, shared by the virtual lights of the strip
+# so that they also share its cached state (zone count, fresh replies).
+_STRIPS = {}
+
 def setup_platform(hass, config, add_entities, discovery_info=None):
     # Assign configuration variables.
     # The configuration check takes care they are present.
@@ -186,7 +191,9 @@ class LIFXVirtualLight(LightEntity):
             self._mz_light.set_color([h, s, 0, k])
             self._mz_light.set_power(True)
 
-        self._mz_light.set_zone_color(self._zone_start, self._zone_end, [h, s, b, k], 500)
+        # A dragged slider calls turn_on faster than the strip acks; only the
+        # latest color waiting to be sent is kept.
+        self._mz_light.set_zone_color(self._zone_start, self._zone_end, [h, s, b, k], 500, coalesce=True)
 
         # Avoid state ping-pong by holding off updates as the state settles
         time.sleep(0.3)
@@ -196,19 +203,31 @@ class LIFXVirtualLight(LightEntity):
 
         self.stop_running_effect_if_needed()
 
-        # Set brightness to 0 and update the state (both the reduced
-        # one and the whole strip).
+        # Set brightness to 0 and update the state.
         self._hsbk[2] = 0
-        for i in range(self._zone_start, self._zone_end):
+        for i in range(len(self._current_color_zones)):
             self._current_color_zones[i] = self._hsbk
 
         # Effectively set the state on the srip.
-        self._mz_light.set_zone_color(self._zone_start, self._zone_end, self._hsbk, 500)
+        self._mz_light.set_zone_color(self._zone_start, self._zone_end, self._hsbk, 500, coalesce=True)
 
         # If the strip has no zones whose brightness is >=0 we can turn the
-        # whole strip off.
-        zones_lit = list(filter(lambda x: x[2] > 0, self._current_color_zones))
-        if len(zones_lit) == 0:
+        # whole strip off. The virtual lights of the strip share its
+        # MultiZoneLight, which remembers the zones their update() read, so
+        # the strip is only read if some zones were never read. If it doesn't
+        # answer, the zones we know of have to do.
+        zone_colors = self._mz_light.zone_colors
+        if zone_colors is None or None in zone_colors:
+            try:
+                self._mz_light.get_color_zones()
+            except WorkflowException:
+                _LOGGER.error("Received error while reading the whole strip. Possibly offline? " + self._target_mac_address)
+        # our zones are dark now, also for the other virtual lights of the strip
+        all_zones = self._mz_light.zone_colors or []
+        for i in range(self._zone_start, min(self._zone_end, len(all_zones))):
+            all_zones[i] = tuple(self._hsbk)
+        zones_lit = list(filter(lambda x: x is not None and x[2] > 0, all_zones))
+        if len(all_zones) > 0 and len(zones_lit) == 0:
             self._mz_light.set_power(False)
 
         # Avoid state ping-pong by holding off updates as the state settles
@@ -220,6 +239,8 @@ class LIFXVirtualLight(LightEntity):
         # We have no light, because we're starting up or because the
         # light went offline earlier. Try to find it again by filtering
         # the whole LAN.
+        if self._mz_light is None:
+            self._mz_light = _STRIPS.get(self._target_mac_address)
         if self._mz_light is None:
             multizone_lights = lifx.get_multizone_lights()
             _LOGGER.info("Found mz lights: " + str(len(multizone_lights)))
@@ -232,6 +253,10 @@ class LIFXVirtualLight(LightEntity):
                 return
 
             self._mz_light = matching_lights[0]
+            # Several virtual lights poll the same strip at about the same
+            # time; let them share the replies of the last second.
+            self._mz_light.response_freshness_secs = 1
+            _STRIPS[self._target_mac_address] = self._mz_light
 
         # At this point, we should have a valid light (cached). Use
         # a try block to catch the exception, which means that the
@@ -239,9 +264,12 @@ class LIFXVirtualLight(LightEntity):
         # on the actual exception, but 99% is that and the only thing we
         # can do is to try the whole thing again anyway).
         try:
-            self._current_color_zones = self._mz_light.get_color_zones()
+            self._current_color_zones = self._mz_light.get_color_zones(self._zone_start, self._zone_end)
         except:
             _LOGGER.error("Received error while updating color zones. Possibly offline? " + self._target_mac_address)
+            # find it again next time, it may have come back with another address
+            if _STRIPS.get(self._target_mac_address) is self._mz_light:
+                del _STRIPS[self._target_mac_address]
             self._mz_light = None
             self._available = False
             return
@@ -253,7 +281,7 @@ class LIFXVirtualLight(LightEntity):
         saturation_values = set()
         brightness_values = set()
         kelvin_values = set()
-        for zone in self._current_color_zones[self._zone_start:self._zone_end]:
+        for zone in self._current_color_zones:
             hue_values.add(zone[0])
             saturation_values.add(zone[1])
             brightness_values.add(zone[2])
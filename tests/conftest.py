@@ -0,0 +1,38 @@
+# coding=utf-8
+# conftest.py
+# Fixtures for the tests that talk to virtual devices (see emulator.py):
+#
+#   emulator   starts an Emulator on free ports: emulator(*devices, latency=...)
+#              returns it running, with the devices added. Closed after the test.
+#   transport  a Transport of its own, closed after the test.
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from lifxlan.transport import Transport
+from emulator import Emulator
+
+
+@pytest.fixture
+def emulator():
+    emulators = []
+    def start(*devices, **kwargs):
+        emulator = Emulator(port=0, **kwargs)
+        emulators.append(emulator)
+        for device in devices:
+            emulator.add_device(device)
+        return emulator.start()
+    yield start
+    for emulator in emulators:
+        emulator.close()
+
+
+@pytest.fixture
+def transport():
+    transport = Transport()
+    yield transport
+    transport.close()
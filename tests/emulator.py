@@ -0,0 +1,509 @@
+# coding=utf-8
+# emulator.py
+# Virtual LIFX devices on localhost, to benchmark and test without hardware.
+#
+# An Emulator runs any number of virtual devices in one process, all served by
+# a single thread waiting on a selector. Each device binds its own UDP port on
+# 127.0.0.1 and keeps real state: what a Set message changes, the next Get
+# reads back. A discovery socket, bound to the port LifxLAN broadcasts to,
+# hands every packet it gets to all the devices, like a broadcast on a LAN, so
+# discovery and the broadcast methods work too. Packets are decoded with
+# unpack.py and replies are built with the msgtypes classes.
+#
+# The network and the firmware can be made worse on purpose: every packet a
+# device sends is delayed by latency plus or minus a random jitter (so replies
+# can arrive out of order), each packet is lost with probability loss, both
+# ways, and a token bucket per device drops what comes in faster than
+# rate_limit packets per second, like the firmware does.
+#
+# It lives with the tests, not in the lifxlan package. With tests/ on sys.path
+# (the tests and benchmarks/end_to_end.py put it there):
+#
+#   from emulator import Emulator, EmulatedMultiZoneLight, EmulatedTileChain, emulated_mac
+#
+#   emulator = Emulator(latency=0.005, jitter=0.002, loss=0.01)
+#   emulator.add_devices(EmulatedMultiZoneLight, 10, zone_count=82)
+#   emulator.add_device(EmulatedTileChain(emulated_mac(100), tile_positions=[(0, 0), (1, 0)]))
+#   emulator.start()
+#   UDP_BROADCAST_IP_ADDRS.set_addrs(["127.0.0.1"])
+#   lights = LifxLAN().get_lights()
+#   ...
+#   emulator.close()
+
+import heapq
+import random
+from itertools import count
+from selectors import EVENT_READ, DefaultSelector
+from socket import AF_INET, SOCK_DGRAM, error, socket, socketpair
+from threading import Thread
+from time import sleep, time
+
+from lifxlan.device import UDP_BROADCAST_PORT, is_get_message
+from lifxlan.errors import WorkflowException
+from lifxlan.message import BROADCAST_MAC, convert_MAC_to_bytes
+from lifxlan.msgtypes import *
+from lifxlan.transport import DEFAULT_BURST, DEFAULT_RATE_LIMIT, RECEIVE_POLL_SECS, RECV_BUFFER_SIZE, TokenBucket
+from lifxlan.unpack import decode_message
+
+EMULATOR_IP_ADDR = "127.0.0.1"
+
+# A distinct MAC address for the index-th virtual device
+def emulated_mac(index):
+    return "d0:73:d5:{:02x}:{:02x}:{:02x}".format((index >> 16) & 0xff, (index >> 8) & 0xff, index & 0xff)
+
+# A client object of device_class (Light, MultiZoneLight...) for the emulated
+# device, without discovery
+def connect(device_class, emulated, transport=None):
+    return device_class(emulated.mac_addr, EMULATOR_IP_ADDR, port=emulated.port, transport=transport)
+
+# Waits until condition() is true, e.g. until an emulated device got what was
+# sent to it, for up to timeout seconds
+def wait_until(condition, timeout=2):
+    end = time() + timeout
+    while not condition():
+        if time() > end:
+            raise AssertionError("timed out waiting for the emulator")
+        sleep(0.001)
+
+class Emulator(object):
+    # port is where the discovery socket listens (0 for any free port, then
+    # point lifxlan.lifxlan.UDP_BROADCAST_PORT at emulator.port).
+    # rate_limit=None doesn't limit anything.
+    def __init__(self, port=UDP_BROADCAST_PORT, latency=0, jitter=0, loss=0, rate_limit=DEFAULT_RATE_LIMIT, burst=DEFAULT_BURST, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.rate_limit = rate_limit
+        self.burst = burst
+        self.random = random.Random(seed)
+        self.devices = []
+        self.selector = DefaultSelector()
+        self.discovery_socket = self.open_socket(port)
+        self.port = self.discovery_socket.getsockname()[1]
+        self.selector.register(self.discovery_socket, EVENT_READ, None)
+        self.wakeup_sockets = socketpair()
+        for wakeup_socket in self.wakeup_sockets:
+            wakeup_socket.setblocking(False)
+        self.selector.register(self.wakeup_sockets[0], EVENT_READ, self.wakeup_sockets[0])
+        self.scheduled = [] # heap of (send time, tiebreak, socket, packet, addr)
+        self.tiebreak = count()
+        self.thread = None
+        self.closed = False
+
+    def open_socket(self, port=0):
+        sock = socket(AF_INET, SOCK_DGRAM)
+        try:
+            sock.bind((EMULATOR_IP_ADDR, port))
+        except Exception as err:
+            sock.close()
+            raise WorkflowException("WorkflowException: error {} while trying to open emulator socket on port {}".format(str(err), port))
+        sock.setblocking(False)
+        return sock
+
+    # Binds device to a port of its own. Devices can be added while the
+    # emulator runs.
+    def add_device(self, device):
+        device.socket = self.open_socket()
+        device.port = device.socket.getsockname()[1]
+        device.bucket = TokenBucket(self.rate_limit, self.burst)
+        self.devices.append(device)
+        self.selector.register(device.socket, EVENT_READ, device)
+        self.wake()
+        return device
+
+    # Adds count devices of class device_class, with MAC addresses following
+    # the ones already there; kwargs go to the constructor. Returns them.
+    def add_devices(self, device_class, count, **kwargs):
+        first = len(self.devices) + 1
+        return [self.add_device(device_class(emulated_mac(first + i), **kwargs)) for i in range(count)]
+
+    def start(self):
+        if self.thread == None:
+            self.thread = Thread(target=self.run)
+            self.thread.daemon = True
+            self.thread.start()
+        return self
+
+    def close(self):
+        self.closed = True
+        self.wake()
+        if self.thread != None:
+            self.thread.join()
+            self.thread = None
+        for device in self.devices:
+            device.socket.close()
+        self.discovery_socket.close()
+        for wakeup_socket in self.wakeup_sockets:
+            wakeup_socket.close()
+        self.selector.close()
+
+    def wake(self):
+        try:
+            self.wakeup_sockets[1].send(b"\0")
+        except error:
+            pass
+
+    def run(self):
+        while not self.closed:
+            wait = RECEIVE_POLL_SECS
+            if self.scheduled:
+                wait = max(0, min(wait, self.scheduled[0][0] - time()))
+            for (key, events) in self.selector.select(wait):
+                if key.data is self.wakeup_sockets[0]:
+                    self.drain(key.fileobj)
+                elif not self.closed:
+                    self.receive(key.fileobj, key.data)
+            self.send_due(time())
+
+    def drain(self, sock):
+        try:
+            while sock.recv(RECV_BUFFER_SIZE):
+                pass
+        except error:
+            pass
+
+    # Reads what is waiting on sock: the socket of device, or the discovery
+    # socket (device None), whose packets go to every device.
+    def receive(self, sock, device):
+        while True:
+            try:
+                data, addr = sock.recvfrom(RECV_BUFFER_SIZE)
+            except error:
+                return
+            try:
+                message = decode_message(data)
+            except Exception: # not a LIFX packet
+                continue
+            for target in (self.devices if device == None else [device]):
+                self.deliver(target, message, addr)
+
+    def deliver(self, device, message, addr):
+        if message.target_addr != device.mac_addr and message.target_addr != BROADCAST_MAC:
+            return
+        device.received += 1
+        if self.loss > 0 and self.random.random() < self.loss:
+            device.lost += 1
+            return
+        if device.bucket.take(time()) > 0:
+            device.throttled += 1
+            return
+        replies = device.handle(message)
+        if message.ack_requested:
+            self.reply(device, message, addr, Acknowledgement, {})
+        if replies and (message.response_requested or is_get_message(type(message))):
+            for (reply_type, payload) in replies:
+                self.reply(device, message, addr, reply_type, payload)
+
+    def reply(self, device, message, addr, reply_type, payload):
+        reply = reply_type(device.mac_addr, message.source_id, message.seq_num, payload)
+        packet = reply.packed_message
+        if reply.target_addr != device.mac_addr: # the tile messages force the broadcast MAC
+            packet = bytearray(packet)
+            packet[8:14] = convert_MAC_to_bytes(device.mac_addr)
+            packet = bytes(packet)
+        if self.loss > 0 and self.random.random() < self.loss:
+            device.lost += 1
+            return
+        device.sent += 1
+        delay = self.latency
+        if self.jitter > 0:
+            delay = max(0, delay + self.random.uniform(-self.jitter, self.jitter))
+        if delay > 0:
+            heapq.heappush(self.scheduled, (time() + delay, next(self.tiebreak), device.socket, packet, addr))
+        else:
+            self.sendto(device.socket, packet, addr)
+
+    def send_due(self, now):
+        while self.scheduled and self.scheduled[0][0] <= now:
+            (send_time, tiebreak, sock, packet, addr) = heapq.heappop(self.scheduled)
+            self.sendto(sock, packet, addr)
+
+    def sendto(self, sock, packet, addr):
+        try:
+            sock.sendto(packet, addr)
+        except error: # the client went away, or its buffer is full: a lost packet
+            pass
+
+    # Totals over all devices
+    def get_stats(self):
+        stats = {"received": 0, "lost": 0, "throttled": 0, "sent": 0}
+        for device in self.devices:
+            for key in stats:
+                stats[key] += getattr(device, key)
+        return stats
+
+################################################################################
+#                                                                              #
+#                               Virtual Devices                                #
+#                                                                              #
+################################################################################
+
+# Each message type is handled by the handle_<message class name> method, if
+# the device has one; it updates the state and returns the replies, as a list
+# of (message class, payload). The emulator only sends them for Get messages
+# and for Sets that asked for a response. Messages without a handler are only
+# acked (if asked).
+
+class EmulatedDevice(object):
+    vendor = 1
+    product = 22 # LIFX Color 1000
+
+    def __init__(self, mac_addr, label=None, firmware=(3, 70), location="Home", group="Emulated"):
+        self.mac_addr = mac_addr
+        self.label = label if label != None else "Emulated " + mac_addr[-8:]
+        self.firmware = firmware # (major, minor)
+        self.power_level = 65535
+        self.location = (location, self.random_id(), 0)
+        self.group = (group, self.random_id(), 0)
+        self.started = time()
+        self.socket = None # set by Emulator.add_device
+        self.port = None
+        self.bucket = None
+        self.received = 0 # packets addressed to the device, including the lost and throttled ones
+        self.lost = 0 # packets lost, both ways
+        self.throttled = 0 # packets dropped by the rate limit
+        self.sent = 0
+
+    def random_id(self):
+        return [random.randrange(256) for i in range(16)]
+
+    def handle(self, message):
+        handler = getattr(self, "handle_" + type(message).__name__, None)
+        if handler == None:
+            return []
+        return handler(message)
+
+    def firmware_version(self):
+        return self.firmware[0] << 16 | self.firmware[1]
+
+    def handle_GetService(self, message):
+        return [(StateService, {"service": 1, "port": self.port})]
+
+    def handle_GetHostInfo(self, message):
+        return [(StateHostInfo, {"signal": 0.0, "tx": 0, "rx": 0, "reserved1": 0})]
+
+    def handle_GetHostFirmware(self, message):
+        return [(StateHostFirmware, {"build": int(self.started * 1e9), "reserved1": 0, "version": self.firmware_version()})]
+
+    def handle_GetWifiInfo(self, message):
+        return [(StateWifiInfo, {"signal": 1e-5, "tx": 0, "rx": 0, "reserved1": 0})]
+
+    def handle_GetWifiFirmware(self, message):
+        return [(StateWifiFirmware, {"build": int(self.started * 1e9), "reserved1": 0, "version": self.firmware_version()})]
+
+    def handle_GetPower(self, message):
+        return [(StatePower, {"power_level": self.power_level})]
+
+    def handle_SetPower(self, message):
+        self.power_level = message.power_level
+        return self.handle_GetPower(message)
+
+    def handle_GetLabel(self, message):
+        return [(StateLabel, {"label": self.label})]
+
+    def handle_SetLabel(self, message):
+        self.label = decode_label(message.label)
+        return self.handle_GetLabel(message)
+
+    def handle_GetVersion(self, message):
+        return [(StateVersion, {"vendor": self.vendor, "product": self.product, "version": 0})]
+
+    def handle_GetInfo(self, message):
+        now = time()
+        return [(StateInfo, {"time": int(now * 1e9), "uptime": int((now - self.started) * 1e9), "downtime": 0})]
+
+    def handle_GetLocation(self, message):
+        (label, location_id, updated_at) = self.location
+        return [(StateLocation, {"location": location_id, "label": label, "updated_at": updated_at})]
+
+    def handle_GetGroup(self, message):
+        (label, group_id, updated_at) = self.group
+        return [(StateGroup, {"group": group_id, "label": label, "updated_at": updated_at})]
+
+    def handle_EchoRequest(self, message):
+        return [(EchoResponse, {"byte_array": message.byte_array})]
+
+class EmulatedLight(EmulatedDevice):
+    def __init__(self, mac_addr, color=(0, 0, 65535, 3500), **kwargs):
+        super(EmulatedLight, self).__init__(mac_addr, **kwargs)
+        self.color = tuple(color)
+        self.infrared_brightness = 0
+
+    def get_color(self):
+        return self.color
+
+    def set_color(self, color):
+        self.color = tuple(color)
+
+    def handle_LightGet(self, message):
+        return [(LightState, {"color": self.get_color(), "reserved1": 0, "power_level": self.power_level, "label": self.label, "reserved2": 0})]
+
+    def handle_LightSetColor(self, message):
+        self.set_color(message.color)
+        return self.handle_LightGet(message)
+
+    def handle_LightSetWaveform(self, message):
+        self.set_color(message.color)
+        return self.handle_LightGet(message)
+
+    def handle_LightGetPower(self, message):
+        return [(LightStatePower, {"power_level": self.power_level})]
+
+    def handle_LightSetPower(self, message):
+        self.power_level = message.power_level
+        return self.handle_LightGetPower(message)
+
+    def handle_LightGetInfrared(self, message):
+        return [(LightStateInfrared, {"infrared_brightness": self.infrared_brightness})]
+
+    def handle_LightSetInfrared(self, message):
+        self.infrared_brightness = message.infrared_brightness
+        return self.handle_LightGetInfrared(message)
+
+# A strip of zone_count zones. With extended (firmware 2.77 or newer), it also
+# answers the extended multizone messages, like a LIFX Z with recent firmware.
+class EmulatedMultiZoneLight(EmulatedLight):
+    product = 32 # LIFX Z 2
+
+    def __init__(self, mac_addr, zone_count=16, extended=True, **kwargs):
+        kwargs.setdefault("firmware", (2, 80) if extended else (2, 60))
+        super(EmulatedMultiZoneLight, self).__init__(mac_addr, **kwargs)
+        self.zones = [self.color] * zone_count
+        self.pending_zones = {} # zone -> color, set with apply=0 (NO_APPLY)
+        self.extended = extended
+        self.effect = {"instanceid": 0, "type": 0, "reserved1": 0, "speed": 0, "duration": 0, "reserved2": 0, "reserved3": 0, "parameters": [0] * 8}
+
+    def get_color(self):
+        return self.zones[0]
+
+    def set_color(self, color):
+        self.zones = [tuple(color)] * len(self.zones)
+
+    def zone_replies(self, start_index, end_index):
+        end_index = min(end_index, len(self.zones) - 1)
+        if start_index > end_index:
+            return []
+        if start_index == end_index:
+            return [(MultiZoneStateZone, {"count": len(self.zones), "index": start_index, "color": self.zones[start_index]})]
+        return [(MultiZoneStateMultiZone, {"count": len(self.zones), "index": i, "color": self.zones[i:i+8]})
+                for i in range(start_index, end_index + 1, 8)]
+
+    def handle_MultiZoneGetColorZones(self, message):
+        return self.zone_replies(message.start_index, message.end_index)
+
+    # apply: 0 keeps the colors until a message with apply=1 (which applies
+    # them along with its own), 2 applies the kept colors and ignores its own
+    def handle_MultiZoneSetColorZones(self, message):
+        if message.apply != 2:
+            for zone in range(message.start_index, min(message.end_index, len(self.zones) - 1) + 1):
+                self.pending_zones[zone] = tuple(message.color)
+        if message.apply != 0:
+            for (zone, color) in self.pending_zones.items():
+                self.zones[zone] = color
+            self.pending_zones = {}
+        return self.zone_replies(message.start_index, message.end_index)
+
+    def handle_GetMultiZoneEffect(self, message):
+        return [(StateMultiZoneEffect, dict(self.effect))]
+
+    def handle_SetMultiZoneEffect(self, message):
+        self.effect = {"instanceid": message.instanceid, "type": message.effect_type, "reserved1": 0, "speed": message.speed,
+                       "duration": message.duration, "reserved2": 0, "reserved3": 0, "parameters": list(message.parameters)}
+        return self.handle_GetMultiZoneEffect(message)
+
+    def extended_replies(self):
+        return [(MultiZoneStateExtendedColorZones, {"zones_count": len(self.zones), "zone_index": i,
+                                                     "colors_count": len(self.zones[i:i+82]), "colors": self.zones[i:i+82]})
+                for i in range(0, len(self.zones), 82)]
+
+    def handle_MultiZoneGetExtendedColorZones(self, message):
+        return self.extended_replies() if self.extended else []
+
+    def handle_MultiZoneSetExtendedColorZones(self, message):
+        if not self.extended:
+            return []
+        for i in range(message.colors_count):
+            zone = message.zone_index + i
+            if zone < len(self.zones):
+                self.zones[zone] = tuple(message.colors[i])
+        return self.extended_replies()
+
+# A chain of 8x8 tiles; tile_positions are their (user_x, user_y), in tile
+# widths, a horizontal row of five by default.
+class EmulatedTileChain(EmulatedLight):
+    product = 55 # LIFX Tile
+
+    def __init__(self, mac_addr, tile_positions=None, **kwargs):
+        super(EmulatedTileChain, self).__init__(mac_addr, **kwargs)
+        if tile_positions == None:
+            tile_positions = [(float(x), 0.0) for x in range(5)]
+        self.tiles = [{"user_x": float(x), "user_y": float(y), "width": 8, "height": 8, "colors": [self.color] * 64}
+                      for (x, y) in tile_positions[:16]]
+        self.effect = {"instanceid": 0, "type": 0, "speed": 0, "duration": 0, "parameters": [0] * 8, "palette": []}
+
+    def get_color(self):
+        return self.tiles[0]["colors"][0] if self.tiles else self.color
+
+    def set_color(self, color):
+        self.color = tuple(color)
+        for tile in self.tiles:
+            tile["colors"] = [self.color] * (tile["width"] * tile["height"])
+
+    def handle_GetDeviceChain(self, message):
+        tile_devices = [{"reserved1": 0, "reserved2": 0, "reserved3": 0, "reserved4": 0,
+                         "user_x": tile["user_x"], "user_y": tile["user_y"], "width": tile["width"], "height": tile["height"],
+                         "reserved5": 0, "device_version_vendor": self.vendor, "device_version_product": self.product,
+                         "device_version_version": 0, "firmware_build": 0, "reserved6": 0,
+                         "firmware_version": self.firmware_version(), "reserved7": 0}
+                        for tile in self.tiles]
+        return [(StateDeviceChain, {"start_index": 0, "tile_devices": tile_devices, "total_count": len(self.tiles)})]
+
+    def handle_SetUserPosition(self, message):
+        if message.tile_index < len(self.tiles):
+            self.tiles[message.tile_index]["user_x"] = message.user_x
+            self.tiles[message.tile_index]["user_y"] = message.user_y
+        return []
+
+    # Indices in a tile's colors of the 64 colors of the rectangle starting at
+    # x, y that is width wide, None outside the tile
+    def rectangle(self, tile, x, y, width):
+        width = max(width, 1)
+        indices = []
+        for i in range(64):
+            (column, row) = (x + i % width, y + i // width)
+            indices.append(row * tile["width"] + column if column < tile["width"] and row < tile["height"] else None)
+        return indices
+
+    def tile_replies(self, tile_index, length, x, y, width):
+        replies = []
+        for tile_index in range(tile_index, min(tile_index + length, len(self.tiles))):
+            tile = self.tiles[tile_index]
+            colors = [tile["colors"][i] if i != None else (0, 0, 0, 0) for i in self.rectangle(tile, x, y, width)]
+            replies.append((StateTileState64, {"tile_index": tile_index, "reserved": 0, "x": x, "y": y, "width": width, "colors": colors}))
+        return replies
+
+    def handle_GetTileState64(self, message):
+        return self.tile_replies(message.tile_index, message.length, message.x, message.y, message.width)
+
+    def handle_SetTileState64(self, message):
+        for tile in self.tiles[message.tile_index:message.tile_index + message.length]:
+            for (i, color) in zip(self.rectangle(tile, message.x, message.y, message.width), message.colors):
+                if i != None:
+                    tile["colors"][i] = tuple(color)
+        return self.tile_replies(message.tile_index, message.length, message.x, message.y, message.width)
+
+    def handle_GetTileEffect(self, message):
+        effect = self.effect
+        return [(StateTileEffect, {"reserved1": 0, "instanceid": effect["instanceid"], "type": effect["type"], "speed": effect["speed"],
+                                   "duration": effect["duration"], "reserved2": 0, "reserved3": 0, "parameters": effect["parameters"],
+                                   "palette_count": len(effect["palette"]), "palette": effect["palette"]})]
+
+    def handle_SetTileEffect(self, message):
+        self.effect = {"instanceid": message.instanceid, "type": message.effect_type, "speed": message.speed, "duration": message.duration,
+                       "parameters": list(message.parameters), "palette": [tuple(c) for c in message.palette[:message.palette_count]]}
+        return self.handle_GetTileEffect(message)
+
+def decode_label(label):
+    if isinstance(label, (bytes, bytearray)):
+        return bytes(label).rstrip(b"\0").decode("utf-8", "replace")
+    return label
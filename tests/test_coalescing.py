@@ -0,0 +1,51 @@
+# coding=utf-8
+# test_coalescing.py
+# Latest-wins writes (writequeue.py, Device.req_with_ack_coalesced) against
+# the emulator.
+#
+# Usage: python -m pytest tests
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from lifxlan import Light, MultiZoneLight
+from lifxlan.msgtypes import Acknowledgement, LightSetColor, MultiZoneSetColorZones
+from emulator import EmulatedLight, EmulatedMultiZoneLight, connect, emulated_mac
+
+COLORS = [(i, 65535, 65535, 3500) for i in range(10)]
+
+
+# While the first write waits for its ack, each newer one replaces the one
+# waiting behind it: only the first and the last are sent.
+def test_writes_coalesce_to_the_latest(emulator, transport):
+    emulated = EmulatedLight(emulated_mac(1))
+    emulator(emulated, latency=0.1)
+    light = connect(Light, emulated, transport)
+    futures = [light.req_with_ack_coalesced_future(LightSetColor, {"color": color, "duration": 0}) for color in COLORS]
+    assert len(light.write_queue) == 1
+    for future in futures:
+        assert type(future.result()) == Acknowledgement
+    assert light.get_send_stats()["elided"] == len(COLORS) - 2
+    assert light.stats.for_message(LightSetColor).sent == 2
+    assert emulated.received == 2
+    assert emulated.color == COLORS[-1]
+
+
+# Writes only replace writes with the same key, e.g. to the same zones
+def test_writes_to_other_zones_are_kept(emulator, transport):
+    emulated = EmulatedMultiZoneLight(emulated_mac(1), zone_count=16)
+    emulator(emulated, latency=0.1)
+    strip = connect(MultiZoneLight, emulated, transport)
+    ranges = [(0, 3), (4, 7), (8, 11)]
+    futures = []
+    for color in COLORS[:4]:
+        for (start, end) in ranges:
+            payload = {"start_index": start, "end_index": end, "color": color, "duration": 0, "apply": 1}
+            futures.append(strip.req_with_ack_coalesced_future(MultiZoneSetColorZones, payload, (start, end)))
+    for future in futures:
+        future.result()
+    assert strip.get_send_stats()["elided"] == len(ranges) * 2
+    assert emulated.received == len(ranges) * 2
+    assert emulated.zones[:12] == [COLORS[3]] * 12
@@ -0,0 +1,73 @@
+# coding=utf-8
+# test_group.py
+# Group against the emulator: a device that doesn't answer doesn't stop the
+# others, and its error is kept in Group.errors.
+#
+# Usage: python -m pytest tests
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from lifxlan import Group, Light, MultiZoneLight, WorkflowException
+from emulator import EMULATOR_IP_ADDR, EmulatedLight, EmulatedMultiZoneLight, connect, emulated_mac
+
+COLOR = (1000, 65535, 32768, 3500)
+MISSING_MAC = emulated_mac(99)
+
+
+# Two emulated lights and, between them, one that isn't there
+def group_with_a_missing_light(emulator, transport, device_class=Light, emulated_class=EmulatedLight):
+    emulated = [emulated_class(emulated_mac(1)), emulated_class(emulated_mac(2))]
+    running = emulator(*emulated)
+    missing = device_class(MISSING_MAC, EMULATOR_IP_ADDR, port=running.port, transport=transport)
+    missing.product = emulated[0].product # so only the Sets go unanswered
+    lights = [connect(device_class, e, transport) for e in emulated]
+    return (emulated, Group([lights[0], missing, lights[1]]))
+
+
+def check_errors(group):
+    assert len(group.errors) == 1
+    assert isinstance(group.errors[0], WorkflowException)
+    assert MISSING_MAC in str(group.errors[0])
+
+
+def test_set_color_carries_on_past_a_missing_light(emulator, transport):
+    (emulated, group) = group_with_a_missing_light(emulator, transport)
+    group.set_color(COLOR)
+    assert [e.color for e in emulated] == [COLOR, COLOR]
+    check_errors(group)
+    group.set_color(COLOR)
+    check_errors(group) # each call starts afresh
+
+
+# A light that doesn't tell its current color is left out of set_brightness
+def test_set_brightness_carries_on_past_a_missing_light(emulator, transport):
+    (emulated, group) = group_with_a_missing_light(emulator, transport)
+    group.set_brightness(1234)
+    assert [e.color[2] for e in emulated] == [1234, 1234]
+    check_errors(group)
+
+
+def test_set_power_carries_on_past_a_light_of_unknown_version(emulator, transport):
+    (emulated, group) = group_with_a_missing_light(emulator, transport)
+    group.devices[1].product = None
+    group.set_power(0)
+    assert [e.power_level for e in emulated] == [0, 0]
+    check_errors(group)
+
+
+def test_set_zone_colors_carries_on_past_a_missing_strip(emulator, transport):
+    (emulated, group) = group_with_a_missing_light(emulator, transport, MultiZoneLight, EmulatedMultiZoneLight)
+    colors = [(i, 65535, 65535, 3500) for i in range(16)]
+    group.set_zone_colors(colors)
+    assert [e.zones for e in emulated] == [colors, colors]
+    check_errors(group)
+
+
+def test_no_errors(emulator, transport):
+    (emulated, group) = group_with_a_missing_light(emulator, transport)
+    group.remove_device(group.devices[1])
+    group.set_color(COLOR)
+    assert group.errors == []
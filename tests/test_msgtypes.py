@@ -0,0 +1,211 @@
+# coding=utf-8
+# test_msgtypes.py
+# Packs every message type and compares the bytes with msgtypes_golden.json,
+# then unpacks them again, eagerly and with lazy=True, and checks every field
+# comes back.
+#
+# The golden bytes come from the original bitstring packer, except for the
+# extended multizone messages, which it didn't have, and for StateHostInfo and
+# StateWifiInfo, whose signal it packed as an integer instead of the float32
+# the protocol (and unpack) has. The other bytes the schemas pack differently
+# are checked below, not in the golden file:
+#   - a label is 32 bytes once encoded: the bitstring packer padded it to 32
+#     characters, so a non-ASCII one overflowed the field, and it didn't
+#     truncate one that was too long
+#   - a fixed size array given fewer elements (MultiZoneStateMultiZone colors,
+#     SetMultiZoneEffect parameters, SetTileState64 colors...) is zero padded
+#     to its full size, the bitstring packer sent a short payload
+#
+# Usage: python -m pytest tests
+
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from lifxlan.message import HEADER_SIZE_BYTES
+from lifxlan.msgtypes import *
+from lifxlan.unpack import unpack_lifx_message
+
+GOLDEN_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "msgtypes_golden.json")
+
+MAC = "d0:73:d5:12:34:56"
+SOURCE_ID = 0x1234abcd
+FLAGS = [(False, False), (True, False), (False, True)] # (ack_requested, response_requested)
+COLOR = (100, 200, 300, 3500)
+TILE = {"reserved1": 0, "reserved2": 0, "reserved3": 0, "reserved4": 0, "user_x": 1.5, "user_y": -0.5,
+        "width": 8, "height": 8, "reserved5": 0, "device_version_vendor": 1, "device_version_product": 55,
+        "device_version_version": 10, "firmware_build": 123456789, "reserved6": 0, "firmware_version": 3 << 16 | 50, "reserved7": 0}
+
+# (message type, payload), one per type, in the order of the golden file.
+# Every type goes with its own sequence number, its index in this list.
+SAMPLES = [
+    (GetService, {}),
+    (StateService, {"service": 1, "port": 56700}),
+    (GetHostInfo, {}),
+    (StateHostInfo, {"signal": 3, "tx": 10, "rx": 20, "reserved1": 0}),
+    (GetHostFirmware, {}),
+    (StateHostFirmware, {"build": 1500000000000000000, "reserved1": 0, "version": 2 << 16 | 77}),
+    (GetWifiInfo, {}),
+    (StateWifiInfo, {"signal": 3, "tx": 10, "rx": 20, "reserved1": 0}),
+    (GetWifiFirmware, {}),
+    (StateWifiFirmware, {"build": 1500000000000000000, "reserved1": 0, "version": 1 << 16 | 2}),
+    (GetPower, {}),
+    (SetPower, {"power_level": 65535}),
+    (StatePower, {"power_level": 65535}),
+    (GetLabel, {}),
+    (SetLabel, {"label": "Kitchen"}),
+    (StateLabel, {"label": "Kitchen strip"}),
+    (GetVersion, {}),
+    (StateVersion, {"vendor": 1, "product": 32, "version": 0}),
+    (GetInfo, {}),
+    (StateInfo, {"time": 10**18, "uptime": 10**12, "downtime": 5 * 10**9}),
+    (GetLocation, {}),
+    (StateLocation, {"location": list(range(16)), "label": "Home", "updated_at": 10**18}),
+    (GetGroup, {}),
+    (StateGroup, {"group": list(range(16, 32)), "label": "Living", "updated_at": 10**18}),
+    (Acknowledgement, {}),
+    (EchoRequest, {"byte_array": [1, 2, 3]}),
+    (EchoResponse, {"byte_array": list(range(64))}),
+    (LightGet, {}),
+    (LightSetColor, {"color": COLOR, "duration": 500}),
+    (LightSetWaveform, {"transient": 1, "color": COLOR, "period": 1000, "cycles": 2.5, "duty_cycle": -100, "waveform": 3}),
+    (LightState, {"color": COLOR, "reserved1": 0, "power_level": 65535, "label": "Desk", "reserved2": 0}),
+    (LightGetPower, {}),
+    (LightSetPower, {"power_level": 0, "duration": 200}),
+    (LightStatePower, {"power_level": 0}),
+    (LightGetInfrared, {}),
+    (LightStateInfrared, {"infrared_brightness": 123}),
+    (LightSetInfrared, {"infrared_brightness": 456}),
+    (MultiZoneSetColorZones, {"start_index": 3, "end_index": 9, "color": COLOR, "duration": 500, "apply": 1}),
+    (MultiZoneGetColorZones, {"start_index": 0, "end_index": 255}),
+    (MultiZoneStateZone, {"count": 16, "index": 2, "color": COLOR}),
+    (MultiZoneStateMultiZone, {"count": 82, "index": 8, "color": [(i, i + 1, i + 2, 3500) for i in range(8)]}),
+    (GetMultiZoneEffect, {}),
+    (SetMultiZoneEffect, {"instanceid": 7, "type": 1, "reserved1": 0, "speed": 3000, "duration": 0, "reserved2": 0, "reserved3": 0, "parameters": [0, 1, 0, 0, 0, 0, 0, 0]}),
+    (StateMultiZoneEffect, {"instanceid": 7, "type": 1, "reserved1": 0, "speed": 3000, "duration": 0, "reserved2": 0, "reserved3": 0, "parameters": [0, 1, 0, 0, 0, 0, 0, 0]}),
+    (GetDeviceChain, {}),
+    (StateDeviceChain, {"start_index": 0, "total_count": 5, "tile_devices": [dict(TILE, user_x=float(i)) for i in range(16)]}),
+    (SetUserPosition, {"tile_index": 1, "reserved": 0, "user_x": 1.0, "user_y": -1.5}),
+    (GetTileState64, {"tile_index": 0, "length": 1, "reserved": 0, "x": 0, "y": 0, "width": 8}),
+    (StateTileState64, {"tile_index": 2, "reserved": 0, "x": 0, "y": 0, "width": 8, "colors": [(i, i * 2, i * 3, 3500) for i in range(64)]}),
+    (SetTileState64, {"tile_index": 2, "length": 1, "reserved": 0, "x": 0, "y": 0, "width": 8, "duration": 100, "colors": [(i, i * 2, i * 3, 3500) for i in range(64)]}),
+    (GetTileEffect, {}),
+    (SetTileEffect, {"reserved1": 0, "reserved2": 0, "instanceid": 1, "type": 2, "speed": 3000, "duration": 0, "reserved3": 0, "reserved4": 0, "parameters": [0] * 8, "palette_count": 3, "palette": [COLOR, COLOR, COLOR]}),
+    (StateTileEffect, {"reserved1": 0, "instanceid": 1, "type": 2, "speed": 3000, "duration": 0, "reserved2": 0, "reserved3": 0, "parameters": [0] * 8, "palette_count": 2, "palette": [COLOR, COLOR]}),
+    (MultiZoneSetExtendedColorZones, {"duration": 500, "apply": 1, "zone_index": 82, "colors_count": 3, "colors": [COLOR] * 3}),
+    (MultiZoneGetExtendedColorZones, {}),
+    (MultiZoneStateExtendedColorZones, {"zones_count": 120, "zone_index": 82, "colors_count": 38, "colors": [(i, i, i, 3500) for i in range(38)]}),
+]
+
+SAMPLE_IDS = [msg_type.__name__ for (msg_type, payload) in SAMPLES]
+
+# the effect messages keep their "type" payload key as effect_type
+ATTRIBUTE_NAMES = {"type": "effect_type"}
+
+
+def build(index, ack_requested=False, response_requested=False):
+    (msg_type, payload) = SAMPLES[index]
+    return msg_type(MAC, SOURCE_ID, index, payload, ack_requested, response_requested)
+
+
+def pack(index, ack_requested=False, response_requested=False):
+    return build(index, ack_requested, response_requested).packed_message
+
+
+# lists and tuples compare alike, floats to the precision of a float32
+def normalize(value):
+    if isinstance(value, (list, tuple)):
+        return [normalize(v) for v in value]
+    if isinstance(value, dict):
+        return {k: normalize(v) for (k, v) in value.items()}
+    if isinstance(value, float):
+        return round(value, 4)
+    if isinstance(value, bytes):
+        return value.rstrip(b"\x00").decode("utf-8")
+    return value
+
+
+def is_zero(value):
+    return value == 0 or (isinstance(value, list) and all(is_zero(v) for v in value))
+
+
+# fixed size arrays come back zero padded, compare them without the padding
+def unpad(value):
+    if not isinstance(value, list):
+        return value
+    end = len(value)
+    while end > 0 and is_zero(value[end-1]):
+        end -= 1
+    return value[:end]
+
+
+@pytest.fixture(scope="module")
+def golden():
+    with open(GOLDEN_FILE) as f:
+        return json.load(f)
+
+
+def test_every_message_type_has_a_sample():
+    sampled = set(msg_type for (msg_type, payload) in SAMPLES)
+    assert [msg_type.__name__ for msg_type in MSG_IDS if msg_type not in sampled] == []
+
+
+@pytest.mark.parametrize("index", range(len(SAMPLES)), ids=SAMPLE_IDS)
+def test_pack_matches_golden_bytes(golden, index):
+    expected = golden[SAMPLE_IDS[index]]
+    for (i, (ack_requested, response_requested)) in enumerate(FLAGS):
+        assert pack(index, ack_requested, response_requested).hex() == expected[i]
+
+
+@pytest.mark.parametrize("label", ["Küche", "é" * 20, "x" * 40])
+def test_label_fills_32_bytes(label):
+    packed = SetLabel(MAC, SOURCE_ID, 0, {"label": label}).packed_message
+    assert len(packed) == HEADER_SIZE_BYTES + 32
+    assert packed[HEADER_SIZE_BYTES:] == label.encode("utf-8")[:32].ljust(32, b"\x00")
+
+
+# (message type, array field, elements given)
+SHORT_ARRAYS = [
+    (MultiZoneStateMultiZone, "color", 3),
+    (SetMultiZoneEffect, "parameters", 2),
+    (SetTileState64, "colors", 10),
+]
+
+@pytest.mark.parametrize("msg_type, field, count", SHORT_ARRAYS, ids=[t.__name__ for (t, f, c) in SHORT_ARRAYS])
+def test_short_array_is_zero_padded(msg_type, field, count):
+    index = [t for (t, p) in SAMPLES].index(msg_type)
+    full = dict(SAMPLES[index][1])
+    short = dict(full, **{field: full[field][:count]})
+    zero = (0, 0, 0, 0) if isinstance(full[field][0], tuple) else 0
+    padded = dict(full, **{field: full[field][:count] + [zero] * (len(full[field]) - count)})
+    packed = msg_type(MAC, SOURCE_ID, 0, short).packed_message
+    assert packed == msg_type(MAC, SOURCE_ID, 0, padded).packed_message
+    assert len(packed) == len(msg_type(MAC, SOURCE_ID, 0, full).packed_message)
+
+
+@pytest.mark.parametrize("lazy", [False, True], ids=["eager", "lazy"])
+@pytest.mark.parametrize("index", range(len(SAMPLES)), ids=SAMPLE_IDS)
+def test_unpack_round_trip(index, lazy):
+    (msg_type, payload) = SAMPLES[index]
+    sent = build(index, response_requested=True)
+    packed = sent.packed_message
+    message = unpack_lifx_message(packed, lazy=lazy)
+    assert type(message) == msg_type
+    assert (message.target_addr, message.source_id, message.seq_num) == (sent.target_addr, SOURCE_ID, index)
+    assert (message.ack_requested, message.response_requested) == (0, 1)
+    assert message.size == len(packed) >= HEADER_SIZE_BYTES
+    assert message.packed_message == packed
+    for (key, value) in payload.items():
+        if key.startswith("reserved"):
+            continue
+        assert unpad(normalize(getattr(message, ATTRIBUTE_NAMES.get(key, key)))) == unpad(normalize(value)), key
+
+
+@pytest.mark.parametrize("index", range(len(SAMPLES)), ids=SAMPLE_IDS)
+def test_lazy_message_prints_like_eager(index):
+    packed = pack(index)
+    assert str(unpack_lifx_message(packed, lazy=True)) == str(unpack_lifx_message(packed))
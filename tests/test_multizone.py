@@ -0,0 +1,39 @@
+# coding=utf-8
+# test_multizone.py
+# MultiZoneLight zone reads against the emulator.
+#
+# Usage: python -m pytest tests
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from lifxlan import MultiZoneLight
+from lifxlan.msgtypes import MultiZoneGetColorZones, MultiZoneGetExtendedColorZones
+from emulator import EmulatedMultiZoneLight, connect, emulated_mac
+
+
+def strip(emulator, transport, zone_count, extended):
+    emulated = EmulatedMultiZoneLight(emulated_mac(1), zone_count=zone_count, extended=extended)
+    emulated.zones = [(i, 65535, 65535, 3500) for i in range(zone_count)]
+    emulator(emulated)
+    return (emulated, connect(MultiZoneLight, emulated, transport))
+
+
+def test_extended_read(emulator, transport):
+    (emulated, light) = strip(emulator, transport, 120, extended=True)
+    assert light.get_extended_color_zones() == emulated.zones
+    assert light.get_extended_color_zones(80, 90) == emulated.zones[80:90]
+    assert light.stats.for_message(MultiZoneGetExtendedColorZones).sent == 2
+    assert light.stats.for_message(MultiZoneGetColorZones).sent == 0
+
+
+# Older firmware doesn't answer the extended messages: the zones are read
+# with GetColorZones instead
+def test_extended_read_falls_back_without_support(emulator, transport):
+    (emulated, light) = strip(emulator, transport, 16, extended=False)
+    assert light.get_extended_color_zones() == emulated.zones
+    assert light.get_extended_color_zones(4, 8) == emulated.zones[4:8]
+    assert light.stats.for_message(MultiZoneGetExtendedColorZones).sent == 0
+    assert light.supports_extended_multizone() == False
@@ -0,0 +1,110 @@
+# coding=utf-8
+# test_pacing.py
+# The per-device token bucket of the transport (see transport.py) against the
+# emulator, whose devices drop what comes in faster than the firmware takes.
+#
+# Usage: python -m pytest tests
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from lifxlan import Light, MultiZoneLight
+from lifxlan.msgtypes import EchoRequest, EchoResponse
+from lifxlan.transport import DEFAULT_BURST, DEFAULT_RATE_LIMIT, MAX_QUEUED_PACKETS
+from emulator import EmulatedLight, EmulatedMultiZoneLight, connect, emulated_mac, wait_until
+
+
+# Notes when each echo request arrives
+class TimedLight(EmulatedLight):
+    def __init__(self, mac_addr, **kwargs):
+        super(TimedLight, self).__init__(mac_addr, **kwargs)
+        self.echo_times = []
+
+    def handle_EchoRequest(self, message):
+        self.echo_times.append(time.monotonic())
+        return super(TimedLight, self).handle_EchoRequest(message)
+
+
+def echoes(light, count):
+    light.max_in_flight = None
+    futures = [light.req_with_resp_future(EchoRequest, EchoResponse, {"byte_array": [i]}) for i in range(count)]
+    return [future.result().byte_array[0] for future in futures]
+
+
+# A burst goes out back to back, the rest at the rate limit, and the device
+# doesn't drop any of it.
+def test_requests_are_paced(emulator, transport):
+    emulated = TimedLight(emulated_mac(1))
+    emulator(emulated, burst=DEFAULT_BURST + 1) # room for a packet the scheduler delayed into the next
+    light = connect(Light, emulated, transport)
+    assert echoes(light, 15) == list(range(15))
+    assert emulated.throttled == 0
+    times = emulated.echo_times
+    assert times[DEFAULT_BURST - 1] - times[0] < 0.5 / DEFAULT_RATE_LIMIT
+    gaps = [b - a for (a, b) in zip(times[DEFAULT_BURST:], times[DEFAULT_BURST+1:])]
+    assert min(gaps) > 0.8 / DEFAULT_RATE_LIMIT
+    stats = light.get_send_stats()
+    assert (stats["sent"], stats["throttled"]) == (15, 15 - DEFAULT_BURST)
+
+
+def test_unpaced_requests_are_dropped_by_the_device(emulator, transport):
+    emulated = TimedLight(emulated_mac(1))
+    emulator(emulated)
+    light = connect(Light, emulated, transport)
+    light.set_rate_limit(None)
+    echoes(light, 15)
+    assert emulated.throttled > 0
+    assert light.stats.for_message(EchoRequest).retransmits > 0
+
+
+# Rapid writes of the same thing don't queue up behind the rate limit: the
+# newest one takes the place of the one waiting.
+def test_rapid_writes_supersede_the_queued_one(emulator, transport):
+    emulated = EmulatedLight(emulated_mac(1))
+    emulator(emulated, rate_limit=None)
+    light = connect(Light, emulated, transport)
+    colors = [(i, 65535, 65535, 3500) for i in range(30)]
+    for color in colors:
+        light.set_color(color, rapid=True)
+    stats = light.get_send_stats()
+    assert stats["max_queued"] == 1
+    assert stats["superseded"] == len(colors) - DEFAULT_BURST - 1
+    wait_until(lambda: emulated.color == colors[-1])
+    assert emulated.received == DEFAULT_BURST + 1
+
+
+# Rapid writes that all differ wait, up to MAX_QUEUED_PACKETS of them; the
+# oldest are dropped beyond that.
+def test_rapid_writes_queue_is_bounded(emulator, transport):
+    emulated = EmulatedMultiZoneLight(emulated_mac(1), zone_count=64)
+    emulator(emulated, rate_limit=None)
+    strip = connect(MultiZoneLight, emulated, transport)
+    strip.set_rate_limit(2 * DEFAULT_RATE_LIMIT) # the queue drains before the packets expire
+    color = (1, 2, 3, 4)
+    count = DEFAULT_BURST + MAX_QUEUED_PACKETS + 10
+    for zone in range(count):
+        strip.set_zone_color(zone, zone, color, rapid=True)
+    stats = strip.get_send_stats()
+    assert stats["max_queued"] == MAX_QUEUED_PACKETS
+    assert stats["dropped"] > 0
+    wait_until(lambda: emulated.received == count - stats["dropped"], timeout=3)
+    assert strip.get_send_stats()["queued"] == 0
+    assert emulated.zones[count-1] == color
+
+
+# A fire-and-forget packet that waited timeout_secs is dropped, not sent late
+def test_queued_packets_expire(emulator, transport):
+    emulated = TimedLight(emulated_mac(1))
+    emulator(emulated, rate_limit=None)
+    light = connect(Light, emulated, transport)
+    count = DEFAULT_BURST + 10
+    for i in range(count):
+        light.fire_and_forget(EchoRequest, {"byte_array": [i]}, timeout_secs=2.5 / DEFAULT_RATE_LIMIT, num_repeats=1, key=i)
+    wait_until(lambda: light.get_send_stats()["queued"] == 0)
+    stats = light.get_send_stats()
+    assert stats["expired"] > 0
+    wait_until(lambda: emulated.received == count - stats["expired"])
+    assert stats["sent"] == emulated.received < count
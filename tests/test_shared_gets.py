@@ -0,0 +1,51 @@
+# coding=utf-8
+# test_shared_gets.py
+# Gets shared by the device objects of one transport (SharedGets in
+# transport.py), against the emulator.
+#
+# Usage: python -m pytest tests
+
+import os
+import sys
+from threading import Thread
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from lifxlan import MultiZoneLight
+from emulator import EmulatedMultiZoneLight, connect, emulated_mac, wait_until
+
+COLOR = (1, 2, 3, 4)
+
+
+def test_concurrent_reads_share_one_request(emulator, transport):
+    emulated = EmulatedMultiZoneLight(emulated_mac(1), zone_count=16)
+    emulator(emulated, latency=0.1)
+    strips = [connect(MultiZoneLight, emulated, transport) for i in range(4)]
+    results = [None] * len(strips)
+    def read(i):
+        results[i] = strips[i].get_color_zones()
+    threads = [Thread(target=read, args=(i,)) for i in range(len(strips))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [emulated.zones] * len(strips)
+    assert transport.get_send_stats(emulated.mac_addr)["sent"] == 1
+
+
+# A Get that starts after a Set mustn't join one sent before it, whose reply
+# may be the state before the Set.
+def test_get_after_set_does_not_join_earlier_get(emulator, transport):
+    emulated = EmulatedMultiZoneLight(emulated_mac(1), zone_count=16)
+    emulator(emulated, latency=0.2)
+    (a, b) = (connect(MultiZoneLight, emulated, transport), connect(MultiZoneLight, emulated, transport))
+    before = {}
+    reader = Thread(target=lambda: before.update(zones=b.get_color_zones()))
+    reader.start()
+    wait_until(lambda: emulated.received == 1) # the Get got there first
+    a.set_zone_color(0, 3, COLOR, rapid=True)
+    after = a.get_color_zones()
+    reader.join()
+    assert before["zones"][0] != COLOR # the earlier Get still gets its own reply
+    assert after[:4] == [COLOR] * 4
+    assert emulated.zones[:4] == [COLOR] * 4
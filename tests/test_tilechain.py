@@ -0,0 +1,48 @@
+# coding=utf-8
+# test_tilechain.py
+# TileChain against the emulator.
+#
+# Usage: python -m pytest tests
+
+import asyncio
+import os
+import sys
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from lifxlan import LifxLAN, TileChain
+from lifxlan.asynctransport import open_async_transport
+from emulator import EMULATOR_IP_ADDR, EmulatedTileChain, connect, emulated_mac
+
+TILE_POSITIONS = [(0, 0), (1, 0), (1, 1)]
+
+
+def test_reads_tiles_when_created(emulator, transport):
+    emulated = EmulatedTileChain(emulated_mac(1), tile_positions=TILE_POSITIONS)
+    emulator(emulated)
+    chain = connect(TileChain, emulated, transport)
+    assert chain.get_tile_count() == len(TILE_POSITIONS)
+    assert [(tile.user_x, tile.user_y) for tile in chain.get_tile_info()] == TILE_POSITIONS
+    assert chain.get_canvas_dimensions() == (16, 16)
+
+
+# async_make_device reads the tiles of a chain with async requests, none go
+# through the blocking transport
+def test_async_make_device_reads_tiles(emulator, transport):
+    emulated = EmulatedTileChain(emulated_mac(1), tile_positions=TILE_POSITIONS)
+    emulator(emulated)
+    lan = LifxLAN()
+    service = SimpleNamespace(target_addr=emulated.mac_addr, ip_addr=EMULATOR_IP_ADDR, service=1, port=emulated.port)
+    async def make_device():
+        lan.async_transport = await open_async_transport()
+        try:
+            return await lan.async_make_device(service)
+        finally:
+            lan.close()
+    chain = asyncio.run(make_device())
+    assert isinstance(chain, TileChain)
+    assert chain.get_tile_count() == len(TILE_POSITIONS)
+    assert chain.get_canvas_dimensions() == (16, 16)
+    assert chain.tile_map == connect(TileChain, emulated, transport).tile_map
+    assert lan.transport.get_send_stats(emulated.mac_addr)["sent"] == 0
@@ -0,0 +1,147 @@
+# coding=utf-8
+# test_transport.py
+# Transport (transport.py) against the emulator: sequence numbers, re-sends
+# with backoff and the window of requests in flight.
+#
+# Usage: python -m pytest tests
+
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from lifxlan import Light, WorkflowException
+from lifxlan.device import DEFAULT_MAX_IN_FLIGHT
+from lifxlan.msgtypes import EchoRequest, EchoResponse
+from lifxlan.transport import MIN_RTO
+from emulator import EmulatedLight, connect, emulated_mac
+
+
+# An echo of i, whose reply tells which request it answers
+def echo(light, i):
+    return light.req_with_resp_future(EchoRequest, EchoResponse, {"byte_array": [i & 0xff, i >> 8]})
+
+
+def echoed(future):
+    return future.result().byte_array[0] | future.result().byte_array[1] << 8
+
+
+def lights(count, device_class=EmulatedLight):
+    return [device_class(emulated_mac(i + 1)) for i in range(count)]
+
+
+# Lights for the emulated ones, without a rate limit or a limit of requests
+# in flight
+def unpaced(emulator, transport, emulated, **kwargs):
+    emulator(*emulated, rate_limit=None, **kwargs)
+    lights = [connect(Light, e, transport) for e in emulated]
+    for light in lights:
+        transport.set_rate_limit(light.mac_addr, None)
+        light.max_in_flight = None
+    return lights
+
+
+# Sequence numbers are counted per target: requests to one device don't use
+# up the numbers of another, whose pending requests keep theirs.
+def test_seq_nums_dont_collide_across_targets(emulator, transport):
+    (slow, busy) = unpaced(emulator, transport, lights(2), latency=0.2)
+    first = echo(slow, 1)
+    others = [echo(busy, i) for i in range(255)]
+    second = echo(slow, 2)
+    assert (echoed(first), echoed(second)) == (1, 2)
+    assert [echoed(future) for future in others] == list(range(255))
+
+
+# A request never takes the number of one still pending: with all 256 in use,
+# it fails instead.
+def test_seq_nums_run_out_rather_than_collide(emulator, transport):
+    (light,) = unpaced(emulator, transport, lights(1), latency=0.2)
+    futures = [echo(light, i) for i in range(256)]
+    with transport.lock:
+        assert len(transport.pending) == 256
+    with pytest.raises(WorkflowException):
+        echo(light, 256).result()
+    assert [echoed(future) for future in futures] == list(range(256))
+
+
+# Hears the echo requests but never answers them
+class DeafLight(EmulatedLight):
+    def __init__(self, mac_addr, **kwargs):
+        super(DeafLight, self).__init__(mac_addr, **kwargs)
+        self.echo_times = []
+
+    def handle_EchoRequest(self, message):
+        self.echo_times.append(time.monotonic())
+        return []
+
+
+def test_requests_get_through_loss(emulator, transport):
+    (light,) = unpaced(emulator, transport, lights(1), loss=0.1, seed=1)
+    futures = [light.req_with_resp_future(EchoRequest, EchoResponse, {"byte_array": [i]}, timeout_secs=1, max_attempts=5) for i in range(50)]
+    assert [future.result().byte_array[0] for future in futures] == list(range(50))
+    stats = light.stats.for_message(EchoRequest)
+    assert stats.retransmits > 0
+    assert stats.timeouts == 0
+
+
+# Once the RTT is known, an unanswered request is re-sent after the RTO,
+# which doubles every time, until timeout_secs * max_attempts is up.
+def test_retransmits_back_off(emulator, transport):
+    (emulated,) = lights(1, DeafLight)
+    (light,) = unpaced(emulator, transport, [emulated])
+    light.get_power()
+    assert light.rtt.rto == MIN_RTO
+    start = time.monotonic()
+    with pytest.raises(WorkflowException):
+        light.req_with_resp(EchoRequest, EchoResponse, {"byte_array": [1]}, timeout_secs=0.5, max_attempts=2)
+    assert 0.9 < time.monotonic() - start < 1.5
+    gaps = [b - a for (a, b) in zip(emulated.echo_times, emulated.echo_times[1:])]
+    assert len(gaps) >= 3
+    assert gaps[0] >= MIN_RTO * 0.9
+    for (gap, next_gap) in zip(gaps, gaps[1:]):
+        assert next_gap > gap * 1.5
+    stats = light.stats.for_message(EchoRequest)
+    assert (stats.sent, stats.retransmits, stats.timeouts) == (len(gaps) + 1, len(gaps), 1)
+
+
+# Requests that time out together double the RTO once, not once each
+def test_concurrent_timeouts_back_off_once(emulator, transport):
+    (light,) = unpaced(emulator, transport, lights(1, DeafLight))
+    light.get_power()
+    assert light.rtt.rto == MIN_RTO
+    futures = [light.req_with_resp_future(EchoRequest, EchoResponse, {"byte_array": [i]}, timeout_secs=MIN_RTO, max_attempts=1) for i in range(3)]
+    for future in futures:
+        with pytest.raises(WorkflowException):
+            future.result()
+    assert light.rtt.rto == 2 * MIN_RTO
+
+
+# At most max_in_flight requests per device are on the wire, the others wait
+# their turn and go out in order.
+def test_in_flight_window(emulator, transport):
+    (emulated,) = lights(1)
+    (light,) = unpaced(emulator, transport, [emulated], latency=0.1)
+    light.max_in_flight = DEFAULT_MAX_IN_FLIGHT
+    futures = [echo(light, i) for i in range(10)]
+    with transport.lock:
+        assert transport.in_flight[light.mac_addr] == DEFAULT_MAX_IN_FLIGHT
+        assert len(transport.waiting[light.mac_addr]) == 10 - DEFAULT_MAX_IN_FLIGHT
+    time.sleep(0.05)
+    assert emulated.received == DEFAULT_MAX_IN_FLIGHT
+    assert [echoed(future) for future in futures] == list(range(10))
+    assert emulated.received == 10
+    with transport.lock:
+        assert light.mac_addr not in transport.in_flight and len(transport.waiting[light.mac_addr]) == 0
+
+
+def test_in_flight_window_of_one_sends_one_at_a_time(emulator, transport):
+    (emulated,) = lights(1)
+    (light,) = unpaced(emulator, transport, [emulated], latency=0.05)
+    light.max_in_flight = 1
+    start = time.monotonic()
+    futures = [echo(light, i) for i in range(4)]
+    assert [echoed(future) for future in futures] == list(range(4))
+    assert time.monotonic() - start >= 4 * 0.05